@@ -1,12 +1,78 @@
 import openai
+import hashlib
+import json
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from typing import List, Dict
 
+import cache
+import telemetry
+from constants import LLMConfig
+
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # to be called in main
 
+SYSTEM_PROMPT = """You are a running safety expert analyzing route options for runners in NYC.
+                Route options come as compact JSON: "start" is [lat, lng], "target_km" the requested
+                out-and-back distance, and each entry of "routes" has
+                - "id": route number, "dir": compass direction the route heads out in
+                - "km": out-and-back walking distance, "accuracy": how close that is to target_km (percent)
+                - "safety": 0-100, higher is safer; crashes, injuries and deaths along the route over the
+                  last 60 days compared to what is typical for that area
+                - "crashes_per_km": crashes along the route per km (when scored along the whole line)
+                - "dangerous": stretches scoring under 80, each with "at_pct" (how far along the route it
+                  starts, percent), "score", and the "crashes", "injuries" and "deaths" counted there
+                Route length accuracy must also be considered in recommendation.
+                Focus on practical advice that helps runners make informed decisions."""
+
+
+def build_prompt(metadata):
+    """
+    Compact JSON with only what the model reasons about
+
+    Polylines, endpoint coordinates and full segment dicts are dropped and numbers rounded,
+    so the prompt is a fraction of str(metadata) and identical requests produce
+    identical prompts (which is what the response cache keys on).
+    """
+    start = metadata.get("start_location", {})
+    routes = []
+    for route in metadata.get("route_options") or []:
+        analysis = route.get("safety_analysis", {})
+        compact = {
+            "id": route.get("id"),
+            "dir": route.get("direction"),
+            "km": round(route.get("distance", {}).get("total_distance", 0), 2),
+            "accuracy": round(route.get("accuracy", 0), 1),
+            "safety": analysis.get("overall_safety_score"),
+            "dangerous": [
+                {
+                    "at_pct": seg.get("route_progress"),
+                    "score": round(seg.get("safety_score", 0), 1),
+                    "crashes": seg.get("counts", {}).get("total_crashes"),
+                    "injuries": seg.get("counts", {}).get("total_injuries"),
+                    "deaths": seg.get("counts", {}).get("total_fatalities"),
+                }
+                for seg in analysis.get("dangerous_segments", [])
+            ],
+        }
+        corridor = analysis.get("corridor")
+        if corridor and "crashes_per_km" in corridor:
+            compact["crashes_per_km"] = corridor["crashes_per_km"]
+        routes.append(compact)
+
+    prompt = {
+        "start": [round(start.get("lat", 0), 4), round(start.get("lng", 0), 4)],
+        "target_km": round(metadata.get("target_distance_km", 0), 2),
+        "routes": routes,
+    }
+    return json.dumps(prompt, separators=(",", ":"))
+
 
 class SafetyAnalysisAgent:
     def __init__(self):
@@ -14,29 +80,96 @@ class SafetyAnalysisAgent:
         if not api_key:
             raise ValueError("OPENAI_API_KEY not found in .env file")
         self.client = openai.OpenAI(api_key=api_key)
+        self.async_client = openai.AsyncOpenAI(api_key=api_key)
+        self.responses = cache.TTLCache(maxsize=LLMConfig.CACHE_SIZE, ttl=LLMConfig.CACHE_TTL)
+        self._metrics_lock = threading.Lock()
+        self.metrics = {
+            "calls": 0,
+            "cache_hits": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "total_latency_s": 0.0,
+            "last_call": None,
+        }
 
+    def _messages(self, prompt):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
 
-    def make_call_to_llm(self, metadata):
-        response = self.client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": """You are a running safety expert analyzing route options for runners in NYC. 
-                Safety scores are calculated based on comparing danger data to averages in that area.
-                There are several segments per route. Additional information is included for dangerous segments. 
-                Route length accuracy must also be considered in recommendation. 
-                Focus on practical advice that helps runners make informed decisions."""
-            },
-            {
-                "role": "user", 
-                "content": str(metadata)
-            }
-        ],
-        temperature=0.3, 
-        max_tokens=800  
-        )
-        print(response)
+    def _cache_key(self, prompt):
+        key = f"{LLMConfig.MODEL}|{LLMConfig.TEMPERATURE}|{LLMConfig.MAX_TOKENS}|{prompt}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _record(self, response, latency, cached):
+        usage = getattr(response, "usage", None)
+        call = {
+            "cached": cached,
+            "latency_ms": round(latency * 1000, 1),
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) if not cached else 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) if not cached else 0,
+        }
+        with self._metrics_lock:
+            if cached:
+                self.metrics["cache_hits"] += 1
+            else:
+                self.metrics["calls"] += 1
+                self.metrics["prompt_tokens"] += call["prompt_tokens"]
+                self.metrics["completion_tokens"] += call["completion_tokens"]
+                self.metrics["total_latency_s"] += latency
+            self.metrics["last_call"] = call
+        log.info("LLM call: %s", call)
+
+    def stats(self):
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        calls = metrics["calls"]
+        metrics["avg_latency_ms"] = round(metrics["total_latency_s"] / calls * 1000, 1) if calls else 0.0
+        metrics["cache"] = self.responses.stats()
+        return metrics
+
+    def _request_args(self, prompt):
+        return {
+            "model": LLMConfig.MODEL,
+            "messages": self._messages(prompt),
+            "temperature": LLMConfig.TEMPERATURE,
+            "max_tokens": LLMConfig.MAX_TOKENS,
+        }
+
+    def _cached(self, metadata, started):
+        """(prompt, cache key, cached response or None); a hit is recorded here"""
+        prompt = build_prompt(metadata)
+        key = self._cache_key(prompt)
+        cached = self.responses.get(key)
+        if cached is not None:
+            self._record(cached, time.perf_counter() - started, cached=True)
+        return prompt, key, cached
+
+    def _store(self, key, response, started):
+        self.responses.set(key, response)
+        self._record(response, time.perf_counter() - started, cached=False)
         return response
-        
 
+    def make_call_to_llm(self, metadata):
+        started = time.perf_counter()
+        prompt, key, cached = self._cached(metadata, started)
+        if cached is not None:
+            return cached
+
+        with telemetry.stage("llm"):
+            telemetry.count("openai")
+            response = self.client.chat.completions.create(**self._request_args(prompt))
+        return self._store(key, response, started)
+
+    async def make_call_to_llm_async(self, metadata):
+        """make_call_to_llm on the event loop; shares the response cache and metrics"""
+        started = time.perf_counter()
+        prompt, key, cached = self._cached(metadata, started)
+        if cached is not None:
+            return cached
+
+        with telemetry.stage("llm"):
+            telemetry.count("openai")
+            response = await self.async_client.chat.completions.create(**self._request_args(prompt))
+        return self._store(key, response, started)
@@ -0,0 +1,532 @@
+"""
+Concurrent route finding over a shared httpx.AsyncClient
+
+Every endpoint's geocode -> route chain in a round runs at once, bounded by a
+semaphore, with per-call timeouts and retry with exponential backoff. Code on
+the server's loop uses get_engine(); blocking callers (optimized_route_finder)
+share one engine on a background loop, so neither opens a client per request.
+
+optimized_route_finder runs the adaptive search (adaptive_route_finder) unless
+SearchConfig.ADAPTIVE is off, in which case it runs the same fixed multiplier
+phases as get_routes.optimized_route_finder (up to 48 calls). The adaptive
+search probes a few directions, learns the walking/straight-line ratio from
+what Google returns, and places the remaining endpoints (and retries for the
+ones that missed) from that ratio, stopping once enough routes meet the
+accuracy goal or the call budget runs out.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import os
+import random
+import threading
+
+import httpx
+
+import cache
+import constants as const
+import get_routes
+import land_mask
+import routing
+import telemetry
+from constants import Direction, HttpConfig, LandMaskConfig, MapsApi, SearchConfig
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# httpx transport for engines that build their own client; None is the network
+transport = None
+
+# probe order: spread the first few directions around the compass
+SEARCH_ORDER = [
+    Direction.NORTH, Direction.EAST, Direction.SOUTH, Direction.WEST,
+    Direction.NORTHEAST, Direction.SOUTHEAST, Direction.SOUTHWEST, Direction.NORTHWEST,
+]
+
+
+class CallBudget:
+    """Google calls one search may make, and how many it has made"""
+
+    def __init__(self, limit=SearchConfig.CALL_BUDGET):
+        self.limit = limit
+        self.geocode = 0
+        self.routes = 0
+
+    @property
+    def used(self):
+        return self.geocode + self.routes
+
+    @property
+    def remaining(self):
+        return max(self.limit - self.used, 0)
+
+    def spend(self, kind):
+        setattr(self, kind, getattr(self, kind) + 1)
+
+    def as_dict(self):
+        return {
+            "budget": self.limit,
+            "calls": self.used,
+            "geocode_calls": self.geocode,
+            "routes_calls": self.routes,
+        }
+
+
+class DirectionSearch:
+    """Endpoints tried along one bearing and the walking distance each produced"""
+
+    def __init__(self, direction):
+        self.direction = direction
+        self.attempts = []  # (straight one-way km, walking one-way km)
+        self.best = None
+        self.done = False
+
+    def record(self, straight_km, walking_km, route):
+        self.attempts.append((straight_km, walking_km))
+        if self.best is None or route["accuracy"] > self.best["accuracy"]:
+            self.best = route
+
+    def next_distance(self, goal_km, ratio):
+        """
+        Straight-line distance for the next endpoint
+
+        Untried: goal / the search-wide ratio. One attempt: rescale by this
+        direction's own ratio. Two or more: secant through the last two, kept
+        inside the bracket when the goal has been over- and undershot.
+        """
+        if not self.attempts:
+            return goal_km / ratio
+
+        d1, w1 = self.attempts[-1]
+        guess = d1 * goal_km / w1 if w1 > 0 else d1
+        if len(self.attempts) >= 2:
+            d0, w0 = self.attempts[-2]
+            if w1 != w0 and (w1 - w0) / (d1 - d0 or 1e-9) > 0:
+                guess = d1 + (goal_km - w1) * (d1 - d0) / (w1 - w0)
+
+        short = [d for d, w in self.attempts if w < goal_km]
+        long = [d for d, w in self.attempts if w > goal_km]
+        if short and long:
+            low, high = max(short), min(long)
+            if not low < guess < high:
+                guess = (low + high) / 2  # bisect
+
+        step = SearchConfig.MAX_STEP
+        return min(max(guess, d1 * (1 - step)), d1 * (1 + step))
+
+
+class RouteEngine:
+    def __init__(
+        self,
+        max_concurrency=HttpConfig.MAX_CONCURRENCY,
+        timeout=HttpConfig.TIMEOUT,
+        retries=HttpConfig.RETRIES,
+        backoff=HttpConfig.BACKOFF,
+        client=None,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._owns_client = client is None
+        self.client = client or httpx.AsyncClient(
+            transport=transport,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=HttpConfig.MAX_KEEPALIVE,
+            ),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_client:
+            await self.client.aclose()
+
+    async def _request(self, method, url, **kwargs):
+        """One HTTP call with concurrency limit, timeout and retry/backoff"""
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    response = await self.client.request(
+                        method, url, timeout=self.timeout, **kwargs
+                    )
+                if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                    response.raise_for_status()
+                    return response.json()
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            # full jitter keeps retries from a fan-out from arriving in lockstep
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    async def geocode(self, lat, lng, mapi=MapsApi, budget=None):
+        cached = cache.geocodes.get(get_routes.geocode_cache_key(lat, lng))
+        if cached is not None:
+            return cached
+
+        params = {"latlng": f"{lat},{lng}", "key": os.getenv("GOOGLE_ROUTES_API_KEY")}
+        if budget is not None:
+            budget.spend("geocode")
+        with telemetry.stage("geocode"):
+            telemetry.count("google_geocode")
+            result = await self._request("GET", mapi.GEOCODING.value, params=params)
+        get_routes.cache_geocode_result(lat, lng, result)
+        return result
+
+    async def route_distance(self, start_lat, start_lng, end_lat, end_lng, budget=None):
+        """Async twin of get_routes.test_google_routes_distance; local backends skip the network"""
+        backend = routing.get_backend()
+        if backend.local:
+            return await asyncio.to_thread(backend.route, start_lat, start_lng, end_lat, end_lng)
+
+        key = get_routes.route_cache_key(start_lat, start_lng, end_lat, end_lng)
+        cached = cache.routes.get(key)
+        if cached is not None:
+            return cached
+
+        url, headers, data = get_routes.routes_request(start_lat, start_lng, end_lat, end_lng)
+        if budget is not None:
+            budget.spend("routes")
+        try:
+            with telemetry.stage("routes"):
+                telemetry.count("google_routes")
+                result = await self._request("POST", url, json=data, headers=headers)
+            result = get_routes.parse_routes_result(result)
+        except Exception as e:
+            return {"error": str(e), "success": False}
+
+        if result["success"]:
+            cache.routes.set(key, result)
+        return result
+
+    async def _test_endpoint(
+        self, start_lat, start_lng, endpoint, water_keywords, budget=None, geocode=True
+    ):
+        """Geocode filter (skipped for masked endpoints unless CHECK_ADDRESSES), then the Routes call"""
+        if not geocode:
+            return await self.route_distance(
+                start_lat, start_lng, endpoint["lat"], endpoint["lng"], budget=budget
+            )
+        try:
+            result = await self.geocode(endpoint["lat"], endpoint["lng"], budget=budget)
+        except Exception as e:
+            log.warning("%s: geocoding error - %s (filtered)", endpoint["direction"], e)
+            return None
+        if not get_routes.accept_geocoded_endpoint(endpoint, result, water_keywords):
+            return None
+        return await self.route_distance(
+            start_lat, start_lng, endpoint["lat"], endpoint["lng"], budget=budget
+        )
+
+    async def test_multipliers(
+        self, start_lat, start_lng, target_distance, multipliers, water_keywords=const.ignore,
+        on_route=None,
+    ):
+        """
+        Fan out every endpoint of every multiplier; routes come back in endpoint order
+
+        on_route, if given, is called with each route as soon as its Routes call
+        succeeds, for callers that stream candidates before selection.
+        """
+        endpoints = []
+        for multiplier in multipliers:
+            endpoints.extend(
+                get_routes.generate_optimized_endpoints(
+                    start_lat, start_lng, target_distance * multiplier
+                )
+            )
+        mask = land_mask.get_mask()
+        geocode = mask is None or LandMaskConfig.CHECK_ADDRESSES
+        if mask is not None:
+            endpoints = get_routes.snap_to_land(start_lat, start_lng, endpoints, mask)
+
+        backend = routing.get_backend()
+        if backend.local:
+            return await self._test_locally(
+                backend, start_lat, start_lng, target_distance, endpoints, water_keywords,
+                geocode=geocode, on_route=on_route,
+            )
+
+        async def test(i, endpoint):
+            google_result = await self._test_endpoint(
+                start_lat, start_lng, endpoint, water_keywords, geocode=geocode
+            )
+            if not (google_result and google_result["success"]):
+                return None
+            route = get_routes.build_route_info(i + 1, endpoint, google_result, target_distance)
+            if on_route is not None:
+                on_route(route)
+            return route
+
+        results = await asyncio.gather(*(test(i, endpoint) for i, endpoint in enumerate(endpoints)))
+        return [route for route in results if route is not None]
+
+    async def _test_locally(
+        self, backend, start_lat, start_lng, target_distance, endpoints, water_keywords,
+        geocode=True, on_route=None,
+    ):
+        """test_multipliers for a local backend: filter, then every endpoint in one search"""
+        if geocode:
+            async def accept(endpoint):
+                try:
+                    result = await self.geocode(endpoint["lat"], endpoint["lng"])
+                except Exception as e:
+                    log.warning("%s: geocoding error - %s (filtered)", endpoint["direction"], e)
+                    return False
+                return get_routes.accept_geocoded_endpoint(endpoint, result, water_keywords)
+
+            accepted = await asyncio.gather(*(accept(endpoint) for endpoint in endpoints))
+            numbered = [(i, e) for i, (e, ok) in enumerate(zip(endpoints, accepted)) if ok]
+        else:
+            numbered = list(enumerate(endpoints))
+
+        results = await asyncio.to_thread(
+            backend.routes_from, start_lat, start_lng,
+            [(endpoint["lat"], endpoint["lng"]) for _, endpoint in numbered],
+        )
+        routes = []
+        for (i, endpoint), result in zip(numbered, results):
+            if not result["success"]:
+                continue
+            route = get_routes.build_route_info(i + 1, endpoint, result, target_distance)
+            if on_route is not None:
+                on_route(route)
+            routes.append(route)
+        return routes
+
+    @telemetry.timed("route_finder")
+    async def optimized_route_finder(
+        self, start_lat, start_lng, target_distance, on_route=None, budget=None, stats=None,
+    ):
+        """
+        Routes for an out-and-back of target_distance km, best first
+
+        stats, if given, is filled with what the search spent (see CallBudget.as_dict).
+        """
+        if SearchConfig.ADAPTIVE:
+            return await self.adaptive_route_finder(
+                start_lat, start_lng, target_distance, on_route=on_route,
+                budget=budget, stats=stats,
+            )
+        return await self.phased_route_finder(start_lat, start_lng, target_distance, on_route)
+
+    async def phased_route_finder(self, start_lat, start_lng, target_distance, on_route=None):
+        """The fixed multiplier phases: 0.4 in all directions, then both backups if needed"""
+        phase1_routes = await self.test_multipliers(
+            start_lat, start_lng, target_distance, [get_routes.OPTIMAL_MULTIPLIER],
+            on_route=on_route,
+        )
+        final_routes = get_routes.select_phase1_routes(phase1_routes)
+
+        if final_routes is None:
+            log.info("Phase 2: testing backup multipliers concurrently")
+            phase2_routes = await self.test_multipliers(
+                start_lat, start_lng, target_distance, get_routes.BACKUP_MULTIPLIERS,
+                on_route=on_route,
+            )
+            final_routes = get_routes.select_final_routes(phase1_routes + phase2_routes)
+
+        get_routes.print_final_routes(final_routes)
+        return final_routes
+
+    async def adaptive_route_finder(
+        self, start_lat, start_lng, target_distance, water_keywords=const.ignore,
+        on_route=None, budget=None, stats=None,
+    ):
+        """
+        Search endpoint distance per direction instead of trying fixed multipliers
+
+        Each round tries the directions still needed (plus SearchConfig.HEDGE):
+        first the ones that missed the accuracy goal, at a distance refined from
+        their own attempts, then untried directions at goal / the median
+        walking/straight-line ratio seen so far. Stops once MIN_ROUTES directions
+        meet GOAL_ACCURACY, nothing is left to try, or the budget (Google calls,
+        default SearchConfig.CALL_BUDGET) can't cover another endpoint. Routes
+        keep their direction's id, so a later candidate replaces an earlier one.
+        """
+        if not isinstance(budget, CallBudget):
+            budget = CallBudget(SearchConfig.CALL_BUDGET if budget is None else budget)
+        goal_km = target_distance / 2
+        goal = SearchConfig.GOAL_ACCURACY
+        searches = [DirectionSearch(direction) for direction in SEARCH_ORDER]
+        ids = {direction: i + 1 for i, direction in enumerate(Direction)}
+        ratios = []
+        rounds = 0
+        mask = land_mask.get_mask()
+        geocode = mask is None or LandMaskConfig.CHECK_ADDRESSES
+
+        async def attempt(search, straight_km):
+            endpoints = get_routes.generate_optimized_endpoints(
+                start_lat, start_lng, straight_km, d=[search.direction]
+            )
+            if mask is not None:
+                endpoints = get_routes.snap_to_land(start_lat, start_lng, endpoints, mask)
+                if not endpoints:
+                    search.done = True
+                    return
+            endpoint = endpoints[0]
+            google_result = await self._test_endpoint(
+                start_lat, start_lng, endpoint, water_keywords, budget, geocode=geocode
+            )
+            if not (google_result and google_result["success"]):
+                search.done = True  # water, no address or no walking route: drop the bearing
+                return
+            route = get_routes.build_route_info(
+                ids[search.direction], endpoint, google_result, target_distance
+            )
+            straight = endpoint["calculated_distance"]
+            search.record(straight, google_result["distance_km"], route)
+            ratios.append(google_result["distance_km"] / straight)
+            if route["accuracy"] >= goal or len(search.attempts) >= SearchConfig.MAX_ATTEMPTS:
+                search.done = True
+            if on_route is not None:
+                on_route(route)
+
+        while True:
+            met = sum(1 for s in searches if s.best and s.best["accuracy"] >= goal)
+            if met >= SearchConfig.MIN_ROUTES:
+                break
+            # retries for misses first (they know their own ratio), then fresh bearings
+            pending = sorted(
+                (s for s in searches if not s.done),
+                key=lambda s: (not s.attempts, -(s.best["accuracy"] if s.best else 0)),
+            )
+            # an endpoint costs up to two calls (geocode + routes), one with the land mask
+            wave = min(
+                SearchConfig.MIN_ROUTES - met + SearchConfig.HEDGE,
+                len(pending),
+                budget.remaining // (1 if mask is not None else 2),
+            )
+            if wave <= 0:
+                break
+
+            # before any route comes back, assume the usual multiplier's ratio
+            ratio = (
+                sorted(ratios)[len(ratios) // 2] if ratios
+                else 0.5 / get_routes.OPTIMAL_MULTIPLIER
+            )
+            rounds += 1
+            await asyncio.gather(*(
+                attempt(search, search.next_distance(goal_km, ratio))
+                for search in pending[:wave]
+            ))
+
+        best = [s.best for s in searches if s.best is not None]
+        good = [r for r in best if r["accuracy"] >= goal]
+        if len(good) >= SearchConfig.MIN_ROUTES:
+            final_routes = sorted(good, key=lambda r: r["accuracy"], reverse=True)
+        else:
+            final_routes = get_routes.select_final_routes(best)
+
+        spent = {**budget.as_dict(), "rounds": rounds, "endpoints": sum(len(s.attempts) for s in searches)}
+        telemetry.count("route_search_calls", budget.used)
+        log.info(
+            "Route search: %d Google calls (%d geocode, %d routes) of %d, %d rounds, %d routes",
+            budget.used, budget.geocode, budget.routes, budget.limit, rounds, len(final_routes),
+        )
+        if stats is not None:
+            stats.update(spent)
+        get_routes.print_final_routes(final_routes)
+        return final_routes
+
+
+_engine = None
+
+
+def get_engine():
+    """Engine shared by everything running on the server's event loop"""
+    global _engine
+    if _engine is None:
+        _engine = RouteEngine()
+    return _engine
+
+
+async def close_engine():
+    global _engine
+    if _engine is not None:
+        await _engine.aclose()
+        _engine = None
+
+
+def set_transport(value):
+    """Send Google calls from new engines through another transport (e.g. a local fake)"""
+    global transport
+    transport = value
+
+
+_loop = None
+_loop_engine = None  # created and used only on _loop
+_loop_lock = threading.Lock()
+
+
+def background_loop():
+    """Event loop on a daemon thread shared by blocking callers, started on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="route-engine", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def run_blocking(coroutine_fn, *args, **kwargs):
+    """
+    Run coroutine_fn(engine, *args, **kwargs) on the background loop and wait for it
+
+    Every blocking call shares that loop's engine, so they reuse its keep-alive
+    connections instead of building a client (and TLS sessions) per call. The
+    coroutine runs in a copy of the caller's context, keeping its trace.
+    """
+    loop = background_loop()
+    context = contextvars.copy_context()
+    done = concurrent.futures.Future()
+
+    async def call():
+        global _loop_engine
+        if _loop_engine is None:
+            _loop_engine = RouteEngine()
+        return await coroutine_fn(_loop_engine, *args, **kwargs)
+
+    def finished(task):
+        if task.cancelled():
+            done.cancel()
+        elif task.exception() is not None:
+            done.set_exception(task.exception())
+        else:
+            done.set_result(task.result())
+
+    def submit():
+        loop.create_task(call(), context=context).add_done_callback(finished)
+
+    loop.call_soon_threadsafe(submit)
+    return done.result()
+
+
+def close_background_loop():
+    """Close the blocking callers' engine and stop their loop"""
+    global _loop, _loop_engine
+    with _loop_lock:
+        loop, _loop = _loop, None
+    if loop is None:
+        return
+    if _loop_engine is not None:
+        asyncio.run_coroutine_threadsafe(_loop_engine.aclose(), loop).result()
+        _loop_engine = None
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def optimized_route_finder(start_lat, start_lng, target_distance, budget=None):
+    """Blocking entry point with the same signature as get_routes.optimized_route_finder"""
+    return run_blocking(
+        RouteEngine.optimized_route_finder, start_lat, start_lng, target_distance, budget=budget
+    )
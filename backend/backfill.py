@@ -1,52 +1,212 @@
+"""
+Streaming bulk load of NYC crash records into the crashes table
+
+Pages through the Socrata CSV endpoint with $offset, parses each page as it
+streams in, validates rows in a generator and feeds them straight into COPY
+on a staging table, then merges with a single INSERT ... ON CONFLICT. Memory
+stays flat no matter how many years are loaded.
+
+Usage:
+    python backfill.py --since 2022-01-01
+"""
+
+import argparse
+import csv
+import io
+import logging
+import time
+from datetime import date, timedelta
+
 import requests
-import psycopg2
 
+import baseline
+import crash_index
+import db
+import telemetry
+from constants import APIConfig
 
-def fetch_year_of_crashes():
-    cutoff_date = "2024-12-15"
-    url = "https://data.cityofnewyork.us/resource/h9gi-nx95.json"
+log = logging.getLogger(__name__)
 
-    params = {
-        "$limit": 50000,
-        "$order": "crash_date DESC",
-        "$where": f"latitude IS NOT NULL AND longitude IS NOT NULL AND crash_date >= '{cutoff_date}'",
-    }
+SOCRATA_FIELDS = (
+    "collision_id",
+    "crash_date",
+    "latitude",
+    "longitude",
+    "number_of_persons_injured",
+    "number_of_persons_killed",
+)
+COLUMNS = ("collision_id", "crash_date", "latitude", "longitude", "injuries", "fatalities")
 
-    response = requests.get(url, params=params)
-    return response.json()
 
+def fetch_crash_pages(
+    where, page_size=int(APIConfig.REQUEST_LIMIT), order="collision_id", select=SOCRATA_FIELDS,
+    url=APIConfig.NYC_CRASHES_CSV_URL,
+):
+    """
+    Yield raw Socrata rows (dicts of strings), one page request at a time
 
-def insert_crashes_to_db(crashes):
-    conn = psycopg2.connect(
-        host="localhost", database="runsafe_db", user="lpietrewicz", password=""
-    )
+    Each page is parsed line by line off the open response, so only the
+    current line is held in memory.
+    """
+    offset = 0
+    while True:
+        params = {
+            "$select": ",".join(select),
+            "$where": where,
+            "$order": order,
+            "$limit": page_size,
+            "$offset": offset,
+        }
+        with requests.get(url, params=params, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            lines = response.iter_lines(decode_unicode=True)
+            page_rows = 0
+            for row in csv.DictReader(lines):
+                page_rows += 1
+                yield row
+
+        log.info("Fetched page at offset %d: %d rows", offset, page_rows)
+        if page_rows < page_size:
+            return
+        offset += page_size
 
-    cursor = conn.cursor()
 
-    for crash in crashes:
+def clean_crash_rows(rows, stats=None):
+    """Validate and convert Socrata rows to COPY-ready tuples, skipping bad ones"""
+    stats = stats if stats is not None else {}
+    stats.setdefault("rows", 0)
+    stats.setdefault("skipped", 0)
+
+    for row in rows:
+        stats["rows"] += 1
         try:
-            cursor.execute(
-                """
-                INSERT INTO crashes (collision_id, crash_date, latitude, longitude, injuries, fatalities)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                ON CONFLICT (collision_id) DO NOTHING
-            """,
-                (
-                    crash.get("collision_id"),
-                    crash.get("crash_date"),
-                    float(crash.get("latitude", 0)),
-                    float(crash.get("longitude", 0)),
-                    int(crash.get("number_of_persons_injured", 0)),
-                    int(crash.get("number_of_persons_killed", 0)),
-                ),
+            latitude = float(row["latitude"])
+            longitude = float(row["longitude"])
+            if latitude == 0 or longitude == 0:
+                raise ValueError("placeholder coordinates")
+            yield (
+                int(row["collision_id"]),
+                row["crash_date"][:10],
+                latitude,
+                longitude,
+                int(row.get("number_of_persons_injured") or 0),
+                int(row.get("number_of_persons_killed") or 0),
             )
-        except Exception as e:
-            print(f"Error inserting crash {crash.get('collision_id')}: {e}")
+        except (KeyError, TypeError, ValueError):
+            stats["skipped"] += 1
+
+
+class RowStream(io.TextIOBase):
+    """Read-only file over a row generator, in COPY text format, for copy_expert"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += "\t".join(str(value) for value in row) + "\n"
+        if size < 0:
+            chunk, self._buffer = self._buffer, ""
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def load_crash_rows(rows, on_conflict="DO NOTHING", returning=False, conn=None):
+    """
+    COPY rows into a staging table and merge them into crashes in one statement
 
-    conn.commit()
-    conn.close()
-    print(f"Inserted crashes into database")
+    With conn the merge joins the caller's transaction (the caller commits);
+    otherwise it borrows a pooled connection and commits on its own.
 
+    Returns:
+        (rows merged, merged rows as (lat, lng, date, injuries, fatalities) if returning)
+    """
+    if conn is None:
+        with db.get_connection() as conn:
+            return load_crash_rows(rows, on_conflict, returning, conn)
 
-crashes = fetch_year_of_crashes()
-insert_crashes_to_db(crashes)
+    columns = ", ".join(COLUMNS)
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        CREATE TEMP TABLE crashes_staging (
+            collision_id BIGINT,
+            crash_date DATE,
+            latitude DOUBLE PRECISION,
+            longitude DOUBLE PRECISION,
+            injuries INTEGER,
+            fatalities INTEGER
+        ) ON COMMIT DROP
+        """
+    )
+    cursor.copy_expert(f"COPY crashes_staging ({columns}) FROM STDIN", RowStream(iter(rows)))
+    cursor.execute(
+        f"""
+        INSERT INTO crashes ({columns})
+        SELECT DISTINCT ON (collision_id) {columns}
+        FROM crashes_staging
+        ORDER BY collision_id
+        ON CONFLICT (collision_id) {on_conflict}
+        {"RETURNING latitude, longitude, crash_date, injuries, fatalities" if returning else ""}
+        """
+    )
+    merged = cursor.fetchall() if returning else None
+    return cursor.rowcount, merged
+
+
+def refresh_derived_data(merged_rows=None):
+    """Bring the crash index (and its published snapshot) and baseline grids up to date"""
+    crash_index.rebuild_if_used()
+    if merged_rows is not None:
+        # small deltas fold into the loaded grids incrementally
+        baseline.refresh_with_crashes(merged_rows)
+    else:
+        baseline.rebuild()
+
+
+def insert_crashes_to_db(crashes):
+    """Load a list of Socrata crash dicts through the COPY path"""
+    inserted, merged = load_crash_rows(clean_crash_rows(crashes), returning=True)
+    refresh_derived_data(merged)
+    log.info("Inserted %d crashes into database", inserted)
+    return inserted
+
+
+def backfill(since, page_size=int(APIConfig.REQUEST_LIMIT), url=APIConfig.NYC_CRASHES_CSV_URL):
+    where = f"latitude IS NOT NULL AND longitude IS NOT NULL AND crash_date >= '{since}'"
+    stats = {}
+    started = time.perf_counter()
+
+    rows = clean_crash_rows(fetch_crash_pages(where, page_size=page_size, url=url), stats)
+    inserted, _ = load_crash_rows(rows)
+
+    elapsed = time.perf_counter() - started
+    log.info(
+        "Backfill since %s: %d rows read, %d skipped, %d inserted in %.1fs (%s rows/s)",
+        since, stats["rows"], stats["skipped"], inserted, elapsed,
+        f"{stats['rows'] / max(elapsed, 1e-9):,.0f}",
+    )
+    if inserted:
+        refresh_derived_data()
+    return inserted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load NYC crashes into Postgres")
+    parser.add_argument(
+        "--since",
+        default=str(date.today() - timedelta(days=365)),
+        help="earliest crash_date to load (YYYY-MM-DD), default one year back",
+    )
+    parser.add_argument("--page-size", type=int, default=int(APIConfig.REQUEST_LIMIT))
+    args = parser.parse_args()
+    telemetry.configure_logging()
+    backfill(args.since, page_size=args.page_size)
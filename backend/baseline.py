@@ -0,0 +1,332 @@
+"""
+Neighbourhood crash baselines from a precomputed grid
+
+get_area_crash_percentiles runs 25 bounding-box aggregates (a 5x5 grid of
+sample points) per attribute and takes the median. Here the crashes are
+binned once into fine cells and turned into a summed-area table, so any
+bounding-box aggregate is 4 array reads and the 5x5 median for all three
+attributes is a single vectorized lookup, independent of radius.
+
+Tolerance: window edges snap to the nearest cell line, so each window can
+gain or lose the crashes within RESOLUTION / 2 of its edges (up to ~11% of
+the window area at the default 0.0005 deg and 0.5 km). The p50s are
+therefore approximate. Against the exact SQL-equivalent p50s
+(exact_percentiles) at 200 random crash locations in a seeded year of 50k
+crashes, the relative error (against max(exact, 1)) was:
+
+    0.5 km, all history   crashes    mean 2%, p95 9%,  max 17% (off by <= 12)
+                          injuries   mean 4%, p95 14%, max 33% (off by <= 5)
+    1 km, all history     crashes    mean 1%, p95 4%,  max 5%
+                          fatalities off by <= 1
+    0.5 km, 60 days       crashes    mean 4%, p95 14%, max 100% (off by <= 4)
+
+Relative error is largest where counts are small (sparse cells, short
+windows, fatalities), where being off by one is 100%; in absolute terms the
+error stays within a few crashes. tests/test_baseline.py fails if the error
+grows past these figures (with some margin); `python baseline.py accuracy` reruns the comparison on the
+loaded crash data and `check LAT LNG` compares one point against the SQL loop.
+Finer resolution tightens the error linearly.
+
+Usage:
+    python baseline.py rebuild      # rebuild from the crashes table and save
+    python baseline.py accuracy [N_POINTS] [RADIUS_KM] [DAYS_BACK]
+    python baseline.py check LAT LNG [RADIUS_KM] [DAYS_BACK]
+"""
+
+import os
+import sys
+import threading
+from datetime import date
+
+import numpy as np
+
+import crash_index
+import utils
+from constants import BaselineGrid
+
+ATTRS = ("crashes", "injuries", "fatalities")
+OFFSETS = np.array([-2, -1, 0, 1, 2], dtype=np.float64)
+
+
+class CrashBaselineGrid:
+    def __init__(self, resolution=BaselineGrid.RESOLUTION, bounds=None):
+        self.resolution = float(resolution)
+        self.lat_min, self.lat_max, self.lng_min, self.lng_max = bounds or (
+            BaselineGrid.LAT_MIN,
+            BaselineGrid.LAT_MAX,
+            BaselineGrid.LNG_MIN,
+            BaselineGrid.LNG_MAX,
+        )
+        self.n_lat = int(np.ceil((self.lat_max - self.lat_min) / self.resolution))
+        self.n_lng = int(np.ceil((self.lng_max - self.lng_min) / self.resolution))
+
+        # per-cell crashes / injuries / fatalities, and the zero-padded summed-area table
+        self.cells = np.zeros((len(ATTRS), self.n_lat, self.n_lng), dtype=np.int32)
+        self.table = np.zeros((len(ATTRS), self.n_lat + 1, self.n_lng + 1), dtype=np.int64)
+        self._lock = threading.Lock()
+        self.built_on = None
+
+    def add_crashes(self, lats, lngs, injuries, fatalities):
+        """Bin crashes into cells and refresh the summed-area table (incremental)"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        rows = np.floor((lats - self.lat_min) / self.resolution).astype(np.int64)
+        cols = np.floor((lngs - self.lng_min) / self.resolution).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.n_lat) & (cols >= 0) & (cols < self.n_lng)
+        rows, cols = rows[inside], cols[inside]
+
+        values = (
+            np.ones(rows.shape, dtype=np.int32),
+            np.nan_to_num(np.asarray(injuries, dtype=np.float64)[inside]).astype(np.int32),
+            np.nan_to_num(np.asarray(fatalities, dtype=np.float64)[inside]).astype(np.int32),
+        )
+
+        with self._lock:
+            for k, value in enumerate(values):
+                np.add.at(self.cells[k], (rows, cols), value)
+            table = np.zeros_like(self.table)
+            table[:, 1:, 1:] = self.cells.cumsum(axis=1, dtype=np.int64).cumsum(axis=2)
+            self.table = table
+        return int(inside.sum())
+
+    def _edges(self, values, origin, size):
+        idx = np.rint((values - origin) / self.resolution).astype(np.int64)
+        return np.clip(idx, 0, size)
+
+    def window_sums(self, lat_lo, lat_hi, lng_lo, lng_hi):
+        """(3, n) crashes/injuries/fatalities inside each of n bounding boxes"""
+        r0 = self._edges(lat_lo, self.lat_min, self.n_lat)
+        r1 = self._edges(lat_hi, self.lat_min, self.n_lat)
+        c0 = self._edges(lng_lo, self.lng_min, self.n_lng)
+        c1 = self._edges(lng_hi, self.lng_min, self.n_lng)
+        t = self.table
+        return t[:, r1, c1] - t[:, r0, c1] - t[:, r1, c0] + t[:, r0, c0]
+
+    def percentiles(self, lat, lng, radius_km, spacing=BaselineGrid.SAMPLE_SPACING):
+        """
+        p50 of crashes, injuries and fatalities over the 5x5 neighbourhood,
+        mirroring get_area_crash_percentiles
+
+        Returns:
+            dict of attr -> p50 value
+        """
+        p50 = self.percentiles_many([lat], [lng], radius_km, spacing=spacing)
+        return {attr: int(p50[k, 0]) for k, attr in enumerate(ATTRS)}
+
+    def percentiles_many(self, lats, lngs, radius_km, spacing=BaselineGrid.SAMPLE_SPACING):
+        """(3, n) p50 crashes/injuries/fatalities for n points in one vectorized pass"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        # (n, 25) sample points: rows step in latitude, columns in longitude
+        sample_lats = np.repeat(lats[:, None] + OFFSETS * spacing, len(OFFSETS), axis=1)
+        sample_lngs = np.tile(lngs[:, None] + OFFSETS * spacing, len(OFFSETS))
+
+        lat_buffer = radius_km / 111.0
+        lng_buffer = radius_km / (111.0 * np.cos(np.radians(sample_lats)))
+
+        sums = self.window_sums(
+            sample_lats - lat_buffer,
+            sample_lats + lat_buffer,
+            sample_lngs - lng_buffer,
+            sample_lngs + lng_buffer,
+        )
+        sums.sort(axis=2)
+        return sums[:, :, int(0.5 * sums.shape[2])]
+
+    def save(self, path=BaselineGrid.PATH):
+        """Write and swap in atomically, so workers loading it never see half a file"""
+        base, ext = os.path.splitext(path)
+        tmp = f"{base}.{os.getpid()}.tmp{ext or '.npz'}"
+        np.savez_compressed(
+            tmp,
+            cells=self.cells,
+            meta=np.array(
+                [self.resolution, self.lat_min, self.lat_max, self.lng_min, self.lng_max]
+            ),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=BaselineGrid.PATH):
+        with np.load(path) as data:
+            resolution, *bounds = data["meta"].tolist()
+            grid = cls(resolution=resolution, bounds=tuple(bounds))
+            grid.cells[...] = data["cells"]
+        grid.table[:, 1:, 1:] = grid.cells.cumsum(axis=1, dtype=np.int64).cumsum(axis=2)
+        return grid
+
+
+def fetch_crash_columns(days_back=None):
+    index = crash_index.get_index()
+    since = utils.window_start(days_back)
+    if since is None:
+        return index.lats, index.lngs, index.injuries, index.fatalities
+    recent = index.dates >= np.datetime64(since, "D")
+    return index.lats[recent], index.lngs[recent], index.injuries[recent], index.fatalities[recent]
+
+
+def build_grid(days_back=None):
+    grid = CrashBaselineGrid()
+    grid.add_crashes(*fetch_crash_columns(days_back))
+    grid.built_on = date.today()
+    return grid
+
+
+# days_back -> grid; None is the all-history grid persisted at BaselineGrid.PATH
+_grids = {}
+_grid_lock = threading.Lock()
+
+
+def get_grid(days_back=None):
+    """
+    Process-wide grid per time window
+
+    The all-history grid is loaded from BaselineGrid.PATH if present, else built
+    from the crash index. Windowed grids are built on first use and rebuilt once
+    a day, since their window slides forward with the calendar.
+    """
+    grid = _grids.get(days_back)
+    if grid is not None and (days_back is None or grid.built_on == date.today()):
+        return grid
+    with _grid_lock:
+        grid = _grids.get(days_back)
+        if grid is None or (days_back is not None and grid.built_on != date.today()):
+            if days_back is None:
+                try:
+                    grid = CrashBaselineGrid.load()
+                    grid.built_on = date.today()
+                except FileNotFoundError:
+                    grid = build_grid()
+            else:
+                grid = build_grid(days_back)
+            _grids[days_back] = grid
+    return grid
+
+
+def rebuild(save=True):
+    """Rebuild the all-history grid and drop windowed grids so they rebuild lazily"""
+    grid = build_grid()
+    if save:
+        grid.save()
+    with _grid_lock:
+        _grids.clear()
+        _grids[None] = grid
+    return grid
+
+
+def reload():
+    """Drop loaded grids: the all-history one reloads from BaselineGrid.PATH, windowed ones rebuild"""
+    with _grid_lock:
+        _grids.clear()
+
+
+def refresh_with_crashes(rows):
+    """
+    Incrementally fold newly ingested crashes into every loaded grid
+
+    Args:
+        rows: (latitude, longitude, crash_date, injuries, fatalities) tuples
+    """
+    if not _grids or not rows:
+        return 0
+    lats, lngs, dates, injuries, fatalities = zip(*rows)
+    lats, lngs = np.array(lats, dtype=np.float64), np.array(lngs, dtype=np.float64)
+    dates = np.array([str(d)[:10] for d in dates], dtype="datetime64[D]")
+    injuries, fatalities = np.array(injuries), np.array(fatalities)
+
+    added = 0
+    for days_back, grid in list(_grids.items()):
+        since = utils.window_start(days_back)
+        keep = np.ones(len(lats), dtype=bool) if since is None else dates >= np.datetime64(since, "D")
+        added += grid.add_crashes(lats[keep], lngs[keep], injuries[keep], fatalities[keep])
+    return added
+
+
+def area_percentiles(lat, lng, radius_km, days_back=None):
+    return get_grid(days_back).percentiles(lat, lng, radius_km)
+
+
+def exact_percentiles(lat, lng, radius_km, days_back=None, spacing=BaselineGrid.SAMPLE_SPACING):
+    """
+    p50s computed the way get_area_crash_percentiles does (inclusive lat/lng
+    boxes over the raw crashes), from the crash index instead of 25 queries
+
+    Returns:
+        dict of attr -> p50 value
+    """
+    index = crash_index.get_index()
+    sums = []
+    for lat_offset in OFFSETS * spacing:
+        for lng_offset in OFFSETS * spacing:
+            sample_lat, sample_lng = lat + lat_offset, lng + lng_offset
+            lat_buffer = radius_km / 111.0
+            lng_buffer = radius_km / (111.0 * np.cos(np.radians(sample_lat)))
+            idx = index.query_box(
+                sample_lat - lat_buffer, sample_lat + lat_buffer,
+                sample_lng - lng_buffer, sample_lng + lng_buffer,
+                days_back=days_back,
+            )
+            sums.append((len(idx), int(index.injuries[idx].sum()), int(index.fatalities[idx].sum())))
+    p50 = np.sort(np.array(sums), axis=0)[len(sums) // 2]
+    return {attr: int(p50[k]) for k, attr in enumerate(ATTRS)}
+
+
+def accuracy(n_points=200, radius_km=0.5, days_back=None, seed=0):
+    """
+    Grid vs exact p50s at n_points crash locations drawn at random
+
+    Returns:
+        dict of attr -> mean/p95/max relative error (against max(exact, 1))
+        and max absolute error
+    """
+    index = crash_index.get_index()
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(index), size=min(n_points, len(index)), replace=False)
+    lats, lngs = np.asarray(index.lats)[picks], np.asarray(index.lngs)[picks]
+
+    grid = get_grid(days_back).percentiles_many(lats, lngs, radius_km)
+    exact = np.array([
+        [exact_percentiles(lat, lng, radius_km, days_back)[attr] for attr in ATTRS]
+        for lat, lng in zip(lats, lngs)
+    ]).T
+    absolute = np.abs(grid - exact)
+    relative = absolute / np.maximum(exact, 1)
+    return {
+        attr: {
+            "mean": float(relative[k].mean()),
+            "p95": float(np.percentile(relative[k], 95)),
+            "max": float(relative[k].max()),
+            "max_abs": int(absolute[k].max()),
+        }
+        for k, attr in enumerate(ATTRS)
+    }
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+
+    if command == "rebuild":
+        grid = rebuild()
+        print(f"Baseline grid rebuilt: {grid.n_lat}x{grid.n_lng} cells, "
+              f"{int(grid.cells[0].sum())} crashes -> {BaselineGrid.PATH}")
+    elif command == "accuracy":
+        n_points = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        radius_km = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+        days_back = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        for attr, error in accuracy(n_points, radius_km, days_back).items():
+            print(f"{attr:>10}: mean {error['mean']:.1%}  p95 {error['p95']:.1%}  "
+                  f"max {error['max']:.1%}  max abs {error['max_abs']}")
+    elif command == "check":
+        import polyline_safety_analysis as p
+
+        lat, lng = float(sys.argv[2]), float(sys.argv[3])
+        radius_km = float(sys.argv[4]) if len(sys.argv) > 4 else 0.5
+        days_back = int(sys.argv[5]) if len(sys.argv) > 5 else None
+        grid_p50 = area_percentiles(lat, lng, radius_km, days_back=days_back)
+        for attr in ATTRS:
+            sql_p50 = p.get_area_crash_percentiles(
+                lat, lng, radius_km=radius_km, attr=attr, days_back=days_back
+            )
+            print(f"{attr:>10}: grid={grid_p50[attr]} sql={sql_p50}")
+    else:
+        print(__doc__)
@@ -0,0 +1,334 @@
+"""
+Deterministic local stand-ins for the services the backend calls
+
+- seeded_crashes: a reproducible year of NYC-shaped crash records
+- install_crash_index: serves that dataset from the in-memory CrashIndex, so
+  scoring runs without Postgres
+- maps_transport: httpx transport answering Geocoding and Routes requests with
+  block-zigzag walking polylines between the requested points
+- street_grid: a seeded block-grid StreetGraph for the local routing backend
+- SocrataServer: local HTTP server paging the seeded crashes out as CSV
+- llm_client / async_llm_client: OpenAI clients whose transport returns a
+  canned recommendation with plausible token usage
+
+Every fake takes a latency in ms (with +-20% seeded jitter) so network-bound
+paths can be timed without the network.
+"""
+
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import math
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import numpy as np
+import openai
+import polyline
+
+import baseline
+import crash_index
+from constants import BaselineGrid
+from street_graph import StreetGraph
+
+# dense parts of Manhattan, Brooklyn, Queens and the Bronx
+HOTSPOTS = [
+    (40.7580, -73.9855), (40.7505, -73.9934), (40.7306, -73.9866), (40.7128, -74.0060),
+    (40.7831, -73.9712), (40.8116, -73.9465), (40.6782, -73.9442), (40.6928, -73.9903),
+    (40.6501, -73.9496), (40.7282, -73.7949), (40.7498, -73.8710), (40.8448, -73.8648),
+    (40.8176, -73.9182), (40.6195, -73.9903), (40.7440, -73.9187), (40.7033, -73.8176),
+]
+STREET_SPACING_KM = 0.08  # one polyline vertex roughly every block face
+WALK_SPEED_MS = 1.4
+
+
+def _rng_for(*values):
+    """Generator seeded from the values, so the same request gets the same answer"""
+    digest = hashlib.sha256(repr(values).encode()).digest()
+    return np.random.default_rng(int.from_bytes(digest[:8], "little"))
+
+
+def jittered(latency_ms, rng):
+    return max(latency_ms * rng.uniform(0.8, 1.2), 0.0) / 1000
+
+
+def seeded_crashes(n=60_000, seed=7, days=365, today=None):
+    """
+    Columns of n crashes: 70% clustered around HOTSPOTS, the rest spread over the grid bounds
+
+    Returns:
+        dict of lats, lngs, dates (datetime64[D]), injuries, fatalities, collision_ids
+    """
+    rng = np.random.default_rng(seed)
+    today = today or date.today()
+    clustered = int(n * 0.7)
+
+    centres = np.array(HOTSPOTS)[rng.integers(0, len(HOTSPOTS), clustered)]
+    lats = np.concatenate([
+        centres[:, 0] + rng.normal(0, 0.012, clustered),
+        rng.uniform(40.55, 40.90, n - clustered),
+    ])
+    lngs = np.concatenate([
+        centres[:, 1] + rng.normal(0, 0.012, clustered),
+        rng.uniform(-74.15, -73.75, n - clustered),
+    ])
+    lats = np.clip(lats, BaselineGrid.LAT_MIN, BaselineGrid.LAT_MAX)
+    lngs = np.clip(lngs, BaselineGrid.LNG_MIN, BaselineGrid.LNG_MAX)
+
+    start = np.datetime64(today - timedelta(days=days), "D")
+    return {
+        "lats": np.round(lats, 6),
+        "lngs": np.round(lngs, 6),
+        "dates": start + rng.integers(0, days + 1, n).astype("timedelta64[D]"),
+        "injuries": rng.poisson(0.35, n).astype(np.int32),
+        "fatalities": (rng.random(n) < 0.002).astype(np.int32),
+        "collision_ids": np.arange(9_000_000_000, 9_000_000_000 + n, dtype=np.int64),
+    }
+
+
+def install_crash_index(crashes):
+    """Serve crashes from the in-memory index and rebuild baseline grids from it"""
+    index = crash_index.CrashIndex(
+        crashes["lats"], crashes["lngs"], crashes["dates"],
+        crashes["injuries"], crashes["fatalities"], crashes["collision_ids"],
+    )
+    crash_index._set_index(index)
+    crash_index.set_enabled(True)
+    baseline.rebuild(save=False)
+    return index
+
+
+def crash_rows(crashes):
+    """Socrata-shaped dicts (strings, like the CSV endpoint) for the seeded crashes"""
+    for lat, lng, day, inj, fat, cid in zip(
+        crashes["lats"], crashes["lngs"], crashes["dates"],
+        crashes["injuries"], crashes["fatalities"], crashes["collision_ids"],
+    ):
+        yield {
+            "collision_id": str(cid),
+            "crash_date": f"{day}T00:00:00.000",
+            "latitude": f"{lat:.6f}",
+            "longitude": f"{lng:.6f}",
+            "number_of_persons_injured": str(inj),
+            "number_of_persons_killed": str(fat),
+        }
+
+
+# --- Google Geocoding + Routes -------------------------------------------------
+
+def street_polyline(start_lat, start_lng, end_lat, end_lng):
+    """
+    A walk that zigzags across blocks along the straight line, 15-35% longer than it
+
+    Returns:
+        (encoded polyline, distance in metres)
+    """
+    rng = _rng_for(round(start_lat, 5), round(start_lng, 5), round(end_lat, 5), round(end_lng, 5))
+    km_per_lng = 111.0 * math.cos(math.radians(start_lat))
+    dx = (end_lng - start_lng) * km_per_lng
+    dy = (end_lat - start_lat) * 111.0
+    straight_km = math.hypot(dx, dy)
+
+    n_blocks = max(int(straight_km / STREET_SPACING_KM), 1)
+    block_km = straight_km / n_blocks
+    # alternate +-amplitude across the line so each block is `detour` times longer
+    detour = rng.uniform(1.15, 1.35)
+    amplitude = block_km * math.sqrt(detour**2 - 1) / 2
+    sides = np.where(np.arange(n_blocks + 1) % 2, amplitude, -amplitude)
+    sides[[0, -1]] = 0.0
+
+    t = np.linspace(0.0, 1.0, n_blocks + 1)
+    normal_x, normal_y = (-dy / straight_km, dx / straight_km) if straight_km else (0.0, 0.0)
+    xs = t * dx + sides * normal_x
+    ys = t * dy + sides * normal_y
+    lats = start_lat + ys / 111.0
+    lngs = start_lng + xs / km_per_lng
+
+    metres = float(np.sum(np.hypot(np.diff(xs), np.diff(ys))) * 1000)
+    return polyline.encode(list(zip(np.round(lats, 5), np.round(lngs, 5)))), metres
+
+
+def routes_response(start_lat, start_lng, end_lat, end_lng):
+    encoded, metres = street_polyline(start_lat, start_lng, end_lat, end_lng)
+    return {
+        "routes": [{
+            "distanceMeters": int(metres),
+            "duration": f"{int(metres / WALK_SPEED_MS)}s",
+            "polyline": {"encodedPolyline": encoded},
+        }]
+    }
+
+
+def geocode_response(lat, lng, water_fraction=0.1):
+    """An address, or (for about water_fraction of points) a river"""
+    rng = _rng_for(round(lat, 5), round(lng, 5))
+    if rng.random() < water_fraction:
+        address = "East River, New York, NY, USA"
+    else:
+        address = f"{int(rng.integers(1, 999))} Fake St, New York, NY 10001, USA"
+    return {"status": "OK", "results": [{"formatted_address": address}]}
+
+
+def maps_transport(route_latency_ms=120, geocode_latency_ms=40, water_fraction=0.1):
+    """httpx.MockTransport standing in for maps.googleapis.com and routes.googleapis.com"""
+
+    async def handler(request):
+        if request.url.host == "routes.googleapis.com":
+            body = json.loads(request.content)
+            origin = body["origin"]["location"]["latLng"]
+            destination = body["destination"]["location"]["latLng"]
+            args = (origin["latitude"], origin["longitude"],
+                    destination["latitude"], destination["longitude"])
+            await asyncio.sleep(jittered(route_latency_ms, _rng_for("latency", *args)))
+            return httpx.Response(200, json=routes_response(*args))
+
+        lat, lng = (float(v) for v in request.url.params["latlng"].split(","))
+        await asyncio.sleep(jittered(geocode_latency_ms, _rng_for("latency", lat, lng)))
+        return httpx.Response(200, json=geocode_response(lat, lng, water_fraction))
+
+    return httpx.MockTransport(handler)
+
+
+def street_grid(lat_min=40.60, lat_max=40.86, lng_min=-74.05, lng_max=-73.75,
+                block_km=STREET_SPACING_KM, closed_fraction=0.08, seed=7):
+    """
+    Block-grid StreetGraph over the box: intersections jittered by up to a
+    quarter block, closed_fraction of street segments removed so routes detour
+    """
+    rng = np.random.default_rng(seed)
+    lat_step = block_km / 111.0
+    lng_step = block_km / (111.0 * math.cos(math.radians((lat_min + lat_max) / 2)))
+    n_lat = int((lat_max - lat_min) / lat_step) + 1
+    n_lng = int((lng_max - lng_min) / lng_step) + 1
+
+    rows, cols = np.divmod(np.arange(n_lat * n_lng), n_lng)
+    lats = lat_min + (rows + rng.uniform(-0.25, 0.25, rows.size)) * lat_step
+    lngs = lng_min + (cols + rng.uniform(-0.25, 0.25, cols.size)) * lng_step
+
+    ids = np.arange(n_lat * n_lng).reshape(n_lat, n_lng)
+    src = np.concatenate([ids[:, :-1].ravel(), ids[:-1, :].ravel()])
+    dst = np.concatenate([ids[:, 1:].ravel(), ids[1:, :].ravel()])
+    keep = rng.random(src.size) >= closed_fraction
+    return StreetGraph.from_edges(lats, lngs, src[keep], dst[keep])
+
+
+# --- Socrata ----------------------------------------------------------------
+
+class SocrataServer:
+    """
+    Threaded local HTTP server paging rows out as CSV with $limit/$offset
+
+    $where is ignored: every request sees the whole seeded dataset. The query
+    parameters of each request are kept in `requests`.
+    """
+
+    def __init__(self, rows, page_latency_ms=150):
+        self.rows = list(rows)
+        self.requests = []
+        self.fields = list(self.rows[0]) if self.rows else []
+        self.page_latency_ms = page_latency_ms
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                server.requests.append(params)
+                offset = int(params.get("$offset", 0))
+                limit = int(params.get("$limit", 1000))
+                time.sleep(jittered(server.page_latency_ms, _rng_for("page", offset)))
+
+                out = io.StringIO()
+                writer = csv.DictWriter(out, fieldnames=server.fields, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(server.rows[offset:offset + limit])
+                body = out.getvalue().encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/resource/h9gi-nx95.csv"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# --- OpenAI -----------------------------------------------------------------
+
+RECOMMENDATION = (
+    "Route 1 is the best choice: it matches your distance closely and avoids the "
+    "busiest intersections. Route 2 passes a crash hotspot near its turnaround; "
+    "if you take it, stay alert crossing the avenue."
+)
+
+
+def completion(request, model="gpt-4o-mini"):
+    body = json.loads(request.content)
+    prompt_chars = sum(len(message["content"]) for message in body["messages"])
+    prompt_tokens = prompt_chars // 4
+    completion_tokens = len(RECOMMENDATION) // 4
+    return {
+        "id": "chatcmpl-offline",
+        "object": "chat.completion",
+        "created": 0,
+        "model": body.get("model", model),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": RECOMMENDATION},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def llm_client(latency_ms=600):
+    def handler(request):
+        time.sleep(jittered(latency_ms, _rng_for("llm", request.content)))
+        return httpx.Response(200, json=completion(request))
+
+    return openai.OpenAI(
+        api_key="offline", max_retries=0,
+        http_client=httpx.Client(transport=httpx.MockTransport(handler)),
+    )
+
+
+def async_llm_client(latency_ms=600):
+    async def handler(request):
+        await asyncio.sleep(jittered(latency_ms, _rng_for("llm", request.content)))
+        return httpx.Response(200, json=completion(request))
+
+    return openai.AsyncOpenAI(
+        api_key="offline", max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+def seeded_origins(n, seed=11):
+    """Start points scattered around HOTSPOTS"""
+    rng = np.random.default_rng(seed)
+    centres = np.array(HOTSPOTS)[rng.integers(0, len(HOTSPOTS), n)]
+    points = centres + rng.normal(0, 0.006, (n, 2))
+    return [(round(float(lat), 6), round(float(lng), 6)) for lat, lng in points]
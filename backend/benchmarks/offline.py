@@ -0,0 +1,314 @@
+"""
+Offline benchmark suite over local fakes (see benchmarks.fakes)
+
+    cd backend && python -m benchmarks.offline [--scenarios route_finder generate]
+        [--iterations 20] [--store index|postgres] [--compare results/<previous>.json]
+
+Scenarios:
+    route_finder   async_routes RouteEngine.optimized_route_finder against fake Google
+    route_safety   analyze_route_safety_detailed on fake walking polylines
+    route_scoring  analyze_routes_parallel on ROUTES_PER_REQUEST polylines per request,
+                   sample-point path, pooled vs one batch lookup (--lookup-ms-per-point
+                   stands in for the SQL time per point of a batch query)
+    generate       GET /api/routes/generate end to end (fake Google + fake LLM)
+    backfill       Socrata CSV pages -> clean -> COPY stream (or COPY into Postgres)
+
+--routing graph answers route requests from a seeded street grid
+(fakes.street_grid) through the local backend instead of the fake Routes API.
+
+--store index (the default) builds the in-memory CrashIndex and baseline grids
+from a seeded crash dataset, so nothing needs a database. --store postgres runs
+the SQL paths against the database configured in the environment; --seed-db
+loads the seeded crashes first (use a scratch database, they go into crashes).
+
+Each run writes p50/p95/p99 latency and throughput per scenario to
+benchmarks/results/ as JSON; --compare prints the change against an earlier file.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import async_routes
+import backfill
+import cache
+import crash_index
+import polyline_safety_analysis as p
+import routing
+import telemetry
+from benchmarks import fakes
+from constants import CorridorConfig
+
+SCENARIOS = ("route_finder", "route_safety", "route_scoring", "generate", "backfill")
+ROUTES_PER_REQUEST = 8
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def summarize(latencies, wall_s, units=None, unit="requests"):
+    latencies_ms = np.asarray(latencies) * 1000
+    units = len(latencies) if units is None else units
+    return {
+        "iterations": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "mean_ms": round(float(latencies_ms.mean()), 3),
+        "max_ms": round(float(latencies_ms.max()), 3),
+        "throughput_per_s": round(units / wall_s, 2) if wall_s else None,
+        "unit": unit,
+    }
+
+
+def timed(fn, calls, warmup=1):
+    """Run fn(*args) per args tuple, the first warmup untimed; returns (latencies, wall seconds)"""
+    for args in calls[:warmup]:
+        fn(*args)
+    latencies = []
+    started = time.perf_counter()
+    for args in calls[warmup:]:
+        t = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - t)
+    return latencies, time.perf_counter() - started
+
+
+def bench_route_finder(args, origins):
+    searches = []
+
+    async def run():
+        async with async_routes.RouteEngine() as engine:
+            gate = asyncio.Semaphore(args.concurrency)
+
+            async def one(lat, lng):
+                async with gate:
+                    search = {}
+                    t = time.perf_counter()
+                    await engine.optimized_route_finder(lat, lng, args.distance, stats=search)
+                    searches.append(search)
+                    return time.perf_counter() - t
+
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*(one(lat, lng) for lat, lng in origins[1:]))
+            return latencies, time.perf_counter() - started
+
+    result = summarize(*asyncio.run(run()))
+    calls = [search["calls"] for search in searches if "calls" in search]
+    if calls:  # the fixed phases don't report calls
+        result["google_calls_per_request"] = round(sum(calls) / len(calls), 2)
+    return result
+
+
+def walking_routes(args, origins):
+    routes = []
+    for i, (lat, lng) in enumerate(origins):
+        # out to a turnaround about distance * 0.4 away, like the route finder picks
+        offset = args.distance * 0.4 / 111.0 / np.sqrt(2)
+        encoded, metres = fakes.street_polyline(lat, lng, lat + offset, lng + offset)
+        routes.append({"id": i + 1, "direction": "Northeast", "polyline": encoded,
+                       "distance": {"total_distance": metres / 500}})
+    return routes
+
+
+def bench_route_safety(args, origins):
+    routes = walking_routes(args, origins)
+    return summarize(*timed(p.analyze_route_safety_detailed, [(route,) for route in routes]))
+
+
+def bench_route_scoring(args, origins):
+    routes = walking_routes(args, fakes.seeded_origins(
+        len(origins) * ROUTES_PER_REQUEST, seed=args.seed + 1
+    ))
+    requests = [
+        (routes[i:i + ROUTES_PER_REQUEST],)
+        for i in range(0, len(routes), ROUTES_PER_REQUEST)
+    ]
+    sample_points = [
+        p.sample_route_array(p.decode_route_array(route["polyline"]), max_samples=5)
+        for route in requests[0][0]
+    ]
+    score_sample_points = p.score_sample_points
+
+    def lookup(lats, lngs):
+        time.sleep(args.lookup_ms_per_point * len(lats) / 1000)
+        return score_sample_points(lats, lngs)
+
+    real_enabled = CorridorConfig.ENABLED
+    CorridorConfig.ENABLED = False
+    p.score_sample_points = lookup
+    try:
+        one_batch = summarize(*timed(lambda r: p.analyze_routes_parallel(r, workers=1), requests))
+        result = summarize(*timed(p.analyze_routes_parallel, requests))
+    finally:
+        p.score_sample_points = score_sample_points
+        CorridorConfig.ENABLED = real_enabled
+    result.update(
+        points_per_request=sum(len(points) for points in sample_points),
+        chunks_per_request=len(p.route_chunks(sample_points)),
+        one_batch_p50_ms=one_batch["p50_ms"],
+        one_batch_throughput_per_s=one_batch["throughput_per_s"],
+    )
+    return result
+
+
+def bench_generate(args, origins):
+    from fastapi.testclient import TestClient
+
+    import main
+    from ai_agents import SafetyAnalysisAgent
+
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    agent = SafetyAnalysisAgent()
+    agent.client = fakes.llm_client(args.llm_latency_ms)
+    agent.async_client = fakes.async_llm_client(args.llm_latency_ms)
+    main.safety_ai = agent
+
+    client = TestClient(main.app)
+
+    def generate(lat, lng):
+        response = client.get(
+            "/api/routes/generate",
+            params={"start_lat": lat, "start_lng": lng, "target_distance_km": args.distance},
+        )
+        response.raise_for_status()
+
+    result = summarize(*timed(generate, [(lat, lng) for lat, lng in origins]))
+    result["llm"] = {k: v for k, v in agent.stats().items() if k != "last_call"}
+    return result
+
+
+def bench_backfill(args, crashes):
+    rows = list(fakes.crash_rows(crashes))
+    page_size = args.page_size
+
+    def load():
+        cleaned = backfill.clean_crash_rows(
+            backfill.fetch_crash_pages("1=1", page_size=page_size, url=server.url)
+        )
+        if args.store == "postgres":
+            backfill.load_crash_rows(cleaned)
+            return
+        # what copy_expert does with the stream, minus the server
+        stream = backfill.RowStream(cleaned)
+        while stream.read(8192):
+            pass
+
+    with fakes.SocrataServer(rows, page_latency_ms=args.socrata_latency_ms) as server:
+        latencies, wall_s = timed(load, [()] * args.backfill_iterations, warmup=0)
+    return summarize(latencies, wall_s, units=len(rows) * len(latencies), unit="rows")
+
+
+def setup_store(args, crashes):
+    if args.store == "index":
+        fakes.install_crash_index(crashes)
+        return
+    crash_index.set_enabled(False)
+    if args.seed_db:
+        loaded, _ = backfill.load_crash_rows(backfill.clean_crash_rows(fakes.crash_rows(crashes)))
+        print(f"Seeded {loaded} crashes into the database")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    print(f"\n{'scenario':<14} {'metric':<18} {'before':>10} {'after':>10} {'change':>8}")
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s"):
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            print(f"{name:<14} {metric:<18} {old:>10.2f} {new:>10.2f} {(new - old) / old:>+8.1%}")
+
+
+def run(args):
+    os.environ.setdefault("LOG_LEVEL", "DEBUG" if args.verbose else "WARNING")
+    telemetry.configure_logging()
+    cache.set_bypass(True)  # every call reaches the fakes
+    # the fakes ignore keys, but the request builders need one to set headers
+    os.environ.setdefault("GOOGLE_ROUTES_API_KEY", "offline")
+    async_routes.set_transport(fakes.maps_transport(
+        route_latency_ms=args.route_latency_ms, geocode_latency_ms=args.geocode_latency_ms
+    ))
+
+    if args.routing == "graph":
+        routing.set_backend(routing.GraphRouting(fakes.street_grid(seed=args.seed)))
+
+    crashes = fakes.seeded_crashes(args.crashes, seed=args.seed)
+    setup_store(args, crashes)
+    # one extra origin for the untimed warm-up call, so no timed call repeats it
+    origins = fakes.seeded_origins(args.iterations + 1, seed=args.seed)
+
+    scenarios = {}
+    for name in args.scenarios:
+        print(f"Running {name}...")
+        if name == "backfill":
+            scenarios[name] = bench_backfill(args, crashes)
+        else:
+            scenarios[name] = globals()[f"bench_{name}"](args, origins)
+        summary = scenarios[name]
+        print(
+            f"  p50 {summary['p50_ms']:.1f} ms  p95 {summary['p95_ms']:.1f} ms  "
+            f"p99 {summary['p99_ms']:.1f} ms  {summary['throughput_per_s']} {summary['unit']}/s"
+        )
+
+    return {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "scenarios": scenarios,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks over local fakes")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--backfill-iterations", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1, help="route_finder requests in flight")
+    parser.add_argument("--distance", type=float, default=5.0, help="target route km")
+    parser.add_argument("--crashes", type=int, default=60_000, help="size of the seeded dataset")
+    parser.add_argument("--page-size", type=int, default=10_000, help="backfill rows per page")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--route-latency-ms", type=float, default=120)
+    parser.add_argument("--geocode-latency-ms", type=float, default=40)
+    parser.add_argument("--llm-latency-ms", type=float, default=600)
+    parser.add_argument("--lookup-ms-per-point", type=float, default=0.5,
+                        help="route_scoring database time per sample point")
+    parser.add_argument("--socrata-latency-ms", type=float, default=150)
+    parser.add_argument("--store", choices=("index", "postgres"), default="index")
+    parser.add_argument("--routing", choices=("google", "graph"), default="google")
+    parser.add_argument("--seed-db", action="store_true", help="load the seeded crashes into Postgres")
+    parser.add_argument("--out", type=Path, help="results file (default benchmarks/results/offline-<time>.json)")
+    parser.add_argument("--compare", type=Path, help="earlier results file to diff against")
+    parser.add_argument("--verbose", action="store_true", help="debug logging from the code under test")
+    args = parser.parse_args()
+
+    results = run(args)
+    out = args.out or RESULTS_DIR / f"offline-{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {out}")
+
+    if args.compare:
+        compare(json.loads(args.compare.read_text()), results)
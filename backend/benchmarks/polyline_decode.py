@@ -0,0 +1,48 @@
+"""
+Microbenchmark: dict-based polyline decode + sampling vs the NumPy array path
+
+    cd backend && python -m benchmarks.polyline_decode [--points 500 5000 50000]
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+import polyline
+
+import polyline_safety_analysis as p
+
+
+def synthetic_polyline(n_points, seed=0):
+    """Random walk through Manhattan at roughly 10 m per vertex"""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.0001, size=(n_points, 2))
+    coords = np.round(np.cumsum(steps, axis=0) + [40.7296, -73.9833], 5)
+    return polyline.encode([tuple(point) for point in coords])
+
+
+def dict_path(encoded):
+    return p.sample_route_points(p.decode_route_polyline(encoded), max_samples=5)
+
+
+def array_path(encoded):
+    return p.sample_route_array(p.decode_polyline_array(encoded), max_samples=5)
+
+
+def run(sizes, number=20):
+    print(f"{'points':>8} {'dicts (ms)':>12} {'array (ms)':>12} {'speedup':>8}")
+    for n_points in sizes:
+        encoded = synthetic_polyline(n_points)
+        assert np.allclose(p.decode_polyline_array(encoded), polyline.decode(encoded))
+
+        dict_ms = min(timeit.repeat(lambda: dict_path(encoded), number=number, repeat=3)) / number * 1e3
+        array_ms = min(timeit.repeat(lambda: array_path(encoded), number=number, repeat=3)) / number * 1e3
+        print(f"{n_points:>8} {dict_ms:>12.3f} {array_ms:>12.3f} {dict_ms / array_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Polyline decode microbenchmark")
+    parser.add_argument("--points", type=int, nargs="+", default=[500, 5000, 50000])
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+    run(args.points, number=args.number)
@@ -0,0 +1,107 @@
+"""
+Row counts and query times for the crash radius query, full history vs days_back windows
+
+Run it before and after `python migrate.py` to see what the indexes buy:
+
+    cd backend && python -m benchmarks.time_window [--radius 0.5] [--repeat 5] [--out before.json]
+
+"full history" is the query as it ran before days_back was honoured. --out
+keeps the indexes, row count and one full EXPLAIN plan per window alongside
+the timings (see benchmarks/README.md).
+"""
+
+import argparse
+import json
+import math
+import statistics
+from pathlib import Path
+
+import db
+import utils
+
+POINTS = [
+    (40.729652, -73.983348),  # East Village
+    (40.758896, -73.985130),  # Times Square
+    (40.678178, -73.944158),  # Crown Heights
+    (40.844782, -73.864827),  # Bronx Park East
+]
+WINDOWS = [None, 365, 180, 60, 30, 7]
+
+
+def explain(cursor, lat, lng, radius_km, days_back):
+    lat_buffer = radius_km / 111.0
+    lng_buffer = radius_km / (111.0 * math.cos(math.radians(lat)))
+    since = utils.window_start(days_back)
+    date_filter = "AND crash_date >= %s" if since else ""
+
+    cursor.execute(
+        f"""
+        EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)
+        SELECT collision_id, crash_date, latitude, longitude, injuries, fatalities
+        FROM crashes
+        WHERE latitude BETWEEN %s AND %s
+        AND longitude BETWEEN %s AND %s
+        {date_filter}
+        """,
+        (lat - lat_buffer, lat + lat_buffer, lng - lng_buffer, lng + lng_buffer)
+        + ((since,) if since else ()),
+    )
+    plan = cursor.fetchone()[0]
+    plan = plan[0] if isinstance(plan, list) else json.loads(plan)[0]
+    return {
+        "rows": plan["Plan"]["Actual Rows"],
+        "buffers": plan["Plan"].get("Shared Hit Blocks", 0) + plan["Plan"].get("Shared Read Blocks", 0),
+        "ms": plan["Execution Time"],
+        "node": plan["Plan"]["Node Type"],
+        "plan": plan["Plan"],
+    }
+
+
+def run(radius_km=0.5, repeat=5):
+    results = []
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'crashes' ORDER BY indexname"
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        print("Indexes on crashes:", ", ".join(indexes))
+        cursor.execute("SELECT COUNT(*) FROM crashes")
+        n_rows = cursor.fetchone()[0]
+        print(f"Rows in crashes: {n_rows}\n")
+
+        for days_back in WINDOWS:
+            runs = [
+                explain(cursor, lat, lng, radius_km, days_back)
+                for _ in range(repeat)
+                for lat, lng in POINTS
+            ]
+            results.append(
+                {
+                    "window": "full history" if days_back is None else f"{days_back} days",
+                    "avg_rows": statistics.mean(r["rows"] for r in runs),
+                    "avg_buffers": statistics.mean(r["buffers"] for r in runs),
+                    "median_ms": statistics.median(r["ms"] for r in runs),
+                    "plan": runs[-1]["node"],
+                    "explain": runs[-1]["plan"],
+                }
+            )
+
+    print(f"{'window':>14} {'rows':>8} {'buffers':>8} {'median ms':>10}  plan")
+    for r in results:
+        print(
+            f"{r['window']:>14} {r['avg_rows']:>8.1f} {r['avg_buffers']:>8.1f} "
+            f"{r['median_ms']:>10.3f}  {r['plan']}"
+        )
+    return {"indexes": indexes, "rows": n_rows, "radius_km": radius_km, "windows": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--radius", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", type=Path, help="write the results and plans as JSON")
+    args = parser.parse_args()
+    results = run(radius_km=args.radius, repeat=args.repeat)
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2, default=str))
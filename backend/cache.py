@@ -0,0 +1,267 @@
+"""
+Two-tier response cache: an in-process LRU in front of a persistent SQLite store
+
+Both tiers expire entries after a TTL and evict the oldest entries once full.
+Keys are tuples (quantize coordinates with quantize() first so nearby requests
+share an entry); values must be JSON-serializable. Set CacheConfig.BYPASS or
+call set_bypass(True) to skip caching entirely.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from constants import CacheConfig
+
+log = logging.getLogger(__name__)
+
+bypass = CacheConfig.BYPASS
+
+
+class TTLCache:
+    """Thread-safe LRU with per-entry expiry and hit/miss counters"""
+
+    def __init__(self, maxsize=CacheConfig.MEMORY_SIZE, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    One in-flight computation per key, shared by every concurrent caller
+
+    Event-loop local: callers await the same task, shielded so a disconnecting
+    caller doesn't cancel it for the others. The key is released as soon as
+    the task finishes; put a TTLCache in front to reuse finished results.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"in_flight": len(self._inflight), "calls": self.calls, "shared": self.shared}
+
+
+class SqliteStore:
+    """Persistent key/value table per namespace, shared across processes on the host"""
+
+    def __init__(self, path=CacheConfig.PATH, maxsize=CacheConfig.STORE_SIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._tables = set()
+
+    def _table(self, namespace):
+        table = f"cache_{namespace}"
+        if table not in self._tables:
+            self._conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_stored_idx ON {table} (stored_at)"
+            )
+            self._tables.add(table)
+        return table
+
+    def get(self, namespace, key):
+        with self._lock:
+            table = self._table(namespace)
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            table = self._table(namespace)
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {table} (key, value, expires_at, stored_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+            self._conn.commit()
+
+    def evict(self, namespace):
+        """Drop expired rows, then the oldest rows beyond maxsize"""
+        with self._lock:
+            table = self._table(namespace)
+            self._conn.execute(f"DELETE FROM {table} WHERE expires_at <= ?", (time.time(),))
+            self._conn.execute(
+                f"""
+                DELETE FROM {table} WHERE key IN (
+                    SELECT key FROM {table} ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.maxsize,),
+            )
+            self._conn.commit()
+
+    def clear(self, namespace):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self._table(namespace)}")
+            self._conn.commit()
+
+
+class TwoTierCache:
+    def __init__(self, namespace, ttl, store=None, maxsize=CacheConfig.MEMORY_SIZE):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._store = store
+        self.store_hits = 0
+        self._writes = 0
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = get_store()
+        return self._store
+
+    def get(self, key):
+        if bypass:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        try:
+            value = self.store.get(self.namespace, _encode(key))
+        except sqlite3.Error as e:
+            log.warning("Cache store unavailable (%s): %s", self.namespace, e)
+            return None
+        if value is not None:
+            self.store_hits += 1
+            self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        if bypass:
+            return
+        self.memory.set(key, value)
+        try:
+            self.store.set(self.namespace, _encode(key), value, self.ttl)
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self.store.evict(self.namespace)
+        except sqlite3.Error as e:
+            log.warning("Cache store unavailable (%s): %s", self.namespace, e)
+
+    def stats(self):
+        memory = self.memory.stats()
+        hits = memory["hits"] + self.store_hits
+        lookups = memory["hits"] + memory["misses"]
+        return {
+            "memory_hits": memory["hits"],
+            "store_hits": self.store_hits,
+            "misses": lookups - hits,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_size": memory["size"],
+            "evictions": memory["evictions"],
+        }
+
+
+def _encode(key):
+    return json.dumps(key, separators=(",", ":"))
+
+
+def quantize(lat, lng, precision=CacheConfig.COORD_PRECISION):
+    return round(float(lat), precision), round(float(lng), precision)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SqliteStore()
+    return _store
+
+
+def set_bypass(value):
+    global bypass
+    bypass = bool(value)
+
+
+geocodes = TwoTierCache("geocode", ttl=CacheConfig.GEOCODE_TTL)
+routes = TwoTierCache("route", ttl=CacheConfig.ROUTE_TTL)
+
+
+def stats():
+    return {"geocode": geocodes.stats(), "route": routes.stats(), "bypass": bypass}
@@ -40,13 +40,146 @@ class DatabaseConfig(StrEnum):
     USER = "lpietrewicz"
     PASSWORD = "" 
 
+class PoolConfig(IntEnum):
+    MIN_SIZE = 1
+    MAX_SIZE = 10
+    CHECKOUT_TIMEOUT = 5  # seconds to wait for a free connection
+    MAX_IDLE = 300  # seconds before an idle connection is re-checked
+
 class APIConfig(StrEnum):
     NYC_CRASHES_URL = "https://data.cityofnewyork.us/resource/h9gi-nx95.json"
-    REQUEST_LIMIT = "50000"
+    NYC_CRASHES_CSV_URL = "https://data.cityofnewyork.us/resource/h9gi-nx95.csv"
+    REQUEST_LIMIT = "50000"  # rows per page
 
 class ScheduleConfig(StrEnum):
     DAILY_TIME = "02:00"
-    LOG_LEVEL = "INFO"
+    LOG_LEVEL = "INFO"  # root logging level (telemetry.configure_logging); LOG_LEVEL env overrides
+
+class HttpConfig:
+    # outbound Google calls made by async_routes.py
+    MAX_CONCURRENCY = 16  # in-flight requests per engine
+    MAX_KEEPALIVE = 16
+    TIMEOUT = 10.0  # seconds per call
+    RETRIES = 3  # attempts after the first
+    BACKOFF = 0.25  # seconds, doubled on each retry
+
+class RoutingConfig:
+    # walking distance/polyline backend for candidate endpoints (see routing.py)
+    BACKEND = "google"  # "graph" routes on the local street graph instead
+    GRAPH_DIR = "street_graph"
+    SNAP_KM = 0.2  # how far a point may be from its nearest graph node
+    WALK_SPEED_KMH = 5.0
+
+class LoopConfig:
+    # closed loop routes on the street graph (see loops.py)
+    SAFETY_WEIGHT = 1.0  # edge cost = metres * (1 + SAFETY_WEIGHT * risk)
+    DAYS_BACK = 365  # crash window behind the edge risk weights
+    INJURY_WEIGHT = 1.0  # a crash counts 1 + injuries * this + fatalities * FATALITY_WEIGHT
+    FATALITY_WEIGHT = 10.0
+    RISK_CELL = 0.0005  # degrees, ~50 m crash density cells
+    RISK_SMOOTH = 1  # cells of box smoothing either side
+    RISK_CAP = 10.0  # risk is density relative to the average street, capped here
+    MIN_ACCURACY = 90  # percent of the target length
+    MAX_OVERLAP = 0.3  # share of a loop that may be walked twice (out-and-back stem)
+    SECTORS = 24  # bearing sectors waypoints are picked from
+    DETOUR = 1.3  # assumed street/straight ratio when pairing waypoints
+    TIME_BUDGET = 0.5  # seconds of search per request
+    MAX_EXPANSIONS = 200_000  # settled nodes per graph search
+
+class SearchConfig:
+    # adaptive endpoint search (see async_routes.RouteEngine.adaptive_route_finder)
+    ADAPTIVE = True  # False runs the fixed multiplier phases
+    CALL_BUDGET = 24  # Google calls (geocode + routes) one search may make
+    GOAL_ACCURACY = 90  # percent; a direction at or above this is done
+    MIN_ROUTES = 3  # stop once this many directions meet the goal
+    HEDGE = 1  # extra directions tried per round beyond those still needed
+    MAX_ATTEMPTS = 3  # endpoints tried per direction
+    MAX_STEP = 0.5  # a refinement moves the endpoint by at most this fraction
+
+class CacheConfig:
+    # geocode / route response cache (see cache.py)
+    BYPASS = False  # True skips both tiers entirely
+    PATH = "runsafe_cache.sqlite3"
+    MEMORY_SIZE = 2048  # entries per in-process LRU
+    STORE_SIZE = 100_000  # rows per persistent table
+    GEOCODE_TTL = 30 * 24 * 3600  # seconds
+    ROUTE_TTL = 7 * 24 * 3600
+    COORD_PRECISION = 4  # decimal places kept in keys, ~11 m
+
+class PointMemoConfig:
+    # memoized point safety lookups while scoring (see point_memo.py)
+    ENABLED = True
+    COORD_PRECISION = 4  # decimal places, ~11 m: points that round together share a lookup
+    SHARED = False  # also keep lookups in a process-wide TTL LRU across requests
+    SHARED_SIZE = 50_000
+    SHARED_TTL = 900  # seconds; cleared on every crash sync regardless
+
+class ParallelConfig:
+    # per-point safety scoring in polyline_safety_analysis
+    WORKERS = 8
+    MIN_BATCH = 16  # sample points in a request below which one batch lookup beats the pool
+    USE_PROCESSES = False  # True for CPU-bound scoring in a process pool
+
+class CorridorConfig:
+    # full-polyline corridor scoring (see corridor.py)
+    ENABLED = True
+    BUFFER_KM = 0.05  # corridor half-width, ~50 m either side of the line
+    BLOCK_SIZE = 2048  # crashes per distance block, bounds memory to BLOCK_SIZE x segments
+    WINDOW_KM = 0.15  # densest stretches are reported over equal windows of about this length
+
+class CoalesceConfig:
+    COORD_PRECISION = 4  # ~10 m: requests from the same start line share a computation
+    DISTANCE_STEP = 0.1  # km
+    RESULT_TTL = 60  # seconds a finished result answers repeat requests
+    RESULT_SIZE = 512
+
+class LLMConfig:
+    MODEL = "gpt-4o-mini"
+    TEMPERATURE = 0.3
+    MAX_TOKENS = 800
+    CACHE_TTL = 3600  # seconds a recommendation is reused for an identical prompt
+    CACHE_SIZE = 256
+
+class TelemetryConfig:
+    ENABLED = True
+    # histogram bucket bounds (seconds) for stage and request timings
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class BaselineGrid:
+    # neighbourhood baseline grid (see baseline.py); bounds cover the five boroughs
+    RESOLUTION = 0.0005  # degrees per cell
+    LAT_MIN = 40.45
+    LAT_MAX = 40.95
+    LNG_MIN = -74.30
+    LNG_MAX = -73.65
+    SAMPLE_SPACING = 0.01  # spacing of the 5x5 neighbourhood sample points
+    PATH = "baseline_grid.npz"
+
+class TileConfig:
+    RESOLUTION = 0.0025  # degrees, ~250 m tiles
+    RADII = (0.5, 1.0)  # km; one precomputed layer set per radius
+    DAYS_BACK = 60  # window the route scorer uses
+    PATH = "safety_tiles.bin"
+    USE_FOR_ROUTES = False  # score route sample points from tiles instead of the index/SQL
+    HEATMAP_MAX_CELLS = 20000
+
+class LandMaskConfig:
+    # offline land/water raster for endpoint filtering (see land_mask.py)
+    ENABLED = True  # use the mask when PATH exists and came from polygons, reverse geocoding otherwise
+    PATH = "land_mask.bin"
+    GEOJSON = "borough_boundaries_clipped.geojson"  # water-clipped borough polygons (NYC Open Data)
+    RESOLUTION = 0.0005  # degrees per cell, ~50 m
+    MIN_CRASHES = 1  # crashes that mark a cell as street when building --from-crashes
+    DILATE = 2  # cells grown around street cells, covering blocks with no recorded crash
+    SNAP_KM = 0.3  # water endpoints move to the nearest land cell within this, else drop
+    CHECK_ADDRESSES = True  # still geocode masked endpoints so constants.ignore applies to them
+
+class CrashIndexConfig:
+    ENABLED = True  # False sends radius queries to Postgres instead (see crash_index.py)
+    CELL_SIZE = 0.005  # degrees per bucket, roughly 0.5 km
+    USE_SNAPSHOT = True  # map the index from SNAPSHOT_DIR instead of querying Postgres per worker
+    SNAPSHOT_DIR = "crash_snapshot"
+
 
 ignore = [
     "North America",
@@ -0,0 +1,265 @@
+"""
+Corridor scoring over the full route polyline
+
+Instead of 0.5 km circles around a handful of sample points (which overlap on
+short routes, leave gaps on long ones and count the same crash several times),
+the decoded polyline is buffered by BUFFER_KM, the crashes inside the buffer
+are gathered once and each one is assigned to its nearest segment. Everything
+runs on NumPy arrays in a local flat projection (km), which is accurate to well
+under a metre at route scale.
+
+Densities are reported per window, not per raw segment: Google polylines have
+many segments a few metres long, where one crash would read as hundreds per
+km. Crashes are placed at their distance along the route and binned into
+equal windows of about WINDOW_KM, so the densest windows are the dangerous
+stretches rather than the shortest segments.
+"""
+
+import math
+
+import numpy as np
+
+import baseline
+import crash_index
+import db
+import utils
+from constants import CorridorConfig
+
+KM_PER_DEG_LAT = 111.0
+
+
+def project(lats, lngs, lat0, lng0):
+    """Equirectangular projection to km around (lat0, lng0)"""
+    x = (np.asarray(lngs) - lng0) * KM_PER_DEG_LAT * math.cos(math.radians(lat0))
+    y = (np.asarray(lats) - lat0) * KM_PER_DEG_LAT
+    return x, y
+
+
+def point_segment_distances(px, py, ax, ay, bx, by):
+    """(points, segments) matrix of distances from each point to each segment"""
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    # zero-length segments (repeated vertices) degrade to point distances
+    safe_length_sq = np.where(length_sq > 0, length_sq, 1.0)
+
+    t = ((px[:, None] - ax) * dx + (py[:, None] - ay) * dy) / safe_length_sq
+    t = np.clip(np.where(length_sq > 0, t, 0.0), 0.0, 1.0)
+    cx = ax + t * dx
+    cy = ay + t * dy
+    return np.hypot(px[:, None] - cx, py[:, None] - cy)
+
+
+def near_polyline(px, py, vx, vy, cell_km):
+    """Mask of points whose grid cell, or a neighbouring one, holds a polyline vertex"""
+    cell_km = max(cell_km, 1e-6)
+    vertex_keys = np.unique(
+        np.floor(vx / cell_km).astype(np.int64) * 1_000_003 + np.floor(vy / cell_km).astype(np.int64)
+    )
+    cx = np.floor(px / cell_km).astype(np.int64)
+    cy = np.floor(py / cell_km).astype(np.int64)
+    near = np.zeros(len(px), dtype=bool)
+    for ox in (-1, 0, 1):
+        for oy in (-1, 0, 1):
+            near |= np.isin((cx + ox) * 1_000_003 + (cy + oy), vertex_keys)
+    return near
+
+
+def crashes_in_box(lat_lo, lat_hi, lng_lo, lng_hi, days_back=None):
+    """(lats, lngs, injuries, fatalities) of crashes in a box, from the index or SQL"""
+    if crash_index.enabled:
+        index = crash_index.get_index()
+        idx = index.query_box(lat_lo, lat_hi, lng_lo, lng_hi, days_back=days_back)
+        return index.lats[idx], index.lngs[idx], index.injuries[idx], index.fatalities[idx]
+
+    since = utils.window_start(days_back)
+    date_filter = "AND crash_date >= %s" if since else ""
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT latitude, longitude, COALESCE(injuries, 0), COALESCE(fatalities, 0)
+            FROM crashes
+            WHERE latitude BETWEEN %s AND %s
+            AND longitude BETWEEN %s AND %s
+            {date_filter}
+            """,
+            (lat_lo, lat_hi, lng_lo, lng_hi) + ((since,) if since else ()),
+        )
+        rows = cursor.fetchall()
+    if not rows:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    lats, lngs, injuries, fatalities = zip(*rows)
+    return (
+        np.array(lats, dtype=np.float64),
+        np.array(lngs, dtype=np.float64),
+        np.array(injuries, dtype=np.int32),
+        np.array(fatalities, dtype=np.int32),
+    )
+
+
+def route_windows(total_km, window_km=CorridorConfig.WINDOW_KM):
+    """(start km, length km) of equal windows covering the route, each about window_km"""
+    n_windows = max(int(round(total_km / window_km)), 1)
+    length = total_km / n_windows
+    return np.arange(n_windows) * length, length
+
+
+def score_corridor(lats, lngs, buffer_km=CorridorConfig.BUFFER_KM, days_back=60,
+                   block_size=CorridorConfig.BLOCK_SIZE, window_km=CorridorConfig.WINDOW_KM):
+    """
+    Crashes within buffer_km of the polyline, each counted once on its nearest segment
+
+    Args:
+        lats, lngs: polyline vertices
+        buffer_km: corridor half-width
+        window_km: target length of the windows densities are reported over
+
+    Returns:
+        dict of per-segment arrays (length_km, crashes, injuries, fatalities),
+        per-window arrays under "windows" (start_km, length_km, crashes,
+        injuries, fatalities, crashes_per_km) and corridor totals
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    n_segments = max(len(lats) - 1, 0)
+    if n_segments == 0:
+        return None
+
+    lat0, lng0 = float(lats.mean()), float(lngs.mean())
+    vx, vy = project(lats, lngs, lat0, lng0)
+    ax, ay, bx, by = vx[:-1], vy[:-1], vx[1:], vy[1:]
+    lengths = np.hypot(bx - ax, by - ay)
+
+    lat_pad = buffer_km / KM_PER_DEG_LAT
+    lng_pad = buffer_km / (KM_PER_DEG_LAT * math.cos(math.radians(lat0)))
+    crash_lats, crash_lngs, injuries, fatalities = crashes_in_box(
+        lats.min() - lat_pad, lats.max() + lat_pad,
+        lngs.min() - lng_pad, lngs.max() + lng_pad,
+        days_back=days_back,
+    )
+    px, py = project(crash_lats, crash_lngs, lat0, lng0)
+
+    # the bounding box of a diagonal route is mostly empty space: keep only
+    # crashes in or next to a grid cell the polyline passes through
+    near = near_polyline(px, py, vx, vy, cell_km=buffer_km + float(lengths.max()))
+    px, py, injuries, fatalities = px[near], py[near], injuries[near], fatalities[near]
+
+    # nearest segment per crash, in blocks so memory stays block_size x segments
+    nearest = np.empty(len(px), dtype=np.int64)
+    nearest_distance = np.empty(len(px))
+    for start in range(0, len(px), block_size):
+        block = slice(start, start + block_size)
+        distances = point_segment_distances(px[block], py[block], ax, ay, bx, by)
+        nearest[block] = distances.argmin(axis=1)
+        nearest_distance[block] = distances[np.arange(distances.shape[0]), nearest[block]]
+
+    inside = nearest_distance <= buffer_km
+    segment = nearest[inside]
+    crashes = np.bincount(segment, minlength=n_segments)
+    segment_injuries = np.bincount(segment, weights=injuries[inside], minlength=n_segments)
+    segment_fatalities = np.bincount(segment, weights=fatalities[inside], minlength=n_segments)
+
+    # each crash's distance along the route: its segment's start plus its projection onto it
+    total_length = float(lengths.sum())
+    route_km = np.concatenate([[0.0], np.cumsum(lengths)])
+    dx, dy = (bx - ax)[segment], (by - ay)[segment]
+    length_sq = dx * dx + dy * dy
+    t = np.divide(
+        (px[inside] - ax[segment]) * dx + (py[inside] - ay[segment]) * dy, length_sq,
+        out=np.zeros(len(segment)), where=length_sq > 0,
+    )
+    along = route_km[segment] + np.clip(t, 0.0, 1.0) * lengths[segment]
+
+    starts, window_length = route_windows(total_length, window_km)
+    window = np.minimum((along / window_length).astype(np.int64), len(starts) - 1)
+    window_crashes = np.bincount(window, minlength=len(starts))
+
+    return {
+        "length_km": lengths,
+        "crashes": crashes,
+        "injuries": segment_injuries.astype(np.int64),
+        "fatalities": segment_fatalities.astype(np.int64),
+        "windows": {
+            "start_km": starts,
+            "length_km": window_length,
+            "start_lat": np.interp(starts, route_km, lats),
+            "start_lng": np.interp(starts, route_km, lngs),
+            "crashes": window_crashes,
+            "injuries": np.bincount(window, weights=injuries[inside], minlength=len(starts)).astype(np.int64),
+            "fatalities": np.bincount(window, weights=fatalities[inside], minlength=len(starts)).astype(np.int64),
+            "crashes_per_km": window_crashes / max(window_length, 1e-9),
+        },
+        "total_length_km": total_length,
+        "total_crashes": int(crashes.sum()),
+        "total_injuries": int(segment_injuries.sum()),
+        "total_fatalities": int(segment_fatalities.sum()),
+        "buffer_km": buffer_km,
+        "center": (lat0, lng0),
+    }
+
+
+def corridor_safety(lats, lngs, buffer_km=CorridorConfig.BUFFER_KM, days_back=60,
+                    radius_km=0.5, top_segments=3, dangerous_below=80):
+    """
+    Corridor summary plus a safety score on the same logarithmic scale as the point scores
+
+    The neighbourhood p50 (crashes per radius_km box) is scaled to the corridor's
+    area (2 * buffer * length), so a ratio of 1 means "as dangerous as a typical
+    nearby stretch of the same size". Each window is scored the same way against
+    its own area; windows under dangerous_below are listed in route order.
+    """
+    # imported here: polyline_safety_analysis imports this module
+    import polyline_safety_analysis as p
+
+    corridor = score_corridor(lats, lngs, buffer_km=buffer_km, days_back=days_back)
+    if corridor is None:
+        return None
+
+    lat0, lng0 = corridor["center"]
+    p50 = baseline.area_percentiles(lat0, lng0, radius_km, days_back=days_back)
+    box_area = (2 * radius_km) ** 2
+    corridor_area = 2 * buffer_km * corridor["total_length_km"]
+    scale = corridor_area / box_area
+
+    ratios = [
+        p.baseline_ratio(corridor[f"total_{attr}"], p50[attr] * scale)
+        for attr in ("crashes", "injuries", "fatalities")
+    ]
+    windows = corridor["windows"]
+    window_scale = 2 * buffer_km * windows["length_km"] / box_area
+    window_scores = [
+        p.calculate_safety_score_logarithmic(*(
+            p.baseline_ratio(int(windows[attr][i]), p50[attr] * window_scale)
+            for attr in ("crashes", "injuries", "fatalities")
+        ))
+        for i in range(len(windows["start_km"]))
+    ]
+    worst = np.argsort(-windows["crashes_per_km"], kind="stable")[:top_segments]
+
+    def window(i):
+        return {
+            "window_index": int(i),
+            "start_km": round(float(windows["start_km"][i]), 3),
+            "start": {"lat": float(windows["start_lat"][i]), "lng": float(windows["start_lng"][i])},
+            "length_km": round(float(windows["length_km"]), 3),
+            "crashes": int(windows["crashes"][i]),
+            "injuries": int(windows["injuries"][i]),
+            "fatalities": int(windows["fatalities"][i]),
+            "crashes_per_km": round(float(windows["crashes_per_km"][i]), 1),
+            "safety_score": round(window_scores[i], 1),
+        }
+
+    return {
+        "safety_score": round(p.calculate_safety_score_logarithmic(*ratios), 1),
+        "length_km": round(corridor["total_length_km"], 2),
+        "buffer_km": buffer_km,
+        "total_crashes": corridor["total_crashes"],
+        "total_injuries": corridor["total_injuries"],
+        "total_fatalities": corridor["total_fatalities"],
+        "crashes_per_km": round(corridor["total_crashes"] / max(corridor["total_length_km"], 1e-9), 2),
+        # fixed-length stretches of the route, densest first
+        "densest_segments": [window(i) for i in worst if windows["crashes"][i] > 0],
+        "dangerous_windows": [
+            window(i) for i, score in enumerate(window_scores) if score < dangerous_below
+        ],
+    }
@@ -0,0 +1,375 @@
+"""
+In-memory spatial index over the crashes table
+
+The whole table (~50k rows a year) is loaded once into flat NumPy columns,
+sorted by grid bucket and then by date, with an offsets array marking where
+each bucket starts. A radius query only touches the buckets overlapping the
+search box, so it costs microseconds instead of a Postgres round trip plus a
+Python distance loop.
+
+Set CrashIndexConfig.ENABLED = False (or call set_enabled(False)) to send
+queries back to the SQL path in polyline_safety_analysis.
+
+Snapshots: with CrashIndexConfig.USE_SNAPSHOT the sorted columns and offsets
+are also written as .npy files under SNAPSHOT_DIR/<version>/, and workers
+memory-map them read-only instead of querying Postgres. Every worker on the
+host shares the same page-cache pages, and startup is a handful of mmaps.
+SNAPSHOT_DIR/CURRENT names the live version and is swapped atomically, so
+readers never see a half-written snapshot. Only one process exports at a time
+(an flock on SNAPSHOT_DIR/.lock): after a sync the writer calls rebuild() and
+every other worker reload()s, re-mapping the version CURRENT now names.
+
+Usage:
+    python crash_index.py export    # snapshot the crashes table
+    python crash_index.py info
+"""
+
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import db
+import utils
+from constants import BaselineGrid, CrashIndexConfig
+
+enabled = CrashIndexConfig.ENABLED
+
+COLUMNS = ("lats", "lngs", "dates", "injuries", "fatalities", "collision_ids", "offsets")
+GRID_FIELDS = ("cell_size", "lat_origin", "lng_origin", "n_rows", "n_cols")
+
+
+class CrashIndex:
+    def __init__(self, lats, lngs, dates, injuries, fatalities, collision_ids,
+                 cell_size=CrashIndexConfig.CELL_SIZE):
+        self.cell_size = float(cell_size)
+
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        self.lat_origin = float(lats.min()) if len(lats) else 0.0
+        self.lng_origin = float(lngs.min()) if len(lngs) else 0.0
+
+        rows = self._rows(lats)
+        cols = self._cols(lngs)
+        self.n_cols = int(cols.max()) + 1 if len(cols) else 1
+        self.n_rows = int(rows.max()) + 1 if len(rows) else 1
+        keys = rows * self.n_cols + cols
+
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        order = np.lexsort((dates, keys))
+
+        self.lats = lats[order]
+        self.lngs = lngs[order]
+        self.dates = dates[order]
+        self.injuries = np.asarray(injuries, dtype=np.int32)[order]
+        self.fatalities = np.asarray(fatalities, dtype=np.int32)[order]
+        self.collision_ids = np.asarray(collision_ids, dtype=np.int64)[order]
+
+        # offsets[k]:offsets[k + 1] is the slice of rows in bucket k
+        self.offsets = np.searchsorted(
+            keys[order], np.arange(self.n_rows * self.n_cols + 1)
+        )
+
+    def __len__(self):
+        return len(self.lats)
+
+    def save_snapshot(self, path):
+        """Write each column as .npy plus the grid parameters to meta.json"""
+        os.makedirs(path, exist_ok=True)
+        for column in COLUMNS:
+            np.save(os.path.join(path, f"{column}.npy"), np.ascontiguousarray(getattr(self, column)))
+        meta = {field: getattr(self, field) for field in GRID_FIELDS}
+        meta["rows"] = len(self)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load_snapshot(cls, path, mmap=True):
+        """Index over a snapshot's columns; with mmap they stay read-only views of the files"""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        index = cls.__new__(cls)
+        for field in GRID_FIELDS:
+            setattr(index, field, meta[field])
+        for column in COLUMNS:
+            setattr(index, column, np.load(
+                os.path.join(path, f"{column}.npy"), mmap_mode="r" if mmap else None
+            ))
+        return index
+
+    def _rows(self, lats):
+        return np.floor((lats - self.lat_origin) / self.cell_size).astype(np.int64)
+
+    def _cols(self, lngs):
+        return np.floor((lngs - self.lng_origin) / self.cell_size).astype(np.int64)
+
+    def candidates(self, lat, lng, radius_km):
+        """Row indices of every crash in the buckets overlapping the search box"""
+        lat_buffer = radius_km / 111.0
+        lng_buffer = radius_km / (111.0 * np.cos(np.radians(lat)))
+        return self.box_candidates(
+            lat - lat_buffer, lat + lat_buffer, lng - lng_buffer, lng + lng_buffer
+        )
+
+    def box_candidates(self, lat_lo, lat_hi, lng_lo, lng_hi):
+        """Row indices of every crash in the buckets overlapping a lat/lng box"""
+        r0, r1 = self._rows(np.array([lat_lo, lat_hi]))
+        c0, c1 = self._cols(np.array([lng_lo, lng_hi]))
+        r0, r1 = max(r0, 0), min(r1, self.n_rows - 1)
+        c0, c1 = max(c0, 0), min(c1, self.n_cols - 1)
+        if r0 > r1 or c0 > c1:
+            return np.empty(0, dtype=np.int64)
+
+        # buckets in one grid row are contiguous, so each row is one slice
+        row_keys = np.arange(r0, r1 + 1) * self.n_cols
+        starts = self.offsets[row_keys + c0]
+        ends = self.offsets[row_keys + c1 + 1]
+        return np.concatenate(
+            [np.arange(start, end) for start, end in zip(starts, ends)]
+        )
+
+    def query_radius(self, lat, lng, radius_km, days_back=None):
+        """
+        Crashes within radius_km of (lat, lng), optionally only the last days_back days
+
+        Returns:
+            (row indices, distances in km)
+        """
+        idx = self.candidates(lat, lng, radius_km)
+        since = utils.window_start(days_back)
+        if since is not None:
+            idx = idx[self.dates[idx] >= np.datetime64(since, "D")]
+        distances = utils.haversine_many(lat, lng, self.lats[idx], self.lngs[idx])
+
+        within = distances <= radius_km
+        return idx[within], distances[within]
+
+    def query_box(self, lat_lo, lat_hi, lng_lo, lng_hi, days_back=None):
+        """Row indices of crashes inside a lat/lng box, optionally only the last days_back days"""
+        idx = self.box_candidates(lat_lo, lat_hi, lng_lo, lng_hi)
+        since = utils.window_start(days_back)
+        if since is not None:
+            idx = idx[self.dates[idx] >= np.datetime64(since, "D")]
+        lats, lngs = self.lats[idx], self.lngs[idx]
+        inside = (lats >= lat_lo) & (lats <= lat_hi) & (lngs >= lng_lo) & (lngs <= lng_hi)
+        return idx[inside]
+
+    def aggregate(self, lat, lng, radius_km, days_back=None):
+        """Crash, injury and fatality totals within radius_km"""
+        idx, _ = self.query_radius(lat, lng, radius_km, days_back=days_back)
+        return {
+            "total_crashes": int(len(idx)),
+            "total_injuries": int(self.injuries[idx].sum()),
+            "total_fatalities": int(self.fatalities[idx].sum()),
+        }
+
+    def records(self, idx, distances):
+        """Rows in the same shape get_crashes_near_me builds from SQL results"""
+        return [
+            {
+                "crash_id": int(self.collision_ids[i]),
+                "date": str(self.dates[i]),
+                "distance_km": round(float(distance), 2),
+                "location": {"lat": float(self.lats[i]), "lng": float(self.lngs[i])},
+                "injuries": int(self.injuries[i]),
+                "fatalities": int(self.fatalities[i]),
+            }
+            for i, distance in zip(idx, distances)
+        ]
+
+
+def load_from_db():
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT latitude, longitude, crash_date::date,
+                   COALESCE(injuries, 0), COALESCE(fatalities, 0), collision_id
+            FROM crashes
+            WHERE latitude BETWEEN %s AND %s
+            AND longitude BETWEEN %s AND %s
+            """,
+            # keeps (0, 0) placeholders and other bad coordinates out of the grid
+            (BaselineGrid.LAT_MIN, BaselineGrid.LAT_MAX,
+             BaselineGrid.LNG_MIN, BaselineGrid.LNG_MAX),
+        )
+        rows = cursor.fetchall()
+
+    if not rows:
+        return CrashIndex([], [], [], [], [], [])
+    lats, lngs, dates, injuries, fatalities, collision_ids = zip(*rows)
+    return CrashIndex(
+        np.array(lats, dtype=np.float64),
+        np.array(lngs, dtype=np.float64),
+        np.array(dates, dtype="datetime64[D]"),
+        injuries,
+        fatalities,
+        collision_ids,
+    )
+
+
+def current_snapshot(root=CrashIndexConfig.SNAPSHOT_DIR):
+    """Directory of the live snapshot version (FileNotFoundError if none)"""
+    with open(os.path.join(root, "CURRENT")) as f:
+        return os.path.join(root, f.read().strip())
+
+
+def load_snapshot(root=CrashIndexConfig.SNAPSHOT_DIR):
+    return CrashIndex.load_snapshot(current_snapshot(root))
+
+
+def export_snapshot(index, root=CrashIndexConfig.SNAPSHOT_DIR, keep=2):
+    """
+    Write index as a new snapshot version and make it current
+
+    Older versions beyond `keep` are deleted; workers that still map them keep
+    their pages until they reload (unlinked files stay valid while mapped).
+    """
+    version = f"v{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}"
+    index.save_snapshot(os.path.join(root, version))
+
+    pointer = os.path.join(root, f"CURRENT.{os.getpid()}")
+    with open(pointer, "w") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(root, "CURRENT"))
+
+    versions = sorted(
+        name for name in os.listdir(root)
+        if name.startswith("v") and os.path.isdir(os.path.join(root, name))
+    )
+    for name in versions[:-keep]:
+        if name != version:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return os.path.join(root, version)
+
+
+def export_lock(root=CrashIndexConfig.SNAPSHOT_DIR):
+    """Cross-process lock (flock on root/.lock) held while a snapshot is exported"""
+    return utils.file_lock(os.path.join(root, ".lock"))
+
+
+def snapshot_from_db(root=CrashIndexConfig.SNAPSHOT_DIR):
+    """Export the crashes table and return the index mapped from the new snapshot"""
+    with export_lock(root):
+        export_snapshot(load_from_db(), root)
+    return load_snapshot(root)
+
+
+_index = None
+_index_path = None  # snapshot directory _index is mapped from
+_index_lock = threading.Lock()
+
+
+def _set_index(index, path=None):
+    global _index, _index_path
+    with _index_lock:
+        _index, _index_path = index, path
+    return index
+
+
+def _map_or_export(root=CrashIndexConfig.SNAPSHOT_DIR):
+    """(index, path) mapped from the current snapshot, exporting one first if there is none"""
+    try:
+        return load_snapshot(root), current_snapshot(root)
+    except FileNotFoundError:
+        pass
+    # cold start: one process exports, the others wait on the lock and then map its files
+    with export_lock(root):
+        try:
+            return load_snapshot(root), current_snapshot(root)
+        except FileNotFoundError:
+            export_snapshot(load_from_db(), root)
+    return load_snapshot(root), current_snapshot(root)
+
+
+def get_index():
+    """Process-wide index: mapped from the current snapshot, else loaded from the crashes table"""
+    global _index, _index_path
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if not CrashIndexConfig.USE_SNAPSHOT:
+                    _index = load_from_db()
+                else:
+                    _index, _index_path = _map_or_export()
+    return _index
+
+
+def rebuild():
+    """
+    Writer side of a refresh: export a new snapshot from the DB and map it
+
+    Only the process that changed the crashes table (the sync holding the
+    advisory lock, a backfill or the CLI) should call this; the other workers
+    reload() the snapshot it publishes.
+    """
+    if not CrashIndexConfig.USE_SNAPSHOT:
+        return _set_index(load_from_db())
+    index = snapshot_from_db()
+    return _set_index(index, current_snapshot())
+
+
+def reload():
+    """
+    Reader side of a refresh: map the snapshot CURRENT names, if it is newer
+
+    Without snapshots each process holds its own copy, so it reloads from the DB.
+    """
+    if not CrashIndexConfig.USE_SNAPSHOT:
+        return _set_index(load_from_db())
+    try:
+        path = current_snapshot()
+    except FileNotFoundError:
+        return _index
+    if path == _index_path:
+        return _index
+    return _set_index(load_snapshot(), path)
+
+
+def mapped_snapshot():
+    """Snapshot directory this process's index is mapped from, or None"""
+    return _index_path
+
+
+def reload_if_loaded():
+    """reload() in processes that have already loaded the index"""
+    if _index is not None:
+        return reload()
+    return None
+
+
+def rebuild_if_used():
+    """rebuild() after this process changed the crashes table, if the index is loaded or published"""
+    snapshot_exists = CrashIndexConfig.USE_SNAPSHOT and os.path.exists(
+        os.path.join(CrashIndexConfig.SNAPSHOT_DIR, "CURRENT")
+    )
+    if _index is not None or snapshot_exists:
+        return rebuild()
+    return None
+
+
+def set_enabled(value):
+    global enabled
+    enabled = bool(value)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+
+    if command == "export":
+        started = time.perf_counter()
+        with export_lock():
+            path = export_snapshot(load_from_db())
+        print(f"Crash snapshot written: {path} ({time.perf_counter() - started:.1f}s)")
+    elif command == "info":
+        started = time.perf_counter()
+        index = load_snapshot()
+        print(f"{current_snapshot()}: {len(index)} crashes, {index.n_rows}x{index.n_cols} buckets, "
+              f"mapped in {(time.perf_counter() - started) * 1000:.1f} ms")
+    else:
+        print(__doc__)
@@ -0,0 +1,240 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+import telemetry
+from constants import DatabaseConfig, PoolConfig
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection frees up within the checkout timeout"""
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor that reports every statement to telemetry as a db_query"""
+
+    def execute(self, query, vars=None):
+        telemetry.count("db_query")
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        telemetry.count("db_query")
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        telemetry.count("db_query")
+        return super().copy_expert(sql, file, size)
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections
+
+    Connections are health checked on checkout (closed, broken or long idle
+    connections are pinged and replaced) and rolled back on return so the
+    next borrower always gets a clean session. Pings and new connections run
+    outside the pool lock, on a slot reserved under it.
+    """
+
+    def __init__(
+        self,
+        min_size=PoolConfig.MIN_SIZE,
+        max_size=PoolConfig.MAX_SIZE,
+        timeout=PoolConfig.CHECKOUT_TIMEOUT,
+        max_idle=PoolConfig.MAX_IDLE,
+        db=DatabaseConfig,
+    ):
+        self.min_size = int(min_size)
+        self.max_size = int(max_size)
+        self.timeout = float(timeout)
+        self.max_idle = float(max_idle)
+        self._dsn = {
+            "host": db.HOST.value,
+            "database": db.DATABASE.value,
+            "user": db.USER.value,
+            "password": db.PASSWORD.value,
+        }
+
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, returned_at)
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._discarded = 0
+        self._closed = False
+
+    def _healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.max_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._discarded += 1
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _reserve(self, deadline):
+        """
+        Under the lock: take a slot, with an idle (connection, returned_at) or
+        (None, None) when the caller should open a new connection
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    self._in_use += 1
+                    return self._idle.pop()
+                if self._in_use < self.max_size:
+                    self._in_use += 1
+                    return None, None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"No database connection free after {self.timeout}s "
+                        f"({self._in_use}/{self.max_size} in use)"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, returned_at = self._reserve(deadline)
+            if conn is None:
+                return self._connect()
+            # health check outside the lock: a slow ping must not stall other checkouts and returns
+            if self._healthy(conn, returned_at):
+                return conn
+            with self._cond:
+                self._in_use -= 1
+                self._discarded += 1
+                self._cond.notify()
+            self._close(conn)
+
+    def _connect(self):
+        """Open a connection for a slot _reserve already counted"""
+        try:
+            conn = psycopg2.connect(**self._dsn, cursor_factory=CountingCursor)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        # the rollback talks to the server, so it also runs outside the lock
+        keep = not discard and not conn.closed
+        if keep:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                keep = False
+        with self._cond:
+            self._in_use -= 1
+            keep = keep and not self._closed
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discarded += 1
+            self._cond.notify()
+        if not keep:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success and rolls back on error"""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken or conn.closed)
+
+    def warm(self):
+        """Open connections up to min_size so the first requests don't pay setup"""
+        conns = [self.getconn() for _ in range(max(0, self.min_size - self.stats()["idle"]))]
+        for conn in conns:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "created": self._created,
+                "discarded": self._discarded,
+                "max_size": self.max_size,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide pool, created lazily on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def get_connection():
+    """Shortcut for `with db.get_connection() as conn:`"""
+    return get_pool().connection()
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -1,14 +1,26 @@
+import logging
 import math
+import numpy as np
 import requests
 import os
 from dotenv import load_dotenv
+import cache
 import constants as const
+import land_mask
+import routing
+import telemetry
 import utils
 from constants import Direction, CompassBearing, MapsApi
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
 
+OPTIMAL_MULTIPLIER = 0.4
+BACKUP_MULTIPLIERS = [0.35, 0.45]  # Based on your data
+
+
+@telemetry.timed("endpoints")
 def generate_optimized_endpoints(
     start_lat, start_lng, target_distance_km, d=Direction, cb=CompassBearing
 ):
@@ -20,47 +32,51 @@ def generate_optimized_endpoints(
         111.0 * math.cos(math.radians(start_lat))
     )  # degrees longitude
 
-    print(f"   Target distance: {target_distance_km} km")
-    print(f"   Latitude delta: {lat_delta:.6f} degrees")
-    print(f"   Longitude delta: {lng_delta:.6f} degrees")
-    print()
+    log.debug(
+        "Target distance: %s km, latitude delta: %.6f deg, longitude delta: %.6f deg",
+        target_distance_km, lat_delta, lng_delta,
+    )
 
     endpoints = []  # initializing endpoints
 
-    for direction in d:
-        bearing = cb[direction.name].value
-        direction_name = direction.value
-        print(f"Bearing: {bearing}, Name: {direction_name}")
+    # bearing --> radians, all directions at once
+    bearings = np.array([cb[direction.name].value for direction in d])
+    bearing_rad = np.radians(bearings)
+
+    # calculate new coordinates
+    new_lats = start_lat + (lat_delta * np.cos(bearing_rad))
+    new_lngs = start_lng + (lng_delta * np.sin(bearing_rad))
 
-        # bearing --> radians
-        bearing_rad = math.radians(bearing)
+    # verify distance using Haversine
+    actual_distances = utils.haversine_many(start_lat, start_lng, new_lats, new_lngs)
 
-        # calculate new coordinates
-        new_lat = start_lat + (lat_delta * math.cos(bearing_rad))
-        new_lng = start_lng + (lng_delta * math.sin(bearing_rad))
+    for direction, bearing, new_lat, new_lng, actual_distance in zip(
+        d, bearings, new_lats, new_lngs, actual_distances
+    ):
+        direction_name = direction.value
 
-        # verify distance using Haversine
-        actual_distance = utils.euc_distance(start_lat, start_lng, new_lat, new_lng)
+        new_lat, new_lng = float(new_lat), float(new_lng)
+        actual_distance = float(actual_distance)
 
         endpoint = {
             "lat": new_lat,
             "lng": new_lng,
-            "bearing": bearing,
+            "bearing": int(bearing),
             "direction": direction_name,
             "calculated_distance": actual_distance,
         }
         endpoints.append(endpoint)
 
-        print(
-            f"   {direction_name:>9}: ({new_lat:.4f}, {new_lng:.4f}) - {actual_distance:.2f}km"
+        log.debug(
+            "%9s (bearing %s): (%.4f, %.4f) - %.2fkm",
+            direction_name, bearing, new_lat, new_lng, actual_distance,
         )
 
     return endpoints
 
 
-def test_google_routes_distance(start_lat, start_lng, end_lat, end_lng, mapi=MapsApi):
-    """Test actual walking distance using Google Routes API"""
-
+def routes_request(start_lat, start_lng, end_lat, end_lng, mapi=MapsApi):
+    """URL, headers and body for a Google Routes walking request"""
     api_key = os.getenv("GOOGLE_ROUTES_API_KEY")
     url = mapi.COMPUTE_ROUTES.value
 
@@ -79,103 +95,126 @@ def test_google_routes_distance(start_lat, start_lng, end_lat, end_lng, mapi=Map
         },
         "travelMode": "WALK",
     }
+    return url, headers, data
+
+
+def parse_routes_result(result):
+    """Google Routes JSON --> distance/duration/polyline dict"""
+    if "routes" in result and result["routes"]:
+        route = result["routes"][0]
+        distance_meters = route.get("distanceMeters", 0)
+        duration_seconds = int(route.get("duration", "0s").replace("s", ""))
+        polyline = route.get("polyline", {}).get("encodedPolyline", "")
+
+        return {
+            "distance_km": distance_meters / 1000,
+            "duration_minutes": duration_seconds / 60,
+            "polyline": polyline,
+            "success": True,
+        }
 
-    try:
-        response = requests.post(url, json=data, headers=headers)
-        response.raise_for_status()
-        result = response.json()
+    return {"error": "No routes found", "success": False}
+
+
+def test_google_routes_distance(start_lat, start_lng, end_lat, end_lng, mapi=MapsApi):
+    """Test actual walking distance using Google Routes API"""
+
+    key = route_cache_key(start_lat, start_lng, end_lat, end_lng)
+    cached = cache.routes.get(key)
+    if cached is not None:
+        return cached
 
-        if "routes" in result and result["routes"]:
-            route = result["routes"][0]
-            distance_meters = route.get("distanceMeters", 0)
-            duration_seconds = int(route.get("duration", "0s").replace("s", ""))
-            polyline = route.get("polyline", {}).get("encodedPolyline", "")
-
-            return {
-                "distance_km": distance_meters / 1000,
-                "duration_minutes": duration_seconds / 60,
-                "polyline": polyline,
-                "success": True,
-            }
+    url, headers, data = routes_request(start_lat, start_lng, end_lat, end_lng, mapi)
+
+    try:
+        with telemetry.stage("routes"):
+            telemetry.count("google_routes")
+            response = requests.post(url, json=data, headers=headers)
+            response.raise_for_status()
+        result = parse_routes_result(response.json())
     except Exception as e:
         return {"error": str(e), "success": False}
 
-    return {"error": "No routes found", "success": False}
+    if result["success"]:
+        cache.routes.set(key, result)
+    return result
+
+
+def route_cache_key(start_lat, start_lng, end_lat, end_lng, travel_mode="WALK"):
+    return (*cache.quantize(start_lat, start_lng), *cache.quantize(end_lat, end_lng), travel_mode)
+
+
+def geocode_cache_key(lat, lng):
+    return cache.quantize(lat, lng)
+
+
+def cache_geocode_result(lat, lng, result):
+    # errors and quota responses are retried next time, definitive answers are kept
+    if result.get("status") in ("OK", "ZERO_RESULTS"):
+        cache.geocodes.set(geocode_cache_key(lat, lng), result)
+
+
+def build_route_info(route_id, endpoint, google_result, target_distance):
+    one_way_actual = google_result["distance_km"]
+    total_distance = one_way_actual * 2  # out and back
+    difference = abs(total_distance - target_distance)
+    accuracy = 100 * (1 - difference / target_distance)
+
+    return {
+        "id": route_id,
+        "direction": endpoint["direction"],
+        "accuracy": accuracy,
+        "distance": {
+            "target_distance": target_distance,
+            "total_distance": total_distance,
+        },
+        "endpoint": {"lat": endpoint["lat"], "lng": endpoint["lng"]},
+        "polyline": google_result.get("polyline", ""),
+    }
 
 
 def calculate_and_test_endpoints(
-    start_lat, start_lng, target_distance, all_routes=[], optimal_multiplier=0.4
+    start_lat, start_lng, target_distance, all_routes=[], optimal_multiplier=OPTIMAL_MULTIPLIER
 ):
     one_way_distance = target_distance * optimal_multiplier
-    print(f"One-way distance entering endpoint generation: {one_way_distance:.2f}km")
+    log.debug("One-way distance entering endpoint generation: %.2fkm", one_way_distance)
 
     # generating optimized endpoints based on multiplier
     endpoints = generate_optimized_endpoints(start_lat, start_lng, one_way_distance)
-    endpoints = reverse_geocode_and_filter(endpoints)
+    endpoints = filter_endpoints(start_lat, start_lng, endpoints)
 
     phase1_routes = []
 
-    for i, endpoint in enumerate(endpoints):
-        print(f"   Testing {endpoint['direction']} route...")
+    # one call per endpoint for Google, one graph search for all of them locally
+    results = routing.get_backend().routes_from(
+        start_lat, start_lng, [(endpoint["lat"], endpoint["lng"]) for endpoint in endpoints]
+    )
 
-        google_result = test_google_routes_distance(
-            start_lat, start_lng, endpoint["lat"], endpoint["lng"]
-        )
+    for i, (endpoint, google_result) in enumerate(zip(endpoints, results)):
+        log.debug("Tested %s route", endpoint["direction"])
 
         if google_result["success"]:
-            one_way_actual = google_result["distance_km"]
-            total_distance = one_way_actual * 2  # out and back
-            difference = abs(total_distance - target_distance)
-            accuracy = 100 * (1 - difference / target_distance)
-
-            route_info = {
-                "id": i + 1,
-                "direction": endpoint["direction"],
-                "accuracy": accuracy,
-                "distance": {
-                    "target_distance": target_distance,
-                    "total_distance": total_distance,
-                },
-                "endpoint": {"lat": endpoint["lat"], "lng": endpoint["lng"]},
-                "polyline": google_result.get("polyline", ""),
-            }
+            route_info = build_route_info(i + 1, endpoint, google_result, target_distance)
             phase1_routes.append(route_info)
             all_routes.append(route_info)
         else:
             continue
-    print()
     return phase1_routes, all_routes
 
 
+@telemetry.timed("route_finder")
 def optimized_route_finder(start_lat, start_lng, target_distance):
     phase1_routes, all_routes = calculate_and_test_endpoints(
         start_lat, start_lng, target_distance
     )
 
-    excellent_phase1 = [r for r in phase1_routes if r["accuracy"] >= 95]
-    good_phase1 = [r for r in phase1_routes if r["accuracy"] >= 90]
-
-    print(f"📊 Phase 1 Results:")
-    print(f"   Excellent routes (≥95%): {len(excellent_phase1)}")
-    print(f"   Good routes (≥90%): {len(good_phase1)}")
-    print()
+    final_routes = select_phase1_routes(phase1_routes)
 
     # PHASE 2: Only run if we need more good routes
-    if len(excellent_phase1) >= 3:
-        print("✅ SUCCESS: Found 3+ excellent routes in Phase 1! Stopping here.")
-        final_routes = sorted(
-            excellent_phase1, key=lambda x: x["accuracy"], reverse=True
-        )
-    elif len(good_phase1) >= 3:
-        print("✅ SUCCESS: Found 3+ good routes in Phase 1! Stopping here.")
-        final_routes = sorted(good_phase1, key=lambda x: x["accuracy"], reverse=True)
-    else:
-        print("🔍 PHASE 2: Testing backup multipliers for better coverage")
-        print("=" * 50)
+    if final_routes is None:
+        log.info("Phase 2: testing backup multipliers for better coverage")
 
-        backup_multipliers = [0.35, 0.45]  # Based on your data
-
-        for multiplier in backup_multipliers:
+        for multiplier in BACKUP_MULTIPLIERS:
             _, all_routes = calculate_and_test_endpoints(
                 start_lat,
                 start_lng,
@@ -183,26 +222,118 @@ def optimized_route_finder(start_lat, start_lng, target_distance):
                 all_routes=all_routes,
                 optimal_multiplier=multiplier,
             )
-            print()
 
-        # Select final routes from all phases
-        decent_routes = [r for r in all_routes if r["accuracy"] >= 80]
-        final_routes = sorted(decent_routes, key=lambda x: x["accuracy"], reverse=True)
+        final_routes = select_final_routes(all_routes)
+
+    print_final_routes(final_routes)
+    return final_routes
+
+
+def select_phase1_routes(phase1_routes):
+    """Phase 1 winners sorted by accuracy, or None when phase 2 is needed"""
+    excellent_phase1 = [r for r in phase1_routes if r["accuracy"] >= 95]
+    good_phase1 = [r for r in phase1_routes if r["accuracy"] >= 90]
+
+    log.info(
+        "Phase 1: %d excellent routes (>=95%%), %d good routes (>=90%%)",
+        len(excellent_phase1), len(good_phase1),
+    )
+
+    if len(excellent_phase1) >= 3:
+        log.info("Found 3+ excellent routes in phase 1, stopping here")
+        return sorted(excellent_phase1, key=lambda x: x["accuracy"], reverse=True)
+    if len(good_phase1) >= 3:
+        log.info("Found 3+ good routes in phase 1, stopping here")
+        return sorted(good_phase1, key=lambda x: x["accuracy"], reverse=True)
+    return None
 
-    print(f"🏆 FINAL TOP 3 ROUTES:")
-    print("=" * 60)
 
+def select_final_routes(all_routes):
+    # Select final routes from all phases
+    decent_routes = [r for r in all_routes if r["accuracy"] >= 80]
+    return sorted(decent_routes, key=lambda x: x["accuracy"], reverse=True)
+
+
+def print_final_routes(final_routes):
+    if not log.isEnabledFor(logging.INFO):
+        return
     for i, route in enumerate(final_routes, 1):
-        print(f"{i}. {route['direction']}")
-        print(f"   🎯 Accuracy: {route['accuracy']:.1f}%")
-        print(
-            f"   📍 Endpoint: ({route['endpoint']['lat']:.4f}, {route['endpoint']['lng']:.4f})"
+        log.info(
+            "Final route %d: %s, accuracy %.1f%%, endpoint (%.4f, %.4f)",
+            i, route["direction"], route["accuracy"],
+            route["endpoint"]["lat"], route["endpoint"]["lng"],
         )
-        print()
-    return final_routes
 
 
-def reverse_geocode_and_filter(endpoints, water_keywords=const.ignore, mapi=MapsApi):
+def filter_endpoints(start_lat, start_lng, endpoints, water_keywords=const.ignore):
+    """
+    Land endpoints from the offline mask when it is built, else by reverse geocoding
+
+    With LandMaskConfig.CHECK_ADDRESSES the endpoints left on land are geocoded
+    too, so the address exclusions in water_keywords still apply.
+    """
+    mask = land_mask.get_mask()
+    if mask is None:
+        return reverse_geocode_and_filter(endpoints, water_keywords)
+    endpoints = snap_to_land(start_lat, start_lng, endpoints, mask)
+    if const.LandMaskConfig.CHECK_ADDRESSES:
+        return reverse_geocode_and_filter(endpoints, water_keywords)
+    return endpoints
+
+
+@telemetry.timed("land_mask")
+def snap_to_land(start_lat, start_lng, endpoints, mask):
+    """
+    Classify endpoints against the land mask in one pass
+
+    Water endpoints are moved to the nearest land cell (marked "snapped", with
+    calculated_distance updated); those with no land within SNAP_KM are dropped.
+    """
+    if not endpoints:
+        return []
+    lats, lngs, ok = mask.snap(
+        [endpoint["lat"] for endpoint in endpoints], [endpoint["lng"] for endpoint in endpoints]
+    )
+    distances = utils.haversine_many(start_lat, start_lng, lats, lngs)
+
+    valid_endpoints = []
+    for endpoint, lat, lng, on_land, distance in zip(endpoints, lats, lngs, ok, distances):
+        if not on_land:
+            log.debug("%s: no land within reach (filtered)", endpoint["direction"])
+            continue
+        if (lat, lng) != (endpoint["lat"], endpoint["lng"]):
+            endpoint.update(lat=float(lat), lng=float(lng), snapped=True)
+            log.debug("%s: snapped to land at (%.4f, %.4f)", endpoint["direction"], lat, lng)
+        endpoint["calculated_distance"] = float(distance)
+        valid_endpoints.append(endpoint)
+
+    print_filter_results(endpoints, valid_endpoints)
+    return valid_endpoints
+
+
+def reverse_geocode(lat, lng, mapi=MapsApi):
+    """Google reverse geocoding JSON for a point, through the geocode cache"""
+    result = cache.geocodes.get(geocode_cache_key(lat, lng))
+    if result is None:
+        params = {"latlng": f"{lat},{lng}", "key": os.getenv("GOOGLE_ROUTES_API_KEY")}
+        with telemetry.stage("geocode"):
+            telemetry.count("google_geocode")
+            response = requests.get(mapi.GEOCODING.value, params=params, timeout=10)
+            response.raise_for_status()
+        result = response.json()
+        cache_geocode_result(lat, lng, result)
+    return result
+
+
+def endpoint_address(lat, lng):
+    """Formatted address for display, or None"""
+    result = reverse_geocode(lat, lng)
+    if result.get("status") == "OK" and result.get("results"):
+        return result["results"][0]["formatted_address"]
+    return None
+
+
+def reverse_geocode_and_filter(endpoints, water_keywords=const.ignore):
     """
     Reverse geocode endpoints and filter out water/invalid locations
 
@@ -213,53 +344,51 @@ def reverse_geocode_and_filter(endpoints, water_keywords=const.ignore, mapi=Maps
         List of valid endpoints with added 'address' field
     """
 
-    api_key = os.getenv("GOOGLE_ROUTES_API_KEY")
     valid_endpoints = []
 
-    print(
-        f"Reverse geocoding {len(endpoints)} endpoints to filter out water locations..."
-    )
+    log.debug("Reverse geocoding %d endpoints to filter out water locations", len(endpoints))
 
     for endpoint in endpoints:
-        lat = endpoint["lat"]
-        lng = endpoint["lng"]
-        direction = endpoint["direction"]
-
-        # google geocoding API call
-        geocoding_url = mapi.GEOCODING.value
-        params = {"latlng": f"{lat},{lng}", "key": api_key}
-
         try:
-            response = requests.get(geocoding_url, params=params, timeout=10)
-            response.raise_for_status()
-            result = response.json()
-
-            if result["status"] == "OK" and result["results"]:
-                address = result["results"][0]["formatted_address"]
-                is_water = any(keyword in address for keyword in water_keywords)
-
-                if is_water:
-                    print(f"   {direction}: {address} (FILTERED - water/invalid)")
-                else:
-                    # adding address to metadata
-                    endpoint["address"] = address
-                    valid_endpoints.append(endpoint)
-                    print(f"   ✅ {direction}: {address}")
-            else:
-                print(f"   {direction}: No address found (FILTERED)")
+            result = reverse_geocode(endpoint["lat"], endpoint["lng"])
+            if accept_geocoded_endpoint(endpoint, result, water_keywords):
+                valid_endpoints.append(endpoint)
 
         except Exception as e:
-            print(f"   {direction}: Geocoding error - {str(e)} (FILTERED)")
-
-    print(f"\n Filtering Results:")
-    print(f"   Original endpoints: {len(endpoints)}")
-    print(f"   Valid endpoints: {len(valid_endpoints)}")
-    print(f"   Filtered out: {len(endpoints) - len(valid_endpoints)}")
+            log.warning("%s: geocoding error - %s (filtered)", endpoint["direction"], e)
 
+    print_filter_results(endpoints, valid_endpoints)
     return valid_endpoints
 
 
+def accept_geocoded_endpoint(endpoint, result, water_keywords=const.ignore):
+    """Keep an endpoint (adding its address) unless the geocode is missing or water"""
+    direction = endpoint["direction"]
+    if result["status"] == "OK" and result["results"]:
+        address = result["results"][0]["formatted_address"]
+        is_water = any(keyword in address for keyword in water_keywords)
+
+        if is_water:
+            log.debug("%s: %s (filtered - water/invalid)", direction, address)
+            return False
+        # adding address to metadata
+        endpoint["address"] = address
+        log.debug("%s: %s", direction, address)
+        return True
+
+    log.debug("%s: no address found (filtered)", direction)
+    return False
+
+
+def print_filter_results(endpoints, valid_endpoints):
+    log.debug(
+        "Filtering: %d endpoints, %d valid, %d filtered out",
+        len(endpoints), len(valid_endpoints), len(endpoints) - len(valid_endpoints),
+    )
+
+
 if __name__ == "__main__":
+    telemetry.configure_logging()
     print("Choose test mode:")
     print("1. Original single distance test")
     print("2. Original comprehensive test (48 API calls)")
@@ -0,0 +1,305 @@
+"""
+Offline land/water mask for endpoint filtering
+
+A uint8 raster over the BaselineGrid bounds at LandMaskConfig.RESOLUTION,
+1 where a run can end (land inside the city), 0 for water and everything
+outside the five boroughs. Route endpoints are classified against it in bulk
+instead of reverse geocoding each one to find out whether it is in the river;
+endpoints in water are snapped to the nearest land cell within SNAP_KM. The
+address exclusions in constants.ignore (Astoria, Unnamed Road, Plus Codes...)
+are not geographic, so with CHECK_ADDRESSES the snapped endpoints are still
+geocoded and filtered on their address (get_routes.filter_endpoints).
+
+The mask is built by this module's CLI from a GeoJSON file of land polygons,
+by default LandMaskConfig.GEOJSON (the water-clipped borough boundaries),
+rasterized by scanline. Crash locations can be rasterized instead with
+--from-crashes for a quick look, but parks with no roads come out as water
+and bridges and the FDR mark river cells as land, so get_mask() only serves
+masks that came from polygons; without one, filtering falls back to
+geocoding.
+
+Like the safety tiles it is one file (JSON header, then the array) that is
+memory-mapped on load.
+
+Usage:
+    python land_mask.py build [--geojson boroughs.geojson | --from-crashes]
+    python land_mask.py check LAT LNG
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import crash_index
+from constants import BaselineGrid, LandMaskConfig
+
+MAGIC = b"RSLAND01"
+HEADER_ALIGN = 64
+CRASH_SOURCE = "crashes"
+
+log = logging.getLogger(__name__)
+
+
+class LandMask:
+    def __init__(self, data, resolution, lat_min, lng_min, sources=(), built_at=None):
+        self.data = data  # (n_lat, n_lng) uint8, 1 = land
+        self.resolution = float(resolution)
+        self.lat_min = float(lat_min)
+        self.lng_min = float(lng_min)
+        self.sources = list(sources)
+        self.built_at = built_at
+        self.n_lat, self.n_lng = data.shape
+
+    def cell_index(self, lats, lngs):
+        """(rows, cols, inside) of the cells containing each point"""
+        rows = np.floor((np.asarray(lats, dtype=np.float64) - self.lat_min) / self.resolution).astype(np.int64)
+        cols = np.floor((np.asarray(lngs, dtype=np.float64) - self.lng_min) / self.resolution).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.n_lat) & (cols >= 0) & (cols < self.n_lng)
+        return np.clip(rows, 0, self.n_lat - 1), np.clip(cols, 0, self.n_lng - 1), inside
+
+    def is_land(self, lats, lngs):
+        """Bool per point; points off the raster are not land"""
+        rows, cols, inside = self.cell_index(lats, lngs)
+        return inside & (self.data[rows, cols] > 0)
+
+    def snap(self, lats, lngs, max_km=LandMaskConfig.SNAP_KM):
+        """
+        Move each point onto land
+
+        Returns:
+            (lats, lngs, ok): land points unchanged, water points moved to the
+            centre of the nearest land cell within max_km, ok False where there
+            is none
+        """
+        lats = np.array(lats, dtype=np.float64)
+        lngs = np.array(lngs, dtype=np.float64)
+        ok = self.is_land(lats, lngs)
+        rows, cols, inside = self.cell_index(lats, lngs)
+        water = np.flatnonzero(~ok & inside)
+        if not len(water):
+            return lats, lngs, ok
+
+        # one window of cell offsets wide enough for the highest latitude, then
+        # (water points x offsets) distances with non-land cells pushed to inf
+        km_lat = 111.0 * self.resolution
+        km_lng = km_lat * np.cos(np.radians(np.abs(lats[water]).max()))
+        reach_rows = int(np.ceil(max_km / km_lat))
+        reach_cols = int(np.ceil(max_km / km_lng))
+        d_rows, d_cols = np.meshgrid(
+            np.arange(-reach_rows, reach_rows + 1), np.arange(-reach_cols, reach_cols + 1), indexing="ij"
+        )
+        cell_rows = rows[water, None] + d_rows.ravel()
+        cell_cols = cols[water, None] + d_cols.ravel()
+        valid = (cell_rows >= 0) & (cell_rows < self.n_lat) & (cell_cols >= 0) & (cell_cols < self.n_lng)
+        valid &= self.data[
+            np.clip(cell_rows, 0, self.n_lat - 1), np.clip(cell_cols, 0, self.n_lng - 1)
+        ] > 0
+
+        centre_lats = self.lat_min + (cell_rows + 0.5) * self.resolution
+        centre_lngs = self.lng_min + (cell_cols + 0.5) * self.resolution
+        dist_km = np.hypot(
+            (centre_lats - lats[water, None]) * 111.0,
+            (centre_lngs - lngs[water, None]) * 111.0 * np.cos(np.radians(lats[water, None])),
+        )
+        dist_km[~valid] = np.inf
+        nearest = np.argmin(dist_km, axis=1)
+        picked = np.arange(len(water))
+        reached = dist_km[picked, nearest] <= max_km
+
+        moved = water[reached]
+        lats[moved] = centre_lats[picked, nearest][reached]
+        lngs[moved] = centre_lngs[picked, nearest][reached]
+        ok[moved] = True
+        return lats, lngs, ok
+
+    @property
+    def from_polygons(self):
+        """True when built from land polygons rather than crash locations alone"""
+        return any(source != CRASH_SOURCE for source in self.sources)
+
+    def header(self):
+        return {
+            "shape": list(self.data.shape),
+            "resolution": self.resolution,
+            "lat_min": self.lat_min,
+            "lng_min": self.lng_min,
+            "sources": self.sources,
+            "built_at": self.built_at,
+        }
+
+    def save(self, path=LandMaskConfig.PATH):
+        header = json.dumps(self.header()).encode()
+        length = len(MAGIC) + 4 + len(header)
+        header += b" " * (-length % HEADER_ALIGN)
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            f.write(np.ascontiguousarray(self.data, dtype=np.uint8).tobytes())
+
+    @classmethod
+    def load(cls, path=LandMaskConfig.PATH, mmap=True):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a land mask file")
+            header_length = int.from_bytes(f.read(4), "little")
+            header = json.loads(f.read(header_length))
+        offset = len(MAGIC) + 4 + header_length
+        shape = tuple(header["shape"])
+        if mmap:
+            data = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=shape)
+        else:
+            data = np.fromfile(path, dtype=np.uint8, offset=offset).reshape(shape)
+        return cls(
+            data, header["resolution"], header["lat_min"], header["lng_min"],
+            header.get("sources", ()), header.get("built_at"),
+        )
+
+
+def grid_shape(resolution):
+    n_lat = int(np.ceil((BaselineGrid.LAT_MAX - BaselineGrid.LAT_MIN) / resolution))
+    n_lng = int(np.ceil((BaselineGrid.LNG_MAX - BaselineGrid.LNG_MIN) / resolution))
+    return n_lat, n_lng
+
+
+def dilate(mask, cells):
+    """Grow True cells by `cells` in every direction (square neighbourhood)"""
+    grown = mask.copy()
+    for _ in range(cells):
+        step = grown.copy()
+        step[1:] |= grown[:-1]
+        step[:-1] |= grown[1:]
+        step[:, 1:] |= grown[:, :-1]
+        step[:, :-1] |= grown[:, 1:]
+        grown = step
+    return grown
+
+
+def crash_cells(shape, resolution, min_crashes=LandMaskConfig.MIN_CRASHES,
+                grow=LandMaskConfig.DILATE):
+    """Cells with at least min_crashes collisions, grown by `grow` cells"""
+    index = crash_index.get_index() if crash_index.enabled else crash_index.load_from_db()
+    rows = np.floor((np.asarray(index.lats) - BaselineGrid.LAT_MIN) / resolution).astype(np.int64)
+    cols = np.floor((np.asarray(index.lngs) - BaselineGrid.LNG_MIN) / resolution).astype(np.int64)
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    counts = np.bincount(
+        rows[inside] * shape[1] + cols[inside], minlength=shape[0] * shape[1]
+    ).reshape(shape)
+    return dilate(counts >= min_crashes, grow)
+
+
+def polygon_rings(geojson):
+    """Every ring of every (Multi)Polygon in a GeoJSON FeatureCollection/Feature/geometry"""
+    if geojson["type"] == "FeatureCollection":
+        for feature in geojson["features"]:
+            yield from polygon_rings(feature)
+    elif geojson["type"] == "Feature":
+        yield from polygon_rings(geojson["geometry"])
+    elif geojson["type"] == "Polygon":
+        yield from (np.asarray(ring, dtype=np.float64) for ring in geojson["coordinates"])
+    elif geojson["type"] == "MultiPolygon":
+        for polygon in geojson["coordinates"]:
+            yield from (np.asarray(ring, dtype=np.float64) for ring in polygon)
+
+
+def rasterize(geojson, shape, resolution):
+    """Cells whose centres fall inside the polygons (even-odd, so holes stay out)"""
+    rings = list(polygon_rings(geojson))
+    # all edges at once: (lng0, lat0) -> (lng1, lat1)
+    starts = np.concatenate([ring[:-1] for ring in rings])
+    ends = np.concatenate([ring[1:] for ring in rings])
+
+    centre_lats = BaselineGrid.LAT_MIN + (np.arange(shape[0]) + 0.5) * resolution
+    centre_lngs = BaselineGrid.LNG_MIN + (np.arange(shape[1]) + 0.5) * resolution
+    mask = np.zeros(shape, dtype=bool)
+    for row, lat in enumerate(centre_lats):
+        spans = (starts[:, 1] <= lat) != (ends[:, 1] <= lat)
+        if not spans.any():
+            continue
+        s, e = starts[spans], ends[spans]
+        crossings = np.sort(s[:, 0] + (lat - s[:, 1]) * (e[:, 0] - s[:, 0]) / (e[:, 1] - s[:, 1]))
+        # centres crossed an odd number of times from the west are inside
+        mask[row] = np.searchsorted(crossings, centre_lngs) % 2 == 1
+    return mask
+
+
+def build(geojson_path=None, use_crashes=False, resolution=LandMaskConfig.RESOLUTION):
+    """Rasterize land polygons (default LandMaskConfig.GEOJSON), or crash locations if use_crashes"""
+    shape = grid_shape(resolution)
+    if use_crashes:
+        mask, sources = crash_cells(shape, resolution), [CRASH_SOURCE]
+    else:
+        geojson_path = geojson_path or LandMaskConfig.GEOJSON
+        with open(geojson_path) as f:
+            mask, sources = rasterize(json.load(f), shape, resolution), [str(geojson_path)]
+    return LandMask(
+        mask.astype(np.uint8), resolution, BaselineGrid.LAT_MIN, BaselineGrid.LNG_MIN,
+        sources, built_at=datetime.now().isoformat(timespec="seconds"),
+    )
+
+
+_mask = None
+_mask_lock = threading.Lock()
+
+
+def get_mask():
+    """
+    Process-wide mask mapped from LandMaskConfig.PATH
+
+    None if disabled, not built, or built from crash locations only; callers
+    then filter endpoints by reverse geocoding.
+    """
+    global _mask
+    if not LandMaskConfig.ENABLED:
+        return None
+    if _mask is None:
+        with _mask_lock:
+            if _mask is None:
+                try:
+                    mask = LandMask.load()
+                except FileNotFoundError:
+                    return None
+                if not mask.from_polygons:
+                    log.warning("%s has no land polygons (sources %s); geocoding endpoints instead",
+                                LandMaskConfig.PATH, mask.sources)
+                _mask = mask
+    return _mask if _mask.from_polygons else None
+
+
+def reload():
+    """Pick up a rebuilt mask file"""
+    global _mask
+    with _mask_lock:
+        _mask = None
+    return get_mask()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the land/water mask")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build")
+    source = build_parser.add_mutually_exclusive_group()
+    source.add_argument("--geojson", help=f"land polygons to rasterize (default {LandMaskConfig.GEOJSON})")
+    source.add_argument("--from-crashes", action="store_true",
+                        help="crash locations instead (rough; not used for endpoint filtering)")
+    check_parser = sub.add_parser("check")
+    check_parser.add_argument("lat", type=float)
+    check_parser.add_argument("lng", type=float)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        started = time.perf_counter()
+        mask = build(args.geojson, use_crashes=args.from_crashes)
+        mask.save()
+        print(f"Land mask built: {mask.n_lat}x{mask.n_lng} cells, {mask.data.mean():.1%} land, "
+              f"sources {mask.sources}, {time.perf_counter() - started:.1f}s -> {LandMaskConfig.PATH}")
+    else:
+        mask = LandMask.load()
+        lats, lngs, ok = mask.snap([args.lat], [args.lng])
+        print(f"land: {bool(mask.is_land([args.lat], [args.lng])[0])}")
+        print(f"snapped: ({lats[0]:.5f}, {lngs[0]:.5f})" if ok[0] else "snapped: none within reach")
@@ -0,0 +1,342 @@
+"""
+Safety-weighted loop routes on the street graph
+
+Every directed edge gets a risk: the injury/fatality-weighted crash density
+around its midpoint over LoopConfig.DAYS_BACK, relative to the average street
+(1.0), capped at RISK_CAP. Searches run on cost = metres * (1 + SAFETY_WEIGHT *
+risk), so quieter streets are preferred while the route is being built rather
+than scored after the fact.
+
+A loop is start -> A -> B -> start. One bounded Dijkstra from the start gives
+the cheapest path to every node within half the target; in each bearing sector
+the waypoint whose path is cheapest per metre (near a third of the target
+away) is kept. Sector pairs 30-120 degrees apart whose estimated perimeter is
+near the target are tried in order of safety, each closed with one A* from A
+to B, until TIME_BUDGET runs out. Loops that walk too much of the same stem
+twice (MAX_OVERLAP) or miss MIN_ACCURACY are dropped; the safest survivors
+from distinct sectors are returned.
+
+Edge risks are never computed on the request path. They live in
+RoutingConfig.GRAPH_DIR/risk.npy, written by one process at a time (an flock
+on GRAPH_DIR/.risk.lock): at startup by the first worker to find it missing
+or built for another graph (prepare), after a sync by the process that synced
+(refresh, a sync.on_refresh hook), or by `python loops.py weights`. Other
+workers map the file (reload, a sync.on_reload hook); until it exists,
+generate_loops finds nothing. Every search also stops at the TIME_BUDGET
+deadline, not just between waypoint pairs.
+"""
+
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+import crash_index
+import utils
+from constants import Direction, LoopConfig, RoutingConfig
+
+log = logging.getLogger(__name__)
+
+RISK_FILE = "risk.npy"
+
+
+def edge_risk(graph, index=None, days_back=LoopConfig.DAYS_BACK):
+    """Relative crash density (1.0 = average street) per directed edge, float32"""
+    if index is None:
+        index = crash_index.get_index() if crash_index.enabled else crash_index.load_from_db()
+    cutoff = np.datetime64(date.today(), "D") - np.timedelta64(days_back, "D")
+    recent = np.asarray(index.dates) >= cutoff
+    weights = (
+        1.0
+        + LoopConfig.INJURY_WEIGHT * np.asarray(index.injuries)[recent]
+        + LoopConfig.FATALITY_WEIGHT * np.asarray(index.fatalities)[recent]
+    )
+
+    cell = LoopConfig.RISK_CELL
+    lat0, lng0 = float(np.min(graph.lats)), float(np.min(graph.lngs))
+    n_lat = int((float(np.max(graph.lats)) - lat0) / cell) + 1
+    n_lng = int((float(np.max(graph.lngs)) - lng0) / cell) + 1
+    rows = np.floor((np.asarray(index.lats)[recent] - lat0) / cell).astype(np.int64)
+    cols = np.floor((np.asarray(index.lngs)[recent] - lng0) / cell).astype(np.int64)
+    inside = (rows >= 0) & (rows < n_lat) & (cols >= 0) & (cols < n_lng)
+    density = np.bincount(
+        rows[inside] * n_lng + cols[inside], weights=weights[inside], minlength=n_lat * n_lng
+    ).reshape(n_lat, n_lng)
+
+    # box smoothing: each cell sums its neighbourhood
+    k = LoopConfig.RISK_SMOOTH
+    padded = np.pad(density, k)
+    smoothed = sum(
+        padded[k + dr:k + dr + n_lat, k + dc:k + dc + n_lng]
+        for dr in range(-k, k + 1) for dc in range(-k, k + 1)
+    )
+
+    src = np.repeat(np.arange(graph.n_nodes), np.diff(graph.indptr))
+    dst = np.asarray(graph.indices)
+    mid_lats = (np.asarray(graph.lats)[src] + np.asarray(graph.lats)[dst]) / 2
+    mid_lngs = (np.asarray(graph.lngs)[src] + np.asarray(graph.lngs)[dst]) / 2
+    edge_rows = np.clip(((mid_lats - lat0) / cell).astype(np.int64), 0, n_lat - 1)
+    edge_cols = np.clip(((mid_lngs - lng0) / cell).astype(np.int64), 0, n_lng - 1)
+    edge_density = smoothed[edge_rows, edge_cols]
+
+    # relative to the length-weighted average street
+    metres = np.asarray(graph.weights, dtype=np.float64)
+    average = np.sum(edge_density * metres) / max(np.sum(metres), 1e-9)
+    risk = edge_density / average if average > 0 else np.zeros_like(edge_density)
+    return np.minimum(risk, LoopConfig.RISK_CAP).astype(np.float32)
+
+
+def risk_lock(root=RoutingConfig.GRAPH_DIR):
+    return utils.file_lock(os.path.join(root, ".risk.lock"))
+
+
+def save_risk(risk, root=RoutingConfig.GRAPH_DIR):
+    os.makedirs(root, exist_ok=True)
+    tmp = os.path.join(root, f".{RISK_FILE}.{os.getpid()}.npy")
+    np.save(tmp, risk)
+    os.replace(tmp, os.path.join(root, RISK_FILE))
+
+
+def load_risk(graph, root=RoutingConfig.GRAPH_DIR):
+    """Saved risks for this graph, or None if missing or built for another graph"""
+    try:
+        risk = np.load(os.path.join(root, RISK_FILE), mmap_mode="r")
+    except FileNotFoundError:
+        return None
+    return risk if len(risk) == len(graph.indices) else None
+
+
+_costs = None  # (graph, risk, costs)
+_costs_lock = threading.Lock()
+
+
+def set_risk(graph, risk):
+    """Serve searches on graph from these risks"""
+    global _costs
+    costs = np.asarray(graph.weights, dtype=np.float64) * (1 + LoopConfig.SAFETY_WEIGHT * risk)
+    with _costs_lock:
+        _costs = (graph, risk, costs)
+    return risk, costs
+
+
+def get_costs(graph):
+    """(risk, search costs) per directed edge for graph, or None until its risks are saved"""
+    current = _costs
+    if current is not None and current[0] is graph:
+        return current[1], current[2]
+    risk = load_risk(graph)
+    return None if risk is None else set_risk(graph, risk)
+
+
+def prepare(graph):
+    """Startup: map the saved risks, computing them first (once across workers) if missing or stale"""
+    risk = load_risk(graph)
+    if risk is None:
+        with risk_lock():
+            risk = load_risk(graph)  # another worker may have written it while we waited
+            if risk is None:
+                started = time.perf_counter()
+                save_risk(edge_risk(graph))
+                risk = load_risk(graph)
+                log.info("Edge risks computed in %.1fs", time.perf_counter() - started)
+    return set_risk(graph, risk)
+
+
+def _served_graph():
+    current = _costs
+    return current[0] if current is not None else None
+
+
+def refresh():
+    """Sync hook in the process that synced: recompute the served graph's risks and publish them"""
+    graph = _served_graph()
+    if graph is None:
+        return
+    with risk_lock():
+        save_risk(edge_risk(graph))
+    set_risk(graph, load_risk(graph))
+
+
+def reload():
+    """Sync hook in the other workers: map the risks the syncing process published"""
+    graph = _served_graph()
+    if graph is None:
+        return
+    risk = load_risk(graph)
+    if risk is not None:
+        set_risk(graph, risk)
+
+
+def direction_name(bearing):
+    return list(Direction)[int(round(bearing / 45)) % 8].value
+
+
+def generate_loops(graph, start_lat, start_lng, target_distance, count=3,
+                   time_budget=LoopConfig.TIME_BUDGET, max_expansions=LoopConfig.MAX_EXPANSIONS):
+    """
+    Up to count loops of target_distance km from the start, safest first
+
+    Returns:
+        (routes, stats): routes shaped like get_routes.build_route_info (plus
+        "shape": "loop" and "risk", the length-weighted mean edge risk), and
+        what the search did
+    """
+    started = time.perf_counter()
+    deadline = started + time_budget
+    stats = {
+        "tree_nodes": 0, "tree_truncated": False, "waypoints": 0,
+        "pairs": 0, "pairs_tried": 0, "stopped": "done",
+    }
+
+    source, source_m = graph.nearest_node(start_lat, start_lng)
+    if source is None:
+        stats["stopped"] = "off_graph"
+        return [], stats
+
+    prepared = get_costs(graph)
+    if prepared is None:
+        stats["stopped"] = "no_risk"
+        return [], stats
+    risk, costs = prepared
+    target_m = target_distance * 1000
+    # the tree gets at most half the budget, so pairs are left time to close
+    tree_deadline = started + time_budget / 2
+    cost, metres, pred = graph.search_tree(
+        source, costs, max_m=target_m / 2, max_expansions=max_expansions, deadline=tree_deadline
+    )
+    stats["tree_nodes"] = len(cost)
+    stats["tree_truncated"] = time.perf_counter() > tree_deadline
+
+    # candidate waypoints: a fifth to under half the target away
+    nodes = np.fromiter(cost.keys(), dtype=np.int64, count=len(cost))
+    node_m = np.fromiter((metres[n] for n in nodes), dtype=np.float64, count=len(nodes))
+    node_c = np.fromiter(cost.values(), dtype=np.float64, count=len(nodes))
+    near = (node_m >= 0.2 * target_m) & (node_m <= 0.45 * target_m)
+    nodes, node_m, node_c = nodes[near], node_m[near], node_c[near]
+
+    lat0, lng0 = float(graph.lats[source]), float(graph.lngs[source])
+    dy = (np.asarray(graph.lats)[nodes] - lat0) * 111.0
+    dx = (np.asarray(graph.lngs)[nodes] - lng0) * 111.0 * math.cos(math.radians(lat0))
+    bearings = np.degrees(np.arctan2(dx, dy)) % 360
+    sectors = (bearings // (360 / LoopConfig.SECTORS)).astype(np.int64)
+
+    # per sector, the cheapest path per metre near a third of the target
+    score = node_c / np.maximum(node_m, 1) + 2 * np.abs(node_m - target_m / 3) / target_m
+    waypoints = {}
+    for i in np.argsort(score):
+        waypoints.setdefault(int(sectors[i]), i)
+    stats["waypoints"] = len(waypoints)
+
+    pairs = []
+    for a, i in waypoints.items():
+        for b, j in waypoints.items():
+            gap = (b - a) % LoopConfig.SECTORS
+            if not LoopConfig.SECTORS / 12 <= gap <= LoopConfig.SECTORS / 3:
+                continue
+            chord_km = math.hypot(dx[i] - dx[j], dy[i] - dy[j])
+            estimate = node_m[i] + node_m[j] + chord_km * 1000 * LoopConfig.DETOUR
+            if abs(estimate - target_m) / target_m > (100 - LoopConfig.MIN_ACCURACY) / 100 + 0.1:
+                continue
+            ratio = (node_c[i] + node_c[j]) / (node_m[i] + node_m[j])
+            pairs.append((ratio + abs(estimate - target_m) / target_m, a, b, i, j))
+    pairs.sort()
+    stats["pairs"] = len(pairs)
+
+    loops = []
+    for _, a, b, i, j in pairs:
+        if time.perf_counter() > deadline:
+            stats["stopped"] = "time"
+            break
+        stats["pairs_tried"] += 1
+        node_a, node_b = int(nodes[i]), int(nodes[j])
+        _, middle = graph.astar(
+            node_a, node_b, costs, max_expansions=max_expansions, deadline=deadline
+        )
+        if middle is None:
+            continue
+
+        out = graph.path(pred, source, node_a)
+        back = graph.path(pred, source, node_b)
+        # the stem both tree paths share is walked out and back
+        shared = 0
+        while shared < min(len(out), len(back)) and out[shared] == back[shared]:
+            shared += 1
+        loop_nodes = out + middle[1:] + back[::-1][1:]
+        edges = graph.path_edges(loop_nodes)
+        lengths = np.asarray(graph.weights, dtype=np.float64)[edges]
+        total_m = float(lengths.sum()) + 2 * source_m
+        accuracy = 100 * (1 - abs(total_m - target_m) / target_m)
+        overlap = 2 * metres[out[shared - 1]] / total_m
+        if accuracy < LoopConfig.MIN_ACCURACY or overlap > LoopConfig.MAX_OVERLAP:
+            continue
+
+        loops.append({
+            "sectors": (a, b),
+            "nodes": loop_nodes,
+            "total_m": total_m,
+            "accuracy": accuracy,
+            "risk": float(np.sum(lengths * np.asarray(risk)[edges]) / max(lengths.sum(), 1e-9)),
+            "waypoint": node_a,
+            "bearings": (float(bearings[i]), float(bearings[j])),
+        })
+
+    # safest first, one loop per waypoint sector
+    routes = []
+    used = set()
+    for loop in sorted(loops, key=lambda l: (l["risk"], -l["accuracy"])):
+        if used & set(loop["sectors"]):
+            continue
+        used.update(loop["sectors"])
+        names = dict.fromkeys(direction_name(bearing) for bearing in loop["bearings"])
+        routes.append({
+            "id": len(routes) + 1,
+            "direction": "-".join(names) + " loop",
+            "shape": "loop",
+            "accuracy": loop["accuracy"],
+            "distance": {
+                "target_distance": target_distance,
+                "total_distance": loop["total_m"] / 1000,
+            },
+            "endpoint": {
+                "lat": float(graph.lats[loop["waypoint"]]),
+                "lng": float(graph.lngs[loop["waypoint"]]),
+            },
+            "polyline": graph.encode(loop["nodes"]),
+            "risk": round(loop["risk"], 3),
+        })
+        if len(routes) == count:
+            break
+
+    stats["loops_found"] = len(loops)
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    log.info("Loop search: %s", stats)
+    return routes, stats
+
+
+if __name__ == "__main__":
+    import street_graph
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "weights"
+    if command == "weights":
+        started = time.perf_counter()
+        graph = street_graph.StreetGraph.load()
+        risk = edge_risk(graph)
+        with risk_lock():
+            save_risk(risk)
+        print(f"Edge risks for {len(risk)} directed edges (mean {risk.mean():.2f}, "
+              f"max {risk.max():.1f}), {time.perf_counter() - started:.1f}s")
+    elif command == "loops":
+        graph = street_graph.StreetGraph.load()
+        lat, lng, km = (float(v) for v in sys.argv[2:5])
+        routes, stats = generate_loops(graph, lat, lng, km)
+        for route in routes:
+            print(route["direction"], f"{route['distance']['total_distance']:.2f} km",
+                  f"accuracy {route['accuracy']:.1f}%", f"risk {route['risk']}")
+        print(stats)
+    else:
+        print("Usage: python loops.py weights | loops LAT LNG KM")
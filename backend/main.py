@@ -1,9 +1,30 @@
-from fastapi import FastAPI
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from ai_agents import SafetyAnalysisAgent
 
 # from test_google_routes import GoogleRoutesAPI
+import async_routes
+import cache
+import db
 import get_routes
+import loops
+import point_memo
 import polyline_safety_analysis as p
+import routing
+import safety_tiles
+import sync
+import telemetry
+from constants import CoalesceConfig, TileConfig
+
+telemetry.configure_logging()
+log = logging.getLogger(__name__)
 
 app = FastAPI(title="runsafe-ai", version="0.1.0")
 
@@ -14,32 +35,62 @@ def get_safety_ai():
     global safety_ai
     if safety_ai is None:
         try:
-            print("Attempting to initialize SafetyAnalysisAgent...")
             safety_ai = SafetyAnalysisAgent()
-            print("SafetyAnalysisAgent initialized successfully!")
-        except Exception as e:
-            print(f"Could not initialize AI agent: {e}")
-            print(f"Error type: {type(e)}")
-            import traceback
-
-            traceback.print_exc()
+            log.info("SafetyAnalysisAgent initialized")
+        except Exception:
+            log.exception("Could not initialize AI agent")
             return None
     return safety_ai
 
 
+route_results = cache.TTLCache(maxsize=CoalesceConfig.RESULT_SIZE, ttl=CoalesceConfig.RESULT_TTL)
+route_flights = cache.SingleFlight()
+
+
+def generation_key(start_lat, start_lng, target_distance_km):
+    """Quantized (lat, lng, km): requests that round to the same key share a result"""
+    step = CoalesceConfig.DISTANCE_STEP
+    return (
+        *cache.quantize(start_lat, start_lng, CoalesceConfig.COORD_PRECISION),
+        round(round(target_distance_km / step) * step, 3),
+    )
+
+
 @app.get("/api/routes/generate")
-def generate_running_routes(
+async def generate_running_routes(
     start_lat: float, start_lng: float, target_distance_km: float = 5.0
 ):
-    """Generate routes and get AI recommendations"""
-
-    # Generate routes with safety analysis
-    enhanced_routes = p.generate_running_routes_with_polyline_safety(
-        start_lat,
-        start_lng,
-        target_distance_km,
-        get_routes.optimized_route_finder
-    )
+    """
+    Generate routes and get AI recommendations
+
+    Concurrent requests with the same generation_key share one run of the
+    pipeline, and its result answers repeats for CoalesceConfig.RESULT_TTL seconds.
+    The run uses the first caller's exact start and distance; the key only
+    decides who shares it (starts within ~10 m, distances within DISTANCE_STEP).
+    """
+    key = generation_key(start_lat, start_lng, target_distance_km)
+    result = route_results.get(key)
+    if result is not None:
+        telemetry.count("route_result_cached")
+        return result
+
+    async def compute():
+        # route finding stays on this loop's shared engine; scoring and the LLM call block
+        routes = await async_routes.get_engine().optimized_route_finder(
+            start_lat, start_lng, target_distance_km
+        )
+        result = await run_in_threadpool(
+            recommend_routes, start_lat, start_lng, target_distance_km, routes
+        )
+        route_results.set(key, result)
+        return result
+
+    return await route_flights.do(key, compute)
+
+
+def recommend_routes(start_lat, start_lng, target_distance_km, routes):
+    """Safety analysis of the found routes and the LLM recommendation"""
+    enhanced_routes = p.analyze_routes_parallel(routes) if routes else {}
 
     # prep metadata for LLM
     route_metadata = {
@@ -50,3 +101,246 @@ def generate_running_routes(
 
     ai_agent = get_safety_ai()
     return ai_agent.make_call_to_llm(route_metadata)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Per-request stage timings as Server-Timing, external call counts as X-Call-Counts;
+    also opens the request's point lookup memo
+    """
+    trace, token = telemetry.start_trace()
+    _, memo_token = point_memo.start()
+    try:
+        response = await call_next(request)
+    finally:
+        point_memo.end(memo_token)
+        route = request.scope.get("route")
+        # streamed responses are timed to their first byte
+        telemetry.end_trace(trace, token, getattr(route, "path", request.url.path))
+    response.headers["Server-Timing"] = trace.server_timing()
+    response.headers["X-Call-Counts"] = trace.counts_header()
+    return response
+
+
+def ndjson(event, **data):
+    return json.dumps({"event": event, **data}) + "\n"
+
+
+async def stream_route_events(start_lat, start_lng, target_distance_km):
+    """
+    Progressive results for one request, one NDJSON line per event:
+    start, candidate (each route as Google returns it), routes (the selection
+    and the Google calls the search used),
+    safety (each route as it is scored), recommendation, done
+    """
+    started = time.perf_counter()
+    yield ndjson(
+        "start",
+        start_location={"lat": start_lat, "lng": start_lng},
+        target_distance_km=target_distance_km,
+    )
+
+    candidates = asyncio.Queue()
+    search = {}
+    finder = asyncio.create_task(
+        async_routes.get_engine().optimized_route_finder(
+            start_lat, start_lng, target_distance_km, on_route=candidates.put_nowait,
+            stats=search,
+        )
+    )
+    finder.add_done_callback(lambda _: candidates.put_nowait(None))
+    while (route := await candidates.get()) is not None:
+        yield ndjson("candidate", route=route)
+
+    try:
+        routes = finder.result()
+    except Exception as e:
+        yield ndjson("error", stage="routes", detail=str(e))
+        return
+    if not routes:
+        yield ndjson("error", stage="routes", detail="No routes found")
+        return
+    yield ndjson("routes", route_ids=[route["id"] for route in routes], search=search)
+
+    # scoring is DB/index bound: run it on the shared pool, stream in finish order
+    loop = asyncio.get_running_loop()
+    executor = p.get_executor()
+
+    analyze = telemetry.bind(p.analyze_route_safety_detailed)
+
+    async def score(i, route):
+        return i, await loop.run_in_executor(executor, analyze, route)
+
+    enhanced_routes = [None] * len(routes)
+    for next_scored in asyncio.as_completed([score(i, route) for i, route in enumerate(routes)]):
+        i, enhanced = await next_scored
+        enhanced_routes[i] = enhanced
+        yield ndjson("safety", route=enhanced)
+
+    ai_agent = get_safety_ai()
+    if ai_agent is not None:
+        route_metadata = {
+            "start_location": {"lat": start_lat, "lng": start_lng},
+            "target_distance_km": target_distance_km,
+            "route_options": enhanced_routes,
+        }
+        try:
+            response = await ai_agent.make_call_to_llm_async(route_metadata)
+            yield ndjson(
+                "recommendation",
+                model=response.model,
+                content=response.choices[0].message.content,
+            )
+        except Exception as e:
+            yield ndjson("error", stage="recommendation", detail=str(e))
+
+    yield ndjson("done", elapsed_s=round(time.perf_counter() - started, 3))
+
+
+@app.get("/api/routes/stream")
+async def stream_running_routes(
+    start_lat: float, start_lng: float, target_distance_km: float = 5.0
+):
+    """Generate routes as a stream: candidates, then safety scores, then the AI recommendation"""
+    return StreamingResponse(
+        stream_route_events(start_lat, start_lng, target_distance_km),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/routes/loops")
+def generate_loop_routes(
+    start_lat: float, start_lng: float, target_distance_km: float = 5.0, count: int = 3
+):
+    """Closed loops of the target length built on the local street graph, safest first"""
+    backend = routing.get_backend()
+    if not backend.local:
+        raise HTTPException(503, "Loop routes need the local street graph (RoutingConfig.BACKEND)")
+    routes, stats = loops.generate_loops(
+        backend.graph, start_lat, start_lng, target_distance_km, count=max(1, min(count, 8))
+    )
+    if stats["stopped"] == "no_risk":
+        raise HTTPException(503, "Street edge risks are not computed yet")
+    if not routes:
+        raise HTTPException(404, f"No loop found ({stats['stopped']})")
+    return {"routes": routes, "search": stats}
+
+
+def require_tiles():
+    tiles = safety_tiles.get_tiles()
+    if tiles is None:
+        raise HTTPException(503, "Safety tiles not built (python safety_tiles.py build)")
+    return tiles
+
+
+@app.get("/api/safety/point")
+def tile_safety_score(lat: float, lng: float, radius_km: float = TileConfig.RADII[0]):
+    """Interpolated safety score for a point, plus the stored values of its tile"""
+    tiles = require_tiles()
+    try:
+        tile = tiles.lookup(lat, lng, radius_km)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if tile is None:
+        raise HTTPException(404, "Point is outside the tile grid")
+    return {
+        "safety_score": round(tiles.score(lat, lng, radius_km), 1),
+        "tile": tile,
+        "days_back": tiles.days_back,
+    }
+
+
+@app.get("/api/safety/heatmap")
+def safety_heatmap(
+    lat_min: float, lat_max: float, lng_min: float, lng_max: float,
+    radius_km: float = TileConfig.RADII[0],
+    max_cells: int = TileConfig.HEATMAP_MAX_CELLS,
+):
+    """Tile safety scores over a bounding box, downsampled to at most max_cells"""
+    tiles = require_tiles()
+    try:
+        return tiles.heatmap(lat_min, lat_max, lng_min, lng_max, radius_km,
+                             max_cells=min(max_cells, TileConfig.HEATMAP_MAX_CELLS))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@app.get("/api/address")
+def endpoint_address(lat: float, lng: float):
+    """Street address for a route endpoint, geocoded (and cached) only when the UI shows it"""
+    try:
+        address = get_routes.endpoint_address(lat, lng)
+    except Exception as e:
+        raise HTTPException(502, f"Geocoding failed: {e}")
+    if address is None:
+        raise HTTPException(404, "No address found")
+    return {"lat": lat, "lng": lng, "address": address}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Stage/request latency histograms and external call counters, Prometheus text format"""
+    return telemetry.metrics.prometheus_text()
+
+
+@app.get("/api/health/db")
+def db_pool_health():
+    """Connection pool metrics (in use, idle, waiting, created, discarded)"""
+    return db.pool_stats()
+
+
+@app.get("/api/health/cache")
+def cache_health():
+    """Geocode, route and route-result cache counters, request coalescing and the point memo"""
+    return {
+        **cache.stats(),
+        "route_results": route_results.stats(),
+        "coalescing": route_flights.stats(),
+        "point_memo": point_memo.stats(),
+    }
+
+
+@app.get("/api/health/llm")
+def llm_health():
+    """LLM call count, token usage, latency and response cache counters"""
+    ai_agent = get_safety_ai()
+    return ai_agent.stats() if ai_agent else {"enabled": False}
+
+
+# safety tiles, edge risks behind loop routes and memoized point lookups follow the crash data
+sync.on_refresh(safety_tiles.refresh)
+sync.on_refresh(loops.refresh)
+sync.on_refresh(point_memo.clear)
+sync.on_reload(safety_tiles.reload)
+sync.on_reload(loops.reload)
+sync.on_reload(point_memo.clear)
+
+
+@app.on_event("startup")
+def start_crash_sync():
+    # every worker runs the schedule, serialized by the sync's advisory lock: the one
+    # that upserts rebuilds and publishes derived data, the rest only re-map it
+    sync.start_scheduler()
+
+
+@app.on_event("startup")
+def prepare_loop_risks():
+    # off the request path: the first worker computes missing edge risks, the rest map them
+    backend = routing.get_backend()
+    if backend.local:
+        threading.Thread(
+            target=loops.prepare, args=(backend.graph,), name="edge-risks", daemon=True
+        ).start()
+
+
+@app.on_event("shutdown")
+def close_db_pool():
+    db.close_pool()
+
+
+@app.on_event("shutdown")
+async def close_route_engine():
+    await async_routes.close_engine()
+    async_routes.close_background_loop()
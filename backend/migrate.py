@@ -0,0 +1,55 @@
+"""
+Apply the SQL files in migrations/ in order, once each
+
+Usage:
+    python migrate.py
+"""
+
+import logging
+import os
+
+import db
+import telemetry
+
+log = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def applied_migrations(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name TEXT PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    cursor.execute("SELECT name FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate():
+    applied = []
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        done = applied_migrations(cursor)
+
+        for name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if not name.endswith(".sql") or name in done:
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                cursor.execute(f.read())
+            cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+            conn.commit()
+            applied.append(name)
+            log.info("Applied %s", name)
+
+    if not applied:
+        log.info("Schema is up to date")
+    return applied
+
+
+if __name__ == "__main__":
+    telemetry.configure_logging()
+    migrate()
@@ -0,0 +1,19 @@
+-- Time-windowed crash lookups (get_crashes_near_me / get_area_crash_percentiles with days_back)
+--
+-- crash_date leads the composite index so a days_back window narrows the scan to
+-- the rows inside the window before the lat/lng box is applied; smaller windows
+-- touch proportionally fewer index pages. The BRIN index is a few pages in size
+-- and covers full-history range scans, since backfill appends rows roughly in
+-- crash_date order.
+
+CREATE INDEX IF NOT EXISTS crashes_date_lat_lng_idx
+    ON crashes (crash_date, latitude, longitude)
+    INCLUDE (injuries, fatalities, collision_id);
+
+CREATE INDEX IF NOT EXISTS crashes_lat_lng_idx
+    ON crashes (latitude, longitude);
+
+CREATE INDEX IF NOT EXISTS crashes_date_brin_idx
+    ON crashes USING BRIN (crash_date);
+
+ANALYZE crashes;
@@ -0,0 +1,170 @@
+"""
+Memoized point safety lookups, per request and optionally process-wide
+
+Candidate routes share an origin and often their first kilometre, so scoring
+them asks for crash totals and neighbourhood baselines at the same (or nearly
+the same) points again and again. Lookups are keyed on (kind, quantized lat,
+lng, radius, window): a memo held in a contextvar answers repeats within one
+request (main's middleware opens it; telemetry.bind carries it into worker
+threads), and with PointMemoConfig.SHARED a TTL LRU answers them across
+requests until the next crash sync clears it.
+
+Points that round to the same key get the first point's result, so
+COORD_PRECISION trades exactness for hits (4 places is ~11 m, well inside the
+scoring radius). Error responses are never stored.
+"""
+
+import contextvars
+import threading
+
+import cache
+import telemetry
+from constants import PointMemoConfig
+
+_current = contextvars.ContextVar("point_memo", default=None)
+
+shared = cache.TTLCache(maxsize=PointMemoConfig.SHARED_SIZE, ttl=PointMemoConfig.SHARED_TTL)
+
+_stats_lock = threading.Lock()
+_stats = {"request_hits": 0, "shared_hits": 0, "misses": 0}
+
+
+class RequestMemo:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    def __len__(self):
+        return len(self._data)
+
+
+def start():
+    """Open a memo for this request's context; pass the token to end()"""
+    memo = RequestMemo()
+    return memo, _current.set(memo)
+
+
+def end(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def key(kind, lat, lng, radius_km, days_back):
+    return (
+        kind, *cache.quantize(lat, lng, PointMemoConfig.COORD_PRECISION),
+        float(radius_km), days_back,
+    )
+
+
+def _is_error(value):
+    if isinstance(value, dict):
+        return "error" in value
+    if isinstance(value, (tuple, list)):
+        return any(_is_error(item) for item in value)
+    return False
+
+
+def _record(memo, request_hits, shared_hits, misses):
+    with _stats_lock:
+        _stats["request_hits"] += request_hits
+        _stats["shared_hits"] += shared_hits
+        _stats["misses"] += misses
+    if memo is not None:
+        with memo._lock:
+            memo.hits += request_hits + shared_hits
+            memo.misses += misses
+    if request_hits + shared_hits:
+        telemetry.count("memo_hit", request_hits + shared_hits)
+    if misses:
+        telemetry.count("memo_miss", misses)
+
+
+def lookup_many(kind, lats, lngs, radius_km, days_back, compute):
+    """
+    Memoized compute(lats, lngs) -> list of per-point results
+
+    Only the points whose key is in neither the request memo nor the shared
+    LRU go to compute, in one call; points repeated within the batch are
+    computed once.
+    """
+    memo = _current.get()
+    use_shared = PointMemoConfig.SHARED and not cache.bypass
+    if not PointMemoConfig.ENABLED or (memo is None and not use_shared):
+        return compute(lats, lngs)
+
+    keys = [key(kind, lat, lng, radius_km, days_back) for lat, lng in zip(lats, lngs)]
+    results = [None] * len(keys)
+    missing = {}  # key -> first index needing it
+    request_hits = shared_hits = 0
+    for i, k in enumerate(keys):
+        value = memo.get(k) if memo is not None else None
+        if value is not None:
+            request_hits += 1
+        elif use_shared:
+            value = shared.get(k)
+            if value is not None:
+                shared_hits += 1
+                if memo is not None:
+                    memo.set(k, value)
+        if value is not None:
+            results[i] = value
+        elif k in missing:
+            request_hits += 1  # repeated within this batch
+        else:
+            missing[k] = i
+
+    if missing:
+        indices = list(missing.values())
+        computed = compute([lats[i] for i in indices], [lngs[i] for i in indices])
+        for k, value in zip(missing, computed):
+            results[missing[k]] = value
+            if _is_error(value):
+                continue
+            if memo is not None:
+                memo.set(k, value)
+            if use_shared:
+                shared.set(k, value)
+    for i, k in enumerate(keys):
+        if results[i] is None:
+            results[i] = results[missing[k]]
+
+    _record(memo, request_hits, shared_hits, len(missing))
+    return results
+
+
+def lookup(kind, lat, lng, radius_km, days_back, compute):
+    """lookup_many for one point; compute(lat, lng) returns its result"""
+    return lookup_many(
+        kind, [lat], [lng], radius_km, days_back,
+        lambda lats, lngs: [compute(lats[0], lngs[0])],
+    )[0]
+
+
+def clear():
+    """Drop the shared LRU (a sync.on_refresh/on_reload hook: totals change after a sync)"""
+    shared.clear()
+
+
+def stats():
+    with _stats_lock:
+        counts = dict(_stats)
+    lookups = counts["request_hits"] + counts["shared_hits"] + counts["misses"]
+    hits = counts["request_hits"] + counts["shared_hits"]
+    return {
+        **counts,
+        "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        "shared": shared.stats(),
+    }
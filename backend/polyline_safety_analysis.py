@@ -1,9 +1,25 @@
 import polyline  # pip install polyline
-import psycopg2
+import logging
 import math
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import baseline
+import corridor
+import crash_index
+import db
+import point_memo
+import safety_tiles
+import telemetry
 import utils
+from constants import CorridorConfig, ParallelConfig, R, TileConfig
 
+log = logging.getLogger(__name__)
 
+DANGEROUS_SCORE = 80  # stretches scoring below this are reported as dangerous
+
+
+@telemetry.timed("decode")
 def decode_route_polyline(encoded_polyline):
     """Decode Google's polyline to get all route coordinates"""
     if not encoded_polyline:
@@ -12,7 +28,7 @@ def decode_route_polyline(encoded_polyline):
         coordinates = polyline.decode(encoded_polyline)
         return [{"lat": lat, "lng": lng} for lat, lng in coordinates]
     except Exception as e:
-        print(f"Error decoding polyline: {e}")
+        log.warning("Error decoding polyline: %s", e)
         return []
 
 
@@ -48,51 +64,135 @@ def sample_route_points(route_points, max_samples=10):
     return sampled_points
 
 
+def decode_polyline_array(encoded_polyline, precision=5):
+    """
+    Decode Google's encoded polyline straight into a float64 (n, 2) array of (lat, lng)
+
+    Fully vectorized: every character is split into its 5-bit chunk and
+    continuation flag, chunks are summed per value with reduceat, zigzag-decoded
+    and cumulatively summed. No per-point Python objects are created.
+    """
+    if not encoded_polyline:
+        return np.empty((0, 2))
+
+    chars = np.frombuffer(encoded_polyline.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if chars.min() < 0 or chars.max() > 63:
+        raise ValueError("Invalid character in encoded polyline")
+
+    ends = np.flatnonzero((chars & 0x20) == 0)  # last chunk of each value
+    if len(ends) == 0 or ends[-1] != len(chars) - 1 or len(ends) % 2:
+        raise ValueError("Truncated encoded polyline")
+
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = 5 * (np.arange(len(chars)) - np.repeat(starts, ends - starts + 1))
+    values = np.add.reduceat((chars & 0x1F) << shifts, starts)
+
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10.0**precision
+
+
+@telemetry.timed("decode")
+def decode_route_array(encoded_polyline):
+    """decode_polyline_array with decode_route_polyline's forgiving error handling"""
+    try:
+        return decode_polyline_array(encoded_polyline)
+    except Exception as e:
+        log.warning("Error decoding polyline: %s", e)
+        return np.empty((0, 2))
+
+
+def sample_route_indices(n_points, max_samples=10):
+    """Indices sample_route_points would pick, always ending on the last point"""
+    if n_points <= max_samples:
+        return np.arange(n_points)
+    indices = np.arange(0, n_points, n_points // max_samples)
+    if indices[-1] != n_points - 1:
+        indices = np.append(indices, n_points - 1)
+    return indices
+
+
+def sample_route_array(coords, max_samples=10):
+    """sample_route_points for an (n, 2) array; only the few sampled points become dicts"""
+    n_points = len(coords)
+    indices = sample_route_indices(n_points, max_samples)
+    if n_points <= max_samples:
+        return [{"lat": float(lat), "lng": float(lng)} for lat, lng in coords]
+    return [
+        {
+            "lat": float(coords[i, 0]),
+            "lng": float(coords[i, 1]),
+            "route_index": int(i),
+            "route_progress": 100.0 if i == n_points - 1 else round((i / n_points) * 100, 1),
+        }
+        for i in indices
+    ]
+
+
+@telemetry.timed("scoring")
 def analyze_route_safety_detailed(route):
     """
     Comprehensive safety analysis using full route polyline
 
+    With CorridorConfig.ENABLED the whole polyline is scored as one corridor;
+    the 0.5 km circles around sample points are only the fallback when it
+    can't be (corridor disabled, too few vertices, or scoring failed).
+
     Args:
         route: Route dict with 'polyline' field
-        get_crashes_function: Function to get crash data (like get_crashes_near_me)
 
     Returns:
         Enhanced route with detailed safety analysis
     """
 
-    encoded_polyline = route.get("polyline", "")
-    route_points = decode_route_polyline(encoded_polyline)
+    coords = decode_route_array(route.get("polyline", ""))
+    if CorridorConfig.ENABLED:
+        enhanced = corridor_route_safety(route, coords)
+        if enhanced is not None:
+            return enhanced
 
+    sample_points = sample_route_array(coords, max_samples=5)
+    log.debug("Processing %d sample points", len(sample_points))
 
-    sample_points = sample_route_points(route_points, max_samples=5)
-    segment_analyses = []  # analyze safety at each sample point
+    # one lookup for all sample points of the route
+    crashes_responses = score_sample_points(
+        [point["lat"] for point in sample_points],
+        [point["lng"] for point in sample_points],
+    )
 
-    for i, point in enumerate(sample_points):
-        print(f"Processing point {i+1}/{len(sample_points)}: {point}")
+    segment_analyses = [  # safety at each sample point
+        build_segment_analysis(i, point, crashes_response)
+        for i, (point, crashes_response) in enumerate(zip(sample_points, crashes_responses))
+    ]
+    return summarize_route_safety(route, segment_analyses)
 
-        # get crash data near this point (smaller radius since we're checking multiple points)
-        crashes_response = get_crashes_near_me(
-            point["lat"],
-            point["lng"],
-            radius_km=0.5,  # WIP - smaller radius since we're sampling along route
-            days_back=60,
-        )
 
-        print(f"Got crashes response for point {i+1}")
+def score_sample_points(lats, lngs):
+    # get crash data near these points (smaller radius since we're checking multiple points)
+    return get_crashes_near_points(
+        lats,
+        lngs,
+        radius_km=0.5,  # WIP - smaller radius since we're sampling along route
+        days_back=60,
+    )
 
-        segment_analysis = {
-            "point_index": i,
-            "route_progress": point.get("route_progress", 0),
-            "coordinates": {"lat": point["lat"], "lng": point["lng"]},
-            "counts": crashes_response["summary"],
-            "safety_score": crashes_response["safety"]
-        }
-        segment_analyses.append(segment_analysis)
 
+def build_segment_analysis(i, point, crashes_response):
+    return {
+        "point_index": i,
+        "route_progress": point.get("route_progress", 0),
+        "coordinates": {"lat": point["lat"], "lng": point["lng"]},
+        "counts": crashes_response["summary"],
+        "safety_score": crashes_response["safety"]
+    }
+
+
+def summarize_route_safety(route, segment_analyses):
     safety_scores = [seg["safety_score"] for seg in segment_analyses]
     overall_safety = sum(safety_scores) / len(safety_scores)
 
-    dangerous_segments = [seg for seg in segment_analyses if seg["safety_score"] < 80]
+    dangerous_segments = [seg for seg in segment_analyses if seg["safety_score"] < DANGEROUS_SCORE]
     return {
         **route,
         "safety_analysis": {
@@ -102,8 +202,147 @@ def analyze_route_safety_detailed(route):
     }
 
 
+def corridor_route_safety(route, coords):
+    """
+    Route scored by its corridor, or None if it can't be
+
+    overall_safety_score is the corridor score and dangerous_segments are the
+    windows under DANGEROUS_SCORE, in the same shape as the sample-point
+    segments; the full corridor summary goes under "corridor".
+    """
+    summary = route_corridor_safety(coords)
+    if summary is None or "error" in summary:
+        if summary is not None:
+            log.warning("%s; scoring sample points instead", summary["error"])
+        return None
+
+    length_km = max(summary["length_km"], 1e-9)
+    dangerous_segments = [
+        {
+            "point_index": window["window_index"],
+            "route_progress": min(round(window["start_km"] / length_km * 100, 1), 100.0),
+            "coordinates": window["start"],
+            "counts": {
+                "total_crashes": window["crashes"],
+                "total_injuries": window["injuries"],
+                "total_fatalities": window["fatalities"],
+            },
+            "safety_score": window["safety_score"],
+        }
+        for window in summary["dangerous_windows"]
+    ]
+    return {
+        **route,
+        "safety_analysis": {
+            "overall_safety_score": summary["safety_score"],
+            "dangerous_segments": dangerous_segments,
+            "corridor": summary,
+        },
+    }
+
+
+@telemetry.timed("corridor")
+def route_corridor_safety(coords):
+    """Every vertex of the polyline, scored as one buffered corridor"""
+    try:
+        # column views of the decoded array, no copies
+        return corridor.corridor_safety(
+            coords[:, 0], coords[:, 1], days_back=60, dangerous_below=DANGEROUS_SCORE
+        )
+    except Exception as e:
+        return {"error": f"Corridor scoring failed: {str(e)}"}
+
+
+@telemetry.timed("scoring")
+def analyze_routes_parallel(routes, workers=ParallelConfig.WORKERS, use_processes=ParallelConfig.USE_PROCESSES):
+    """
+    Score every sample point of every route at once
+
+    All points go out as batch lookups (one SQL query each on the DB path).
+    Routes are grouped into contiguous chunks (route_chunks) fanned out over a
+    thread pool (the work is DB/index bound) or, with use_processes, a process
+    pool for CPU-heavy scoring. map() keeps chunks in submission order, so
+    output is identical to the serial path. With CorridorConfig.ENABLED each
+    route is one corridor, so the routes themselves are what is fanned out.
+    """
+    routes = list(routes)
+    if CorridorConfig.ENABLED:
+        if len(routes) <= 1:
+            return [analyze_route_safety_detailed(route) for route in routes]
+        executor = get_executor(workers, use_processes)
+        return list(executor.map(
+            analyze_route_safety_detailed if use_processes
+            else telemetry.bind(analyze_route_safety_detailed),
+            routes,
+        ))
+
+    route_coords = [decode_route_array(route.get("polyline", "")) for route in routes]
+    sample_points = [sample_route_array(coords, max_samples=5) for coords in route_coords]
+    chunks = [
+        [point for i in chunk for point in sample_points[i]]
+        for chunk in route_chunks(sample_points, workers)
+    ]
+
+    if len(chunks) <= 1:
+        chunk_responses = [score_sample_points(
+            [point["lat"] for point in chunks[0]], [point["lng"] for point in chunks[0]]
+        )]
+    else:
+        executor = get_executor(workers, use_processes)
+        chunk_responses = executor.map(
+            # threads report to this request's trace; process workers can't
+            score_sample_points if use_processes else telemetry.bind(score_sample_points),
+            [[point["lat"] for point in chunk] for chunk in chunks],
+            [[point["lng"] for point in chunk] for chunk in chunks],
+        )
+    responses = iter([response for chunk in chunk_responses for response in chunk])
+
+    enhanced_routes = []
+    for route, coords, points in zip(routes, route_coords, sample_points):
+        segment_analyses = [
+            build_segment_analysis(i, point, next(responses))
+            for i, point in enumerate(points)
+        ]
+        enhanced_routes.append(summarize_route_safety(route, segment_analyses))
+    return enhanced_routes
+
+
+def route_chunks(sample_points, workers=ParallelConfig.WORKERS):
+    """
+    Route indices per pool task: up to `workers` contiguous groups of whole routes
+
+    A typical request (8 routes x ~6 samples) is a few dozen points, so routes
+    rather than a points-per-chunk size are the unit; below MIN_BATCH points
+    in total everything stays one lookup.
+    """
+    n_routes = len(sample_points)
+    if n_routes <= 1 or sum(len(points) for points in sample_points) < ParallelConfig.MIN_BATCH:
+        return [range(n_routes)]
+    bounds = np.linspace(0, n_routes, min(workers, n_routes) + 1).round().astype(int)
+    return [range(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+_executors = {}
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers=ParallelConfig.WORKERS, use_processes=False):
+    """Long-lived pools, one per (kind, size), so requests don't pay pool start-up"""
+    key = ("process" if use_processes else "thread", workers)
+    with _executor_lock:
+        if key not in _executors:
+            if use_processes:
+                _executors[key] = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _executors[key] = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="safety"
+                )
+        return _executors[key]
+
+
 def generate_running_routes_with_polyline_safety(
-    start_lat, start_lng, target_distance_km, get_routes_function
+    start_lat, start_lng, target_distance_km, get_routes_function, parallel=True,
+    workers=ParallelConfig.WORKERS,
 ):
     """
     Main function to generate routes with detailed polyline-based safety analysis
@@ -112,20 +351,22 @@ def generate_running_routes_with_polyline_safety(
     if not routes:
         return {}
 
+    if parallel:
+        return analyze_routes_parallel(routes, workers=workers)
+
     enhanced_routes = []
     for route in routes:
         enhanced_route = analyze_route_safety_detailed(route)
         enhanced_routes.append(enhanced_route)
     return enhanced_routes
 
-def get_area_crash_percentiles(lat: float, lng: float, radius_km: float = 1.0, attr="injuries"):
+def get_area_crash_percentiles(
+    lat: float, lng: float, radius_km: float = 1.0, attr="injuries", days_back=None
+):
     """Calculate crash percentiles for areas similar to the query location"""
     try:
-        conn = psycopg2.connect(
-            host="localhost", database="runsafe_db", user="lpietrewicz", password=""
-        ) # TO BE CHANGED
-        cursor = conn.cursor()
-        
+        since = utils.window_start(days_back)
+        date_filter = "AND crash_date >= %s" if since else ""
         # create a grid of sample points around the area to get distribution
         grid_size = 0.01
         sample_points = []
@@ -134,32 +375,34 @@ def get_area_crash_percentiles(lat: float, lng: float, radius_km: float = 1.0, a
             f"{attr}": f"COALESCE(SUM({attr}), 0)",
             "crashes": "COUNT(*)",
         }
-        
-        for lat_offset in [-2*grid_size, -grid_size, 0, grid_size, 2*grid_size]:
-            for lng_offset in [-2*grid_size, -grid_size, 0, grid_size, 2*grid_size]:
-                sample_lat = lat + lat_offset
-                sample_lng = lng + lng_offset
-                
-                lat_buffer = radius_km / 111.0
-                lng_buffer = radius_km / (111.0 * math.cos(math.radians(sample_lat)))
-                
-                cursor.execute(
-                    f"""
-                    SELECT 
-                        {sql[f"{attr}"]} as {attr}
-                    FROM crashes
-                    WHERE latitude BETWEEN %s AND %s
-                    AND longitude BETWEEN %s AND %s
-                    """,
-                    (sample_lat - lat_buffer, sample_lat + lat_buffer, 
-                     sample_lng - lng_buffer, sample_lng + lng_buffer),
-                )
-                
-                count = cursor.fetchone()[0]
-                sample_points.append(count)
-        
-        conn.close()
-        
+
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            for lat_offset in [-2*grid_size, -grid_size, 0, grid_size, 2*grid_size]:
+                for lng_offset in [-2*grid_size, -grid_size, 0, grid_size, 2*grid_size]:
+                    sample_lat = lat + lat_offset
+                    sample_lng = lng + lng_offset
+
+                    lat_buffer = radius_km / 111.0
+                    lng_buffer = radius_km / (111.0 * math.cos(math.radians(sample_lat)))
+
+                    cursor.execute(
+                        f"""
+                        SELECT 
+                            {sql[f"{attr}"]} as {attr}
+                        FROM crashes
+                        WHERE latitude BETWEEN %s AND %s
+                        AND longitude BETWEEN %s AND %s
+                        {date_filter}
+                        """,
+                        (sample_lat - lat_buffer, sample_lat + lat_buffer, 
+                         sample_lng - lng_buffer, sample_lng + lng_buffer)
+                        + ((since,) if since else ()),
+                    )
+
+                    count = cursor.fetchone()[0]
+                    sample_points.append(count)
+
         sample_points.sort()
         p50_index = int(0.5 * len(sample_points))
         
@@ -169,52 +412,222 @@ def get_area_crash_percentiles(lat: float, lng: float, radius_km: float = 1.0, a
         return {"error": f"Percentile calculation failed: {str(e)}"}
 
 
-def get_crashes_near_me(
-    lat: float, lng: float, radius_km: float = 0.5, days_back: int = 60
-):
+def area_baselines(lat: float, lng: float, radius_km: float, days_back=None):
+    """p50 crashes, injuries and fatalities around a point, memoized per request"""
+    return point_memo.lookup("baseline", lat, lng, radius_km, days_back, lambda lat, lng: (
+        lookup_area_baselines(lat, lng, radius_km, days_back=days_back)
+    ))
+
+
+@telemetry.timed("baseline")
+def lookup_area_baselines(lat: float, lng: float, radius_km: float, days_back=None):
+    """p50 crashes, injuries and fatalities around a point, from the baseline grid when available"""
     try:
-        # WIP - move this out
-        conn = psycopg2.connect(
-            host="localhost", database="runsafe_db", user="lpietrewicz", password=""
+        p50 = baseline.area_percentiles(lat, lng, radius_km, days_back=days_back)
+        return p50["crashes"], p50["injuries"], p50["fatalities"]
+    except Exception as e:
+        log.warning("Baseline grid unavailable, falling back to SQL: %s", e)
+        return tuple(
+            get_area_crash_percentiles(
+                lat, lng, radius_km=radius_km, attr=attr, days_back=days_back
+            )
+            for attr in baseline.ATTRS
         )
-        cursor = conn.cursor()
 
-        # bounding box for query
-        lat_buffer = radius_km / 111.0
-        lng_buffer = radius_km / (111.0 * math.cos(math.radians(lat)))
 
+def query_crashes_near_me(lat: float, lng: float, radius_km: float, days_back=None):
+    """SQL path: bounding-box query in Postgres, then exact distance filter"""
+    # bounding box for query
+    lat_buffer = radius_km / 111.0
+    lng_buffer = radius_km / (111.0 * math.cos(math.radians(lat)))
+
+    # crash_date leads the (crash_date, latitude, longitude) index, see migrations/
+    since = utils.window_start(days_back)
+    date_filter = "AND crash_date >= %s" if since else ""
+
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
         cursor.execute(
-            """
+            f"""
             SELECT collision_id, crash_date, latitude, longitude, injuries, fatalities
             FROM crashes
             WHERE latitude BETWEEN %s AND %s
             AND longitude BETWEEN %s AND %s
+            {date_filter}
         """,
-            (lat - lat_buffer, lat + lat_buffer, lng - lng_buffer, lng + lng_buffer),
+            (lat - lat_buffer, lat + lat_buffer, lng - lng_buffer, lng + lng_buffer)
+            + ((since,) if since else ()),
         )
-
         rough_crashes = cursor.fetchall()
-        conn.close()
-
-        # filter by exact distance
-        nearby_crashes = []
-        for crash in rough_crashes:
-            collision_id, crash_date, crash_lat, crash_lng, injuries, fatalities = crash
-            distance = utils.euc_distance(lat, lng, float(crash_lat), float(crash_lng))
-
-            if distance <= radius_km:
-                clean_crash = {
-                    "crash_id": collision_id,
-                    "date": str(crash_date),
-                    "distance_km": round(distance, 2),
-                    "location": {"lat": float(crash_lat), "lng": float(crash_lng)},
-                    "injuries": injuries or 0,
-                    "fatalities": fatalities or 0,
+
+    if not rough_crashes:
+        return []
+
+    # filter by exact distance, all candidates at once
+    crash_lats = np.array([float(crash[2]) for crash in rough_crashes])
+    crash_lngs = np.array([float(crash[3]) for crash in rough_crashes])
+    distances = utils.haversine_many(lat, lng, crash_lats, crash_lngs)
+
+    nearby_crashes = []
+    for i in np.flatnonzero(distances <= radius_km):
+        collision_id, crash_date, crash_lat, crash_lng, injuries, fatalities = rough_crashes[i]
+        clean_crash = {
+            "crash_id": collision_id,
+            "date": str(crash_date),
+            "distance_km": round(float(distances[i]), 2),
+            "location": {"lat": float(crash_lat), "lng": float(crash_lng)},
+            "injuries": injuries or 0,
+            "fatalities": fatalities or 0,
+        }
+        nearby_crashes.append(clean_crash)
+    return nearby_crashes
+
+
+def query_crash_totals_near_points(lats, lngs, radius_km: float, days_back=None):
+    """
+    SQL path for many points in one round trip
+
+    The points are unnested server-side and each one is joined (LATERAL) against
+    its own bounding box, so the per-point lat/lng index ranges still apply;
+    exact haversine filtering and the per-point aggregates happen in Postgres.
+
+    Returns:
+        list of (total_crashes, total_injuries, total_fatalities), in input order
+    """
+    if len(lats) == 0:
+        return []
+
+    since = utils.window_start(days_back)
+    date_filter = "AND c.crash_date >= %(since)s" if since else ""
+
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT p.idx, COUNT(c.collision_id),
+                   COALESCE(SUM(c.injuries), 0), COALESCE(SUM(c.fatalities), 0)
+            FROM unnest(%(lats)s::float8[], %(lngs)s::float8[])
+                 WITH ORDINALITY AS p(lat, lng, idx)
+            LEFT JOIN LATERAL (
+                SELECT collision_id, injuries, fatalities
+                FROM crashes c
+                WHERE c.latitude BETWEEN p.lat - %(lat_buffer)s AND p.lat + %(lat_buffer)s
+                AND c.longitude BETWEEN p.lng - %(lat_buffer)s / cos(radians(p.lat))
+                                    AND p.lng + %(lat_buffer)s / cos(radians(p.lat))
+                {date_filter}
+                AND %(earth_radius)s * 2 * asin(sqrt(
+                        sin(radians(c.latitude - p.lat) / 2) ^ 2
+                        + cos(radians(p.lat)) * cos(radians(c.latitude))
+                        * sin(radians(c.longitude - p.lng) / 2) ^ 2
+                    )) <= %(radius_km)s
+            ) c ON true
+            GROUP BY p.idx
+            ORDER BY p.idx
+            """,
+            {
+                "lats": [float(lat) for lat in lats],
+                "lngs": [float(lng) for lng in lngs],
+                "lat_buffer": radius_km / 111.0,
+                "radius_km": radius_km,
+                "earth_radius": R,
+                "since": since,
+            },
+        )
+        return [(int(c), int(i), int(f)) for _, c, i, f in cursor.fetchall()]
+
+
+def get_crashes_near_points(lats, lngs, radius_km: float = 0.5, days_back: int = 60):
+    """
+    Batch twin of get_crashes_near_me: one index pass or one SQL query for all points
+
+    Points already looked up in this request (see point_memo) are answered from
+    the memo; only the rest reach the tiles, index or database.
+
+    Returns:
+        list of responses shaped like get_crashes_near_me's, in input order
+    """
+    responses = point_memo.lookup_many(
+        "near", lats, lngs, radius_km, days_back,
+        lambda lats, lngs: lookup_crashes_near_points(lats, lngs, radius_km, days_back),
+    )
+    return [located(response, lat, lng) for response, lat, lng in zip(responses, lats, lngs)]
+
+
+def located(response, lat, lng):
+    """A memoized response, reporting the point that was asked about"""
+    if "search_location" not in response:
+        return response
+    return {**response, "search_location": {"lat": lat, "lng": lng}}
+
+
+def lookup_crashes_near_points(lats, lngs, radius_km: float = 0.5, days_back: int = 60):
+    if TileConfig.USE_FOR_ROUTES:
+        responses = safety_tiles.point_responses(lats, lngs, radius_km, days_back)
+        if responses is not None:
+            return responses
+
+    try:
+        with telemetry.stage("crash_query"):
+            if crash_index.enabled:
+                index = crash_index.get_index()
+                totals = [
+                    tuple(index.aggregate(lat, lng, radius_km, days_back=days_back).values())
+                    for lat, lng in zip(lats, lngs)
+                ]
+            else:
+                totals = query_crash_totals_near_points(lats, lngs, radius_km, days_back=days_back)
+
+        responses = []
+        for lat, lng, (total_crashes, total_injuries, total_fatalities) in zip(lats, lngs, totals):
+            safety_score = score_crash_totals(
+                lat, lng, radius_km, total_crashes, total_injuries, total_fatalities,
+                days_back=days_back,
+            )
+            responses.append(
+                {
+                    "search_location": {"lat": lat, "lng": lng},
+                    "search_radius_km": radius_km,
+                    "days_searched": days_back,
+                    "summary": {
+                        "total_crashes": total_crashes,
+                        "total_injuries": total_injuries,
+                        "total_fatalities": total_fatalities,
+                    },
+                    "safety": safety_score,
                 }
-                nearby_crashes.append(clean_crash)
+            )
+        return responses
+
+    except Exception as e:
+        return [{"error": f"Database query failed: {str(e)}"} for _ in lats]
+
+
+def get_crashes_near_me(
+    lat: float, lng: float, radius_km: float = 0.5, days_back: int = 60
+):
+    response = point_memo.lookup("near_me", lat, lng, radius_km, days_back, lambda lat, lng: (
+        lookup_crashes_near_me(lat, lng, radius_km, days_back)
+    ))
+    return located(response, lat, lng)
+
+
+def lookup_crashes_near_me(
+    lat: float, lng: float, radius_km: float = 0.5, days_back: int = 60
+):
+    try:
+        with telemetry.stage("crash_query"):
+            if crash_index.enabled:
+                index = crash_index.get_index()
+                nearby_crashes = index.records(
+                    *index.query_radius(lat, lng, radius_km, days_back=days_back)
+                )
+            else:
+                nearby_crashes = query_crashes_near_me(lat, lng, radius_km, days_back=days_back)
 
         # summary
-        safety_score, total_crashes, total_injuries, total_fatalities = safety_wrapper(lat, lng, radius_km, nearby_crashes)
+        safety_score, total_crashes, total_injuries, total_fatalities = safety_wrapper(
+            lat, lng, radius_km, nearby_crashes, days_back=days_back
+        )
 
         return {
             "search_location": {"lat": lat, "lng": lng},
@@ -243,22 +656,33 @@ def calculate_safety_score_logarithmic(crash_ratio, injury_ratio, fatality_ratio
     safety_score = 100 - crash_penalty - injury_penalty - fatality_penalty
     return max(0, min(100, safety_score))
 
-def safety_wrapper(lat, lng, radius_km, nearby_crashes):
+def baseline_ratio(total, percentile50):
+    """total / p50, falling back to the raw total when the baseline is zero"""
+    try:
+        return total / percentile50
+    except ZeroDivisionError:
+        return total
+
+
+def safety_wrapper(lat, lng, radius_km, nearby_crashes, days_back=None):
     total_crashes = len(nearby_crashes)
     total_injuries = sum(crash["injuries"] for crash in nearby_crashes)
     total_fatalities = sum(crash["fatalities"] for crash in nearby_crashes)
 
+    safety_score = score_crash_totals(
+        lat, lng, radius_km, total_crashes, total_injuries, total_fatalities,
+        days_back=days_back,
+    )
+    return safety_score, total_crashes, total_injuries, total_fatalities
 
-    percentile50_crashes = get_area_crash_percentiles(lat, lng, radius_km=radius_km, attr="crashes")
-    percentile50_injuries = get_area_crash_percentiles(lat, lng, radius_km=radius_km, attr="injuries")
-    percentile50_fatalities = get_area_crash_percentiles(lat, lng, radius_km=radius_km, attr="fatalities")
-    try:
-        fatality_r = total_fatalities / percentile50_fatalities
-    except ZeroDivisionError:
-        fatality_r = total_fatalities
 
-    crash_r = total_crashes / percentile50_crashes
-    injury_r = total_injuries / percentile50_injuries
+def score_crash_totals(lat, lng, radius_km, total_crashes, total_injuries, total_fatalities, days_back=None):
+    percentile50_crashes, percentile50_injuries, percentile50_fatalities = area_baselines(
+        lat, lng, radius_km, days_back=days_back
+    )
+    # short windows can leave quiet neighbourhoods with a zero median
+    fatality_r = baseline_ratio(total_fatalities, percentile50_fatalities)
+    crash_r = baseline_ratio(total_crashes, percentile50_crashes)
+    injury_r = baseline_ratio(total_injuries, percentile50_injuries)
 
-    safety_score = calculate_safety_score_logarithmic(crash_r, injury_r, fatality_r)
-    return safety_score, total_crashes, total_injuries, total_fatalities
\ No newline at end of file
+    return calculate_safety_score_logarithmic(crash_r, injury_r, fatality_r)
@@ -0,0 +1,81 @@
+"""
+Pluggable walking-route backends for candidate endpoints
+
+A backend answers route(start, end) and routes_from(start, points) with
+get_routes.parse_routes_result-shaped dicts (distance_km, duration_minutes,
+polyline, success). "google" calls the Routes API, one request per endpoint;
+"graph" searches the local street graph (street_graph.py), all endpoints of a
+start in one Dijkstra, with no network or quota. RoutingConfig.BACKEND picks
+the process default; set_backend swaps it (e.g. for a synthetic graph).
+"""
+
+import logging
+import threading
+
+import telemetry
+from constants import RoutingConfig
+
+log = logging.getLogger(__name__)
+
+
+class GoogleRouting:
+    name = "google"
+    local = False  # network bound: async callers make their own concurrent requests
+
+    def route(self, start_lat, start_lng, end_lat, end_lng):
+        # imported here: get_routes imports this module
+        import get_routes
+
+        return get_routes.test_google_routes_distance(start_lat, start_lng, end_lat, end_lng)
+
+    def routes_from(self, start_lat, start_lng, points):
+        return [self.route(start_lat, start_lng, lat, lng) for lat, lng in points]
+
+
+class GraphRouting:
+    name = "graph"
+    local = True
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def route(self, start_lat, start_lng, end_lat, end_lng):
+        with telemetry.stage("graph_route"):
+            telemetry.count("graph_route")
+            return self.graph.route(start_lat, start_lng, end_lat, end_lng)
+
+    def routes_from(self, start_lat, start_lng, points):
+        with telemetry.stage("graph_route"):
+            telemetry.count("graph_route")
+            return self.graph.routes_from(start_lat, start_lng, points)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def load_backend(name=RoutingConfig.BACKEND):
+    if name == "graph":
+        import street_graph
+
+        try:
+            return GraphRouting(street_graph.StreetGraph.load())
+        except FileNotFoundError:
+            log.warning("No street graph in %s, routing with Google", RoutingConfig.GRAPH_DIR)
+    return GoogleRouting()
+
+
+def get_backend():
+    """Process-wide backend, loaded on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = load_backend()
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,337 @@
+"""
+Citywide safety tiles: point scores precomputed on a fixed grid
+
+The BaselineGrid bounds are cut into RESOLUTION-degree tiles. For each tile
+centre and each radius in TileConfig.RADII the build job stores the inputs
+and output of calculate_safety_score_logarithmic: crash/injury/fatality totals
+within the radius over the DAYS_BACK window, their neighbourhood p50s and the
+score. Everything goes into one float32 file (a JSON header, then the array)
+that is memory-mapped on load, so a lookup is a few array reads and the
+pages are shared between worker processes.
+
+Scores between tile centres are bilinearly interpolated. At the default
+0.0025 deg (~250 m) resolution and 0.5 km radius, scores at random points
+were off from the exact score by ~2 points on average (p95 ~8) on a seeded
+year of crashes; finer tiles tighten that. That is fine for heatmaps and
+ranking, which is why route scoring only uses tiles with
+TileConfig.USE_FOR_ROUTES. `python safety_tiles.py check LAT LNG` compares
+a point against the exact score.
+
+Once built, the tiles follow the crash data: the process that syncs new rows
+rebuilds them with the same settings (refresh, a sync.on_refresh hook) and
+the other workers re-map the new file (reload, a sync.on_reload hook).
+
+Usage:
+    python safety_tiles.py build                 # from the crash index, write PATH
+    python safety_tiles.py check LAT LNG [RADIUS_KM]
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+import baseline
+import crash_index
+from constants import BaselineGrid, TileConfig
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"RSTILES1"
+HEADER_ALIGN = 64
+LAYERS = (
+    "crashes", "injuries", "fatalities",
+    "p50_crashes", "p50_injuries", "p50_fatalities",
+    "score",
+)
+SCORE = LAYERS.index("score")
+
+
+class SafetyTiles:
+    def __init__(self, data, resolution, lat_min, lng_min, radii, days_back, built_at=None):
+        self.data = data  # (radii, layers, n_lat, n_lng) float32
+        self.resolution = float(resolution)
+        self.lat_min = float(lat_min)
+        self.lng_min = float(lng_min)
+        self.radii = tuple(float(r) for r in radii)
+        self.days_back = days_back
+        self.built_at = built_at
+        self.n_lat, self.n_lng = data.shape[2:]
+
+    def covers(self, radius_km, days_back):
+        return days_back == self.days_back and float(radius_km) in self.radii
+
+    def _layers(self, radius_km):
+        try:
+            return self.data[self.radii.index(float(radius_km))]
+        except ValueError:
+            raise ValueError(f"No tiles for radius {radius_km} km (have {self.radii})") from None
+
+    def centres(self):
+        lats = self.lat_min + (np.arange(self.n_lat) + 0.5) * self.resolution
+        lngs = self.lng_min + (np.arange(self.n_lng) + 0.5) * self.resolution
+        return lats, lngs
+
+    def tile_index(self, lats, lngs):
+        """(rows, cols, inside) of the tiles containing each point"""
+        rows = np.floor((np.asarray(lats, dtype=np.float64) - self.lat_min) / self.resolution).astype(np.int64)
+        cols = np.floor((np.asarray(lngs, dtype=np.float64) - self.lng_min) / self.resolution).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.n_lat) & (cols >= 0) & (cols < self.n_lng)
+        return np.clip(rows, 0, self.n_lat - 1), np.clip(cols, 0, self.n_lng - 1), inside
+
+    def lookup(self, lat, lng, radius_km):
+        """Every stored layer for the tile containing the point, or None outside the grid"""
+        rows, cols, inside = self.tile_index([lat], [lng])
+        if not inside[0]:
+            return None
+        values = self._layers(radius_km)[:, rows[0], cols[0]]
+        return {layer: float(value) for layer, value in zip(LAYERS, values)}
+
+    def scores(self, lats, lngs, radius_km, interpolate=True):
+        """Safety score per point (NaN outside the grid), bilinear between tile centres"""
+        layer = self._layers(radius_km)[SCORE]
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        rows, cols, inside = self.tile_index(lats, lngs)
+        if not interpolate:
+            return np.where(inside, layer[rows, cols], np.nan)
+
+        # fractional position in tile-centre coordinates, clamped at the edges
+        fr = np.clip((lats - self.lat_min) / self.resolution - 0.5, 0, self.n_lat - 1)
+        fc = np.clip((lngs - self.lng_min) / self.resolution - 0.5, 0, self.n_lng - 1)
+        r0, c0 = np.floor(fr).astype(np.int64), np.floor(fc).astype(np.int64)
+        r1, c1 = np.minimum(r0 + 1, self.n_lat - 1), np.minimum(c0 + 1, self.n_lng - 1)
+        wr, wc = fr - r0, fc - c0
+        top = layer[r0, c0] * (1 - wc) + layer[r0, c1] * wc
+        bottom = layer[r1, c0] * (1 - wc) + layer[r1, c1] * wc
+        return np.where(inside, top * (1 - wr) + bottom * wr, np.nan)
+
+    def score(self, lat, lng, radius_km, interpolate=True):
+        return float(self.scores([lat], [lng], radius_km, interpolate)[0])
+
+    def polyline_scores(self, coords, radius_km):
+        """Per-vertex scores along an (n, 2) lat/lng array, with the mean and the worst vertex"""
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        scores = self.scores(coords[:, 0], coords[:, 1], radius_km)
+        if not len(scores) or np.isnan(scores).all():
+            return {"scores": scores, "mean": None, "min": None, "min_index": None}
+        worst = int(np.nanargmin(scores))
+        return {
+            "scores": scores,
+            "mean": round(float(np.nanmean(scores)), 1),
+            "min": round(float(scores[worst]), 1),
+            "min_index": worst,
+        }
+
+    def heatmap(self, lat_lo, lat_hi, lng_lo, lng_hi, radius_km,
+                max_cells=TileConfig.HEATMAP_MAX_CELLS):
+        """Scores for the tiles in a box, strided so at most max_cells come back"""
+        r0, c0, _ = self.tile_index([lat_lo], [lng_lo])
+        r1, c1, _ = self.tile_index([lat_hi], [lng_hi])
+        r0, r1, c0, c1 = int(r0[0]), int(r1[0]), int(c0[0]), int(c1[0])
+        n_cells = (r1 - r0 + 1) * (c1 - c0 + 1)
+        stride = max(1, int(np.ceil(np.sqrt(n_cells / max_cells))))
+
+        scores = self._layers(radius_km)[SCORE, r0:r1 + 1:stride, c0:c1 + 1:stride]
+        lats, lngs = self.centres()
+        return {
+            "radius_km": float(radius_km),
+            "days_back": self.days_back,
+            "cell_size_deg": self.resolution * stride,
+            "lats": np.round(lats[r0:r1 + 1:stride], 6).tolist(),
+            "lngs": np.round(lngs[c0:c1 + 1:stride], 6).tolist(),
+            "scores": np.round(scores, 1).tolist(),
+        }
+
+    def header(self):
+        return {
+            "resolution": self.resolution,
+            "lat_min": self.lat_min,
+            "lng_min": self.lng_min,
+            "radii": list(self.radii),
+            "days_back": self.days_back,
+            "layers": list(LAYERS),
+            "shape": list(self.data.shape),
+            "built_at": self.built_at,
+        }
+
+    def save(self, path=TileConfig.PATH):
+        """Write to a temporary file and swap it in, so workers mapping the old one keep valid pages"""
+        header = json.dumps(self.header()).encode()
+        # pad so the array starts on an aligned offset
+        length = len(MAGIC) + 4 + len(header)
+        header += b" " * (-length % HEADER_ALIGN)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            f.write(np.ascontiguousarray(self.data, dtype="<f4").tobytes())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=TileConfig.PATH, mmap=True):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a safety tile file")
+            header_length = int.from_bytes(f.read(4), "little")
+            header = json.loads(f.read(header_length))
+        offset = len(MAGIC) + 4 + header_length
+        shape = tuple(header["shape"])
+        if mmap:
+            data = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=shape)
+        else:
+            data = np.fromfile(path, dtype="<f4", offset=offset).reshape(shape)
+        return cls(
+            data, header["resolution"], header["lat_min"], header["lng_min"],
+            header["radii"], header["days_back"], header.get("built_at"),
+        )
+
+
+def tile_totals(lats, lngs, radius_km, days_back):
+    """(3, n) crash/injury/fatality totals within radius_km of each tile centre"""
+    # imported here: polyline_safety_analysis imports this module
+    import polyline_safety_analysis as p
+
+    if crash_index.enabled:
+        index = crash_index.get_index()
+        totals = [
+            tuple(index.aggregate(lat, lng, radius_km, days_back=days_back).values())
+            for lat, lng in zip(lats, lngs)
+        ]
+    else:
+        totals = []
+        for start in range(0, len(lats), 5000):
+            totals += p.query_crash_totals_near_points(
+                lats[start:start + 5000], lngs[start:start + 5000], radius_km, days_back=days_back
+            )
+    return np.array(totals, dtype=np.float64).reshape(-1, 3).T
+
+
+def build(resolution=TileConfig.RESOLUTION, radii=TileConfig.RADII, days_back=TileConfig.DAYS_BACK):
+    import polyline_safety_analysis as p
+
+    lat_min, lng_min = BaselineGrid.LAT_MIN, BaselineGrid.LNG_MIN
+    n_lat = int(np.ceil((BaselineGrid.LAT_MAX - lat_min) / resolution))
+    n_lng = int(np.ceil((BaselineGrid.LNG_MAX - lng_min) / resolution))
+    centre_lats = lat_min + (np.arange(n_lat) + 0.5) * resolution
+    centre_lngs = lng_min + (np.arange(n_lng) + 0.5) * resolution
+    lats = np.repeat(centre_lats, n_lng)
+    lngs = np.tile(centre_lngs, n_lat)
+
+    grid = baseline.get_grid(days_back)
+    score = np.vectorize(p.calculate_safety_score_logarithmic, otypes=[np.float64])
+    data = np.empty((len(radii), len(LAYERS), n_lat, n_lng), dtype=np.float32)
+    for k, radius_km in enumerate(radii):
+        totals = tile_totals(lats, lngs, radius_km, days_back)
+        p50 = grid.percentiles_many(lats, lngs, radius_km).astype(np.float64)
+        # baseline_ratio: the raw total when the neighbourhood median is zero
+        ratios = np.where(p50 > 0, totals / np.where(p50 > 0, p50, 1), totals)
+        layers = np.concatenate([totals, p50, score(*ratios)[None]])
+        data[k] = layers.reshape(len(LAYERS), n_lat, n_lng)
+
+    return SafetyTiles(
+        data, resolution, lat_min, lng_min, radii, days_back,
+        built_at=datetime.now().isoformat(timespec="seconds"),
+    )
+
+
+_tiles = None
+_tiles_lock = threading.Lock()
+
+
+def get_tiles():
+    """Process-wide tiles mapped from TileConfig.PATH, or None if it hasn't been built"""
+    global _tiles
+    if _tiles is None:
+        with _tiles_lock:
+            if _tiles is None:
+                try:
+                    _tiles = SafetyTiles.load()
+                except FileNotFoundError:
+                    return None
+    return _tiles
+
+
+def reload():
+    """Pick up a rebuilt tile file (a sync.on_reload hook in workers that didn't sync)"""
+    global _tiles
+    with _tiles_lock:
+        _tiles = None
+    return get_tiles()
+
+
+def refresh():
+    """
+    Sync hook in the process that synced: rebuild the tiles from the refreshed
+    crash data with the current file's settings, save and swap them in
+
+    Does nothing where the tiles were never built.
+    """
+    current = get_tiles()
+    if current is None:
+        return None
+    started = time.perf_counter()
+    tiles = build(current.resolution, current.radii, current.days_back)
+    tiles.save()
+    log.info("Safety tiles rebuilt in %.1fs", time.perf_counter() - started)
+    return reload()
+
+
+def point_responses(lats, lngs, radius_km, days_back):
+    """
+    get_crashes_near_points-shaped responses from the tiles, or None when the
+    tiles don't cover this radius/window or a point falls outside the grid
+
+    Summary and safety both come from the tile containing the point (not the
+    bilinear score), so the score is the one for those totals.
+    """
+    tiles = get_tiles()
+    if tiles is None or not tiles.covers(radius_km, days_back):
+        return None
+    rows, cols, inside = tiles.tile_index(lats, lngs)
+    if not inside.all():
+        return None
+    layers = tiles._layers(radius_km)
+    return [
+        {
+            "search_location": {"lat": lat, "lng": lng},
+            "search_radius_km": radius_km,
+            "days_searched": days_back,
+            "summary": {
+                "total_crashes": int(layers[0, row, col]),
+                "total_injuries": int(layers[1, row, col]),
+                "total_fatalities": int(layers[2, row, col]),
+            },
+            "safety": float(layers[SCORE, row, col]),
+        }
+        for lat, lng, row, col in zip(lats, lngs, rows, cols)
+    ]
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+
+    if command == "build":
+        started = time.perf_counter()
+        tiles = build()
+        tiles.save()
+        print(f"Safety tiles built: {tiles.n_lat}x{tiles.n_lng} tiles, radii {tiles.radii} km, "
+              f"{time.perf_counter() - started:.1f}s -> {TileConfig.PATH}")
+    elif command == "check":
+        import polyline_safety_analysis as p
+
+        lat, lng = float(sys.argv[2]), float(sys.argv[3])
+        radius_km = float(sys.argv[4]) if len(sys.argv) > 4 else TileConfig.RADII[0]
+        tiles = SafetyTiles.load()
+        exact = p.get_crashes_near_me(lat, lng, radius_km, days_back=tiles.days_back)
+        print(f"tile:         {tiles.lookup(lat, lng, radius_km)}")
+        print(f"interpolated: {tiles.score(lat, lng, radius_km):.1f}")
+        print(f"exact:        {exact.get('safety')}  {exact.get('summary')}")
+    else:
+        print(__doc__)
@@ -0,0 +1,334 @@
+"""
+Pedestrian street graph in CSR arrays, with Dijkstra/A* over it
+
+Nodes are street intersections and shape points (lat/lng arrays); the edges
+out of node i are indices[indptr[i]:indptr[i + 1]] with lengths in metres in
+the same slice of weights. Every street is stored in both directions.
+
+The graph is imported once from an OpenStreetMap extract and saved as one
+.npy per array under RoutingConfig.GRAPH_DIR, which load() memory-maps, so
+worker processes share the pages. A route is the node path's coordinates as an
+encoded polyline plus its length, in the same shape as
+get_routes.parse_routes_result, so either can feed build_route_info.
+
+Usage:
+    python street_graph.py import extract.osm     # highways walkable per PEDESTRIAN_HIGHWAYS
+    python street_graph.py info
+    python street_graph.py route LAT LNG LAT LNG
+"""
+
+import heapq
+import json
+import math
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import polyline
+
+from constants import RoutingConfig
+
+ARRAYS = ("lats", "lngs", "indptr", "indices", "weights")
+CELL_SIZE = 0.002  # degrees per node-lookup bucket, ~200 m
+DEADLINE_EVERY = 256  # settled nodes between deadline checks
+M_PER_DEG = 111_000.0
+
+# OSM highway values a runner can use
+PEDESTRIAN_HIGHWAYS = {
+    "footway", "path", "pedestrian", "living_street", "residential", "service",
+    "steps", "track", "cycleway", "unclassified", "tertiary", "tertiary_link",
+    "secondary", "secondary_link", "primary", "primary_link", "corridor",
+}
+
+
+class StreetGraph:
+    def __init__(self, lats, lngs, indptr, indices, weights):
+        self.lats = lats
+        self.lngs = lngs
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights  # metres
+        self.n_nodes = len(lats)
+
+        # local planar metres for the A* heuristic and nearest-node search
+        self._cos = math.cos(math.radians(float(np.mean(lats)))) if self.n_nodes else 1.0
+        self._xs = np.asarray(lngs, dtype=np.float64) * M_PER_DEG * self._cos
+        self._ys = np.asarray(lats, dtype=np.float64) * M_PER_DEG
+
+        # nodes sorted by lookup bucket, like CrashIndex
+        self._lat0 = float(np.min(lats)) if self.n_nodes else 0.0
+        self._lng0 = float(np.min(lngs)) if self.n_nodes else 0.0
+        rows = self._rows(lats)
+        cols = self._cols(lngs)
+        self._n_cols = int(cols.max()) + 1 if self.n_nodes else 1
+        keys = rows * self._n_cols + cols
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    @classmethod
+    def from_edges(cls, lats, lngs, src, dst):
+        """Undirected graph from edge endpoint arrays; weights are haversine metres"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        both_src = np.concatenate([src, dst])
+        both_dst = np.concatenate([dst, src])
+
+        lat1, lat2 = np.radians(lats[both_src]), np.radians(lats[both_dst])
+        dlat = lat2 - lat1
+        dlng = np.radians(lngs[both_dst] - lngs[both_src])
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+        metres = 2 * 6_371_000 * np.arcsin(np.sqrt(a))
+
+        order = np.lexsort((both_dst, both_src))
+        indptr = np.zeros(len(lats) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(both_src, minlength=len(lats)), out=indptr[1:])
+        return cls(
+            lats, lngs, indptr,
+            both_dst[order].astype(np.int32), metres[order].astype(np.float32),
+        )
+
+    def _rows(self, lats):
+        return np.floor((np.asarray(lats) - self._lat0) / CELL_SIZE).astype(np.int64)
+
+    def _cols(self, lngs):
+        return np.floor((np.asarray(lngs) - self._lng0) / CELL_SIZE).astype(np.int64)
+
+    def nearest_node(self, lat, lng, max_km=RoutingConfig.SNAP_KM):
+        """(node, metres away) of the closest node within max_km, or (None, None)"""
+        row, col = int(self._rows(lat)), int(self._cols(lng))
+        reach = max(int(math.ceil(max_km * 1000 / (CELL_SIZE * M_PER_DEG * self._cos))), 1)
+        candidates = []
+        for r in range(row - reach, row + reach + 1):
+            if r < 0:
+                continue
+            lo = np.searchsorted(self._keys, r * self._n_cols + max(col - reach, 0))
+            hi = np.searchsorted(self._keys, r * self._n_cols + min(col + reach, self._n_cols - 1), side="right")
+            candidates.append(self._order[lo:hi])
+        candidates = np.concatenate(candidates) if candidates else np.empty(0, dtype=np.int64)
+        if not len(candidates):
+            return None, None
+
+        x = lng * M_PER_DEG * self._cos
+        y = lat * M_PER_DEG
+        metres = np.hypot(self._xs[candidates] - x, self._ys[candidates] - y)
+        best = int(np.argmin(metres))
+        if metres[best] > max_km * 1000:
+            return None, None
+        return int(candidates[best]), float(metres[best])
+
+    def search_tree(self, source, costs=None, targets=None, max_m=None, max_expansions=None,
+                    deadline=None):
+        """
+        Dijkstra from source on costs (per directed edge, default the lengths)
+
+        Stops once every node in targets is settled, past max_m metres of
+        walking, after max_expansions settled nodes or once time.perf_counter()
+        passes deadline. Returns (cost, metres, pred): dicts over the settled
+        nodes, pred mapping node -> previous node.
+        """
+        remaining = set(targets) if targets is not None else None
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        costs = weights if costs is None else costs
+        cost = {source: 0.0}
+        metres = {source: 0.0}
+        pred = {}
+        settled = {}
+        heap = [(0.0, source)]
+        while heap:
+            c, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            if max_m is not None and metres[node] > max_m:
+                continue  # too far to walk, but cheaper-cost nodes may still be in reach
+            settled[node] = c
+            if remaining is not None:
+                remaining.discard(node)
+                if not remaining:
+                    break
+            if max_expansions is not None and len(settled) >= max_expansions:
+                break
+            if deadline is not None and not len(settled) % DEADLINE_EVERY and time.perf_counter() > deadline:
+                break
+            m = metres[node]
+            for k in range(indptr[node], indptr[node + 1]):
+                nxt = int(indices[k])
+                nc = c + float(costs[k])
+                if nc < cost.get(nxt, math.inf):
+                    cost[nxt] = nc
+                    metres[nxt] = m + float(weights[k])
+                    pred[nxt] = node
+                    heapq.heappush(heap, (nc, nxt))
+        return settled, {node: metres[node] for node in settled}, pred
+
+    def shortest_paths(self, source, targets=None, max_m=None):
+        """Walking distances from source: (dist, pred) over the settled nodes"""
+        dist, _, pred = self.search_tree(source, targets=targets, max_m=max_m)
+        return dist, pred
+
+    def astar(self, source, target, costs=None, max_expansions=None, deadline=None):
+        """
+        (cost, node path) from source to target, or (None, None) if unreachable
+        or max_expansions or the deadline (a time.perf_counter() value) runs
+        out; costs must be at least the edge lengths to keep the straight-line
+        heuristic admissible
+        """
+        indptr, indices = self.indptr, self.indices
+        costs = self.weights if costs is None else costs
+        tx, ty = self._xs[target], self._ys[target]
+        xs, ys = self._xs, self._ys
+
+        def h(node):
+            return math.hypot(xs[node] - tx, ys[node] - ty)
+
+        dist = {source: 0.0}
+        pred = {}
+        settled = set()
+        heap = [(h(source), source)]
+        while heap:
+            _, node = heapq.heappop(heap)
+            if node == target:
+                return dist[node], self.path(pred, source, target)
+            if node in settled:
+                continue
+            settled.add(node)
+            if max_expansions is not None and len(settled) >= max_expansions:
+                break
+            if deadline is not None and not len(settled) % DEADLINE_EVERY and time.perf_counter() > deadline:
+                break
+            d = dist[node]
+            for k in range(indptr[node], indptr[node + 1]):
+                nxt = int(indices[k])
+                nd = d + float(costs[k])
+                if nd < dist.get(nxt, math.inf):
+                    dist[nxt] = nd
+                    pred[nxt] = node
+                    heapq.heappush(heap, (nd + h(nxt), nxt))
+        return None, None
+
+    def path_edges(self, nodes):
+        """Directed edge index for each step of a node path"""
+        edges = []
+        for u, v in zip(nodes, nodes[1:]):
+            lo, hi = self.indptr[u], self.indptr[u + 1]
+            edges.append(lo + int(np.flatnonzero(self.indices[lo:hi] == v)[0]))
+        return np.asarray(edges, dtype=np.int64)
+
+    @staticmethod
+    def path(pred, source, target):
+        nodes = [target]
+        while nodes[-1] != source:
+            nodes.append(pred[nodes[-1]])
+        return nodes[::-1]
+
+    def encode(self, nodes):
+        coords = np.column_stack([self.lats[nodes], self.lngs[nodes]])
+        return polyline.encode([tuple(c) for c in np.round(coords, 5)])
+
+    def route_result(self, metres, nodes, snap_m=0.0):
+        """parse_routes_result-shaped dict; snap_m adds the walk to and from the graph"""
+        km = (metres + snap_m) / 1000
+        return {
+            "distance_km": km,
+            "duration_minutes": km / RoutingConfig.WALK_SPEED_KMH * 60,
+            "polyline": self.encode(nodes),
+            "success": True,
+        }
+
+    def route(self, start_lat, start_lng, end_lat, end_lng):
+        """One walking route by A*, in the Google result shape"""
+        source, source_m = self.nearest_node(start_lat, start_lng)
+        target, target_m = self.nearest_node(end_lat, end_lng)
+        if source is None or target is None:
+            return {"error": "Point is off the street graph", "success": False}
+        metres, nodes = self.astar(source, target)
+        if metres is None:
+            return {"error": "No routes found", "success": False}
+        return self.route_result(metres, nodes, source_m + target_m)
+
+    def routes_from(self, start_lat, start_lng, points):
+        """Routes from one start to every (lat, lng) in points in a single Dijkstra"""
+        source, source_m = self.nearest_node(start_lat, start_lng)
+        if source is None:
+            return [{"error": "Point is off the street graph", "success": False} for _ in points]
+        snapped = [self.nearest_node(lat, lng) for lat, lng in points]
+        targets = {node for node, _ in snapped if node is not None}
+        dist, pred = self.shortest_paths(source, targets)
+
+        results = []
+        for node, target_m in snapped:
+            if node is None:
+                results.append({"error": "Point is off the street graph", "success": False})
+            elif node not in dist:
+                results.append({"error": "No routes found", "success": False})
+            else:
+                nodes = self.path(pred, source, node)
+                results.append(self.route_result(dist[node], nodes, source_m + target_m))
+        return results
+
+    def save(self, root=RoutingConfig.GRAPH_DIR):
+        os.makedirs(root, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(root, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(root, "meta.json"), "w") as f:
+            json.dump({"nodes": self.n_nodes, "edges": int(len(self.indices))}, f)
+
+    @classmethod
+    def load(cls, root=RoutingConfig.GRAPH_DIR, mmap=True):
+        mode = "r" if mmap else None
+        return cls(*(np.load(os.path.join(root, f"{name}.npy"), mmap_mode=mode) for name in ARRAYS))
+
+
+def import_osm(path, highways=PEDESTRIAN_HIGHWAYS):
+    """StreetGraph of the walkable ways in an OSM XML extract"""
+    coords = {}
+    ways = []
+    for _, elem in ET.iterparse(path):
+        if elem.tag == "node":
+            coords[elem.get("id")] = (float(elem.get("lat")), float(elem.get("lon")))
+        elif elem.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+            if tags.get("highway") in highways and tags.get("foot") != "no":
+                ways.append([nd.get("ref") for nd in elem.iter("nd")])
+        if elem.tag in ("node", "way", "relation"):
+            elem.clear()
+
+    ids = {}
+    src, dst = [], []
+    for refs in ways:
+        refs = [ref for ref in refs if ref in coords]
+        for a, b in zip(refs, refs[1:]):
+            src.append(ids.setdefault(a, len(ids)))
+            dst.append(ids.setdefault(b, len(ids)))
+
+    lats = np.empty(len(ids))
+    lngs = np.empty(len(ids))
+    for ref, i in ids.items():
+        lats[i], lngs[i] = coords[ref]
+    return StreetGraph.from_edges(lats, lngs, src, dst)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+
+    if command == "import":
+        started = time.perf_counter()
+        graph = import_osm(sys.argv[2])
+        graph.save()
+        print(f"Street graph imported: {graph.n_nodes} nodes, {len(graph.indices)} directed edges, "
+              f"{time.perf_counter() - started:.1f}s -> {RoutingConfig.GRAPH_DIR}")
+    elif command == "info":
+        graph = StreetGraph.load()
+        print(f"{graph.n_nodes} nodes, {len(graph.indices)} directed edges, "
+              f"{float(np.sum(graph.weights)) / 2000:.0f} km of street")
+    elif command == "route":
+        graph = StreetGraph.load()
+        started = time.perf_counter()
+        result = graph.route(*(float(v) for v in sys.argv[2:6]))
+        print({k: v for k, v in result.items() if k != "polyline"},
+              f"{(time.perf_counter() - started) * 1000:.1f} ms")
+    else:
+        print(__doc__)
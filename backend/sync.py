@@ -0,0 +1,232 @@
+"""
+Incremental crash sync against a stored high-water mark
+
+Each run asks Socrata only for records whose :updated_at is past the last
+watermark (new crashes and amendments to old ones), then upserts them through
+the backfill COPY path and advances the watermark in one transaction. A
+nightly run moves kilobytes instead of re-downloading the year.
+
+The download happens with no connection or lock held; only the staging COPY,
+merge and watermark write run under the advisory lock. Every worker runs the
+schedule, and the lock serializes the merges: a worker that finds the
+watermark moved while it was downloading leaves the merge to the one that
+moved it. The one that
+upserts rows rebuilds the derived data and publishes it (crash snapshot,
+baseline grid file, plus anything registered with on_refresh); the others
+find nothing new and only pick up what it published (crash_index.reload,
+baseline.reload, plus on_reload hooks). When nothing was upserted anywhere,
+nothing is rebuilt.
+
+Usage:
+    python sync.py            # one sync now
+    python sync.py --daemon   # sync every day at ScheduleConfig.DAILY_TIME
+"""
+
+import argparse
+import logging
+import threading
+import time
+
+import schedule
+
+import backfill
+import baseline
+import crash_index
+import db
+import telemetry
+from constants import APIConfig, CrashIndexConfig, ScheduleConfig
+
+log = logging.getLogger(__name__)
+
+SYNC_NAME = "nyc_crashes"
+LOCK_KEY = 728_340_011  # pg advisory lock shared by every process that syncs
+UPSERT = """DO UPDATE SET
+    crash_date = EXCLUDED.crash_date,
+    latitude = EXCLUDED.latitude,
+    longitude = EXCLUDED.longitude,
+    injuries = EXCLUDED.injuries,
+    fatalities = EXCLUDED.fatalities"""
+
+_refresh_hooks = []
+_reload_hooks = []
+
+
+def on_refresh(callback):
+    """Register a callable run in the process that synced new rows (rebuild and publish)"""
+    _refresh_hooks.append(callback)
+    return callback
+
+
+def on_reload(callback):
+    """Register a callable run in the other processes once they map the new data"""
+    _reload_hooks.append(callback)
+    return callback
+
+
+def ensure_state_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            name TEXT PRIMARY KEY,
+            watermark TEXT NOT NULL,
+            synced_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+
+
+def read_watermark(cursor):
+    """Last :updated_at seen, or the newest crash_date already loaded on first run"""
+    ensure_state_table(cursor)
+    cursor.execute("SELECT watermark FROM sync_state WHERE name = %s", (SYNC_NAME,))
+    row = cursor.fetchone()
+    if row:
+        return row[0], ":updated_at >"
+    cursor.execute("SELECT MAX(crash_date)::date FROM crashes")
+    latest = cursor.fetchone()[0]
+    return (str(latest) if latest else None), "crash_date >="
+
+
+def write_watermark(cursor, watermark):
+    cursor.execute(
+        """
+        INSERT INTO sync_state (name, watermark) VALUES (%s, %s)
+        ON CONFLICT (name) DO UPDATE SET watermark = EXCLUDED.watermark, synced_at = now()
+        """,
+        (SYNC_NAME, watermark),
+    )
+
+
+def track_watermark(rows, state):
+    """Pass rows through, remembering the largest :updated_at"""
+    for row in rows:
+        updated_at = (row.get(":updated_at") or "").rstrip("Z")
+        if updated_at > state.get("watermark", ""):
+            state["watermark"] = updated_at
+        yield row
+
+
+def download_updates(watermark, condition, stats, state, url=APIConfig.NYC_CRASHES_CSV_URL,
+                     page_size=int(APIConfig.REQUEST_LIMIT)):
+    """Cleaned rows past the watermark, all pages read before anything touches the database"""
+    where = "latitude IS NOT NULL AND longitude IS NOT NULL"
+    if watermark:
+        where += f" AND {condition} '{watermark}'"
+    raw_rows = backfill.fetch_crash_pages(
+        where, page_size=page_size, order=":id", select=(":updated_at",) + backfill.SOCRATA_FIELDS,
+        url=url,
+    )
+    return list(backfill.clean_crash_rows(track_watermark(raw_rows, state), stats))
+
+
+def run_sync(url=APIConfig.NYC_CRASHES_CSV_URL, page_size=int(APIConfig.REQUEST_LIMIT)):
+    """
+    One incremental sync; safe to call from several processes at once
+
+    The Socrata pages are downloaded first, holding neither a pooled connection
+    nor the lock. Then the merge and the watermark commit together under the
+    advisory lock, so a crash in between can neither skip rows nor import them
+    twice. If another process advanced the watermark during the download it has
+    merged these records already: nothing is merged here, and this process
+    follows what it published.
+    """
+    started = time.perf_counter()
+    stats, state = {}, {}
+
+    with db.get_connection() as conn:
+        watermark, condition = read_watermark(conn.cursor())
+    rows = download_updates(watermark, condition, stats, state, url=url, page_size=page_size)
+
+    upserted = 0
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (LOCK_KEY,))
+        current, _ = read_watermark(cursor)
+        if current != watermark:
+            log.info("Sync: watermark moved to %s during the download, leaving the merge to that run",
+                     current)
+        else:
+            if rows:
+                upserted, _ = backfill.load_crash_rows(rows, on_conflict=UPSERT, conn=conn)
+            if state.get("watermark"):
+                write_watermark(cursor, state["watermark"])
+        # leaving the block commits both and releases the lock
+
+    log.info(
+        "Sync: %d records past watermark %s, %d upserted in %.1fs",
+        stats.get("rows", 0), watermark, upserted, time.perf_counter() - started,
+    )
+    if upserted:
+        refresh()
+    else:
+        follow()
+    return upserted
+
+
+def run_hooks(hooks):
+    for hook in hooks:
+        try:
+            hook()
+        except Exception as e:
+            log.warning("Sync hook %s failed: %s", getattr(hook, "__name__", hook), e)
+
+
+def refresh():
+    """Rebuild and publish derived data after this process changed the crashes table"""
+    # amendments can change existing rows, so rebuild instead of folding in deltas
+    crash_index.rebuild_if_used()
+    baseline.rebuild(save=True)
+    run_hooks(_refresh_hooks)
+
+
+def follow():
+    """Map what another process published, if anything changed since this one loaded"""
+    mapped = crash_index.mapped_snapshot()
+    crash_index.reload_if_loaded()
+    if CrashIndexConfig.USE_SNAPSHOT and crash_index.mapped_snapshot() == mapped:
+        return False  # no new snapshot (or no index loaded here): nothing to pick up
+    baseline.reload()
+    run_hooks(_reload_hooks)
+    return True
+
+
+def run_sync_safely():
+    try:
+        run_sync()
+    except Exception:
+        log.exception("Scheduled crash sync failed")
+
+
+_scheduler_thread = None
+
+
+def start_scheduler(at=ScheduleConfig.DAILY_TIME.value, poll_seconds=30):
+    """Run the sync daily in a daemon thread of this process"""
+    global _scheduler_thread
+    if _scheduler_thread is not None:
+        return _scheduler_thread
+
+    scheduler = schedule.Scheduler()
+    scheduler.every().day.at(at).do(run_sync_safely)
+
+    def loop():
+        while True:
+            scheduler.run_pending()
+            time.sleep(poll_seconds)
+
+    _scheduler_thread = threading.Thread(target=loop, name="crash-sync", daemon=True)
+    _scheduler_thread.start()
+    log.info("Crash sync scheduled daily at %s", at)
+    return _scheduler_thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental NYC crash sync")
+    parser.add_argument("--daemon", action="store_true", help="keep running on the daily schedule")
+    args = parser.parse_args()
+    telemetry.configure_logging()
+
+    if args.daemon:
+        start_scheduler().join()
+    else:
+        run_sync()
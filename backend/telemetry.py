@@ -0,0 +1,252 @@
+"""
+Per-request stage timers, call counters and process-wide metrics
+
+Code on the request path marks its stages with `with telemetry.stage("geocode"):`
+or @telemetry.timed("decode"), and external calls with telemetry.count("db_query").
+Each HTTP request gets a Trace in a contextvar (see the middleware in main);
+stage times and counts land on that trace, for the Server-Timing header, and in
+process-wide histograms and counters that prometheus_text() renders for /metrics.
+
+Stage times are summed per stage, so stages that run concurrently (eight
+geocodes in flight) or nest (crash_query inside scoring) can add up to more
+than the request's wall time. Worker threads don't inherit contextvars: wrap
+callables handed to a thread pool with bind() so they report to the caller's
+trace.
+"""
+
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from constants import ScheduleConfig, TelemetryConfig
+
+enabled = TelemetryConfig.ENABLED
+
+
+class Trace:
+    """Stage timings and call counts for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> [calls, seconds]
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Server-Timing header value: one metric per stage plus the total"""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][1])
+        parts = [
+            f'{name};dur={seconds * 1000:.1f};desc="{calls}x"'
+            for name, (calls, seconds) in stages
+        ]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def counts_header(self):
+        with self._lock:
+            return ", ".join(f"{name}={n}" for name, n in sorted(self.counters.items()))
+
+    def summary(self):
+        with self._lock:
+            return {
+                "elapsed_ms": round(self.elapsed() * 1000, 1),
+                "stages": {
+                    name: {"calls": calls, "ms": round(seconds * 1000, 1)}
+                    for name, (calls, seconds) in self.stages.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+
+class Histogram:
+    def __init__(self, buckets=TelemetryConfig.BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Metrics:
+    """Process-wide stage/request histograms and call counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.requests = {}
+        self.counters = {}
+
+    def observe_stage(self, name, seconds):
+        with self._lock:
+            self.stages.setdefault(name, Histogram()).observe(seconds)
+
+    def observe_request(self, path, seconds):
+        with self._lock:
+            self.requests.setdefault(path, Histogram()).observe(seconds)
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _histogram_lines(self, metric, label, histograms):
+        lines = [f"# TYPE {metric} histogram"]
+        for value, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, n in zip(histogram.buckets, histogram.counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{metric}_sum{{{label}="{value}"}} {histogram.sum:.6f}')
+            lines.append(f'{metric}_count{{{label}="{value}"}} {histogram.count}')
+        return lines
+
+    def prometheus_text(self):
+        with self._lock:
+            lines = self._histogram_lines("runsafe_stage_seconds", "stage", self.stages)
+            lines += self._histogram_lines("runsafe_request_seconds", "path", self.requests)
+            lines.append("# TYPE runsafe_calls_total counter")
+            lines += [
+                f'runsafe_calls_total{{kind="{name}"}} {n}'
+                for name, n in sorted(self.counters.items())
+            ]
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {
+                    name: {"calls": h.count, "total_s": round(h.sum, 3)}
+                    for name, h in self.stages.items()
+                },
+                "requests": {
+                    path: {"calls": h.count, "total_s": round(h.sum, 3)}
+                    for path, h in self.requests.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+
+metrics = Metrics()
+_current = contextvars.ContextVar("runsafe_trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+def start_trace():
+    """Begin a request trace in this context; pass the token to end_trace"""
+    trace = Trace()
+    return trace, _current.set(trace)
+
+
+def end_trace(trace, token, path):
+    metrics.observe_request(path, trace.elapsed())
+    _current.reset(token)
+
+
+def record_stage(name, seconds):
+    if not enabled:
+        return
+    metrics.observe_stage(name, seconds)
+    trace = _current.get()
+    if trace is not None:
+        trace.add_stage(name, seconds)
+
+
+def count(name, n=1):
+    """Count an external call (db_query, google_routes, openai, ...)"""
+    if not enabled:
+        return
+    metrics.inc(name, n)
+    trace = _current.get()
+    if trace is not None:
+        trace.add_count(name, n)
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """Decorator form of stage(); works on plain and async functions"""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def bind(fn):
+    """
+    fn, run in the caller's context (its trace, point memo, ...) when called
+    from another thread; each call gets its own copy, so pool threads can run
+    it concurrently
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def set_enabled(value):
+    global enabled
+    enabled = bool(value)
+
+
+def configure_logging(level=None):
+    """Root logging at LOG_LEVEL (env) or ScheduleConfig.LOG_LEVEL; DEBUG shows per-endpoint detail"""
+    level = level or os.getenv("LOG_LEVEL", ScheduleConfig.LOG_LEVEL.value)
+    logging.basicConfig(
+        level=level.upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
@@ -0,0 +1,100 @@
+"""
+Shared fixtures: backend modules are imported flat, as the app runs them, and
+crash data comes from the seeded fakes the offline benchmarks use
+"""
+
+import json
+import math
+import os
+import sys
+
+import httpx
+import polyline
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_routes  # noqa: E402
+import cache  # noqa: E402
+import land_mask  # noqa: E402
+import utils  # noqa: E402
+from benchmarks import fakes  # noqa: E402
+from constants import CompassBearing, Direction  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def crashes():
+    return fakes.seeded_crashes(50_000, seed=7)
+
+
+@pytest.fixture
+def crash_data(crashes, tmp_path, monkeypatch):
+    """Seeded crashes served from the in-memory index; files land in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    return fakes.install_crash_index(crashes)
+
+
+class FakeRouter:
+    """
+    Geocoding + Routes stand-in with a controlled detour: each walking route is
+    walking(direction, straight one-way km) long, and geocodes in the `water`
+    directions come back as a river
+    """
+
+    def __init__(self, origin, walking=lambda direction, km: km * 1.3, water=()):
+        self.origin = origin
+        self.walking = walking
+        self.water = set(water)
+        self.calls = {"geocode": 0, "routes": 0}
+
+    def direction(self, lat, lng):
+        d_lat = lat - self.origin[0]
+        d_lng = (lng - self.origin[1]) * math.cos(math.radians(self.origin[0]))
+        bearing = round(math.degrees(math.atan2(d_lng, d_lat)) / 45) % 8 * 45
+        return Direction[CompassBearing(bearing).name]
+
+    def handle(self, request):
+        if request.url.host == "routes.googleapis.com":
+            self.calls["routes"] += 1
+            body = json.loads(request.content)
+            end = body["destination"]["location"]["latLng"]
+            lat, lng = end["latitude"], end["longitude"]
+            straight_km = utils.euc_distance(*self.origin, lat, lng)
+            metres = 1000 * self.walking(self.direction(lat, lng), straight_km)
+            return httpx.Response(200, json={"routes": [{
+                "distanceMeters": int(round(metres)),
+                "duration": f"{int(metres / 1.4)}s",
+                "polyline": {"encodedPolyline": polyline.encode([self.origin, (lat, lng)])},
+            }]})
+
+        self.calls["geocode"] += 1
+        lat, lng = (float(v) for v in request.url.params["latlng"].split(","))
+        if self.direction(lat, lng) in self.water:
+            address = "East River, New York, NY, USA"
+        else:
+            address = "1 Fake St, New York, NY 10001, USA"
+        return httpx.Response(200, json={"status": "OK", "results": [{"formatted_address": address}]})
+
+    @property
+    def total(self):
+        return self.calls["geocode"] + self.calls["routes"]
+
+
+@pytest.fixture
+def router(tmp_path, monkeypatch):
+    """
+    Factory for a FakeRouter that new engines (get_engine included) send
+    Google calls to; caches are bypassed and no land mask is built
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GOOGLE_ROUTES_API_KEY", "offline")
+    monkeypatch.setattr(cache, "bypass", True)
+    monkeypatch.setattr(land_mask, "_mask", None)
+    monkeypatch.setattr(async_routes, "_engine", None)
+
+    def make(origin, **kwargs):
+        fake = FakeRouter(origin, **kwargs)
+        monkeypatch.setattr(async_routes, "transport", httpx.MockTransport(fake.handle))
+        return fake
+
+    return make
@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import pytest
+
+import ai_agents
+from benchmarks import fakes
+from constants import LLMConfig
+
+
+def route(route_id, **overrides):
+    return {
+        "id": route_id,
+        "direction": "Northeast",
+        "polyline": "a~l~Fjk~uOwHJy@P",
+        "endpoint": {"lat": 40.7412345, "lng": -73.9812345},
+        "accuracy": 96.4321,
+        "distance": {"target_distance": 5.0, "total_distance": 5.1789},
+        "safety_analysis": {
+            "overall_safety_score": 72.5,
+            "dangerous_segments": [{
+                "point_index": 3,
+                "route_progress": 45.0,
+                "coordinates": {"lat": 40.7401, "lng": -73.9823},
+                "counts": {"total_crashes": 4, "total_injuries": 2, "total_fatalities": 0},
+                "safety_score": 61.2345,
+            }],
+            "corridor": {"safety_score": 72.5, "crashes_per_km": 3.41, "densest_segments": []},
+        },
+        **overrides,
+    }
+
+
+def metadata(*routes):
+    return {
+        "start_location": {"lat": 40.7306123, "lng": -73.9866456},
+        "target_distance_km": 5.0,
+        "route_options": list(routes),
+    }
+
+
+def test_build_prompt_keeps_only_the_compact_schema():
+    prompt = json.loads(ai_agents.build_prompt(metadata(route(1))))
+    assert prompt == {
+        "start": [40.7306, -73.9866],
+        "target_km": 5.0,
+        "routes": [{
+            "id": 1,
+            "dir": "Northeast",
+            "km": 5.18,
+            "accuracy": 96.4,
+            "safety": 72.5,
+            "dangerous": [
+                {"at_pct": 45.0, "score": 61.2, "crashes": 4, "injuries": 2, "deaths": 0},
+            ],
+            "crashes_per_km": 3.41,
+        }],
+    }
+    # every key the model sees is explained in the system prompt
+    for key in ("start", "target_km", "dir", "km", "accuracy", "safety", "crashes_per_km",
+                "dangerous", "at_pct", "score", "crashes", "injuries", "deaths"):
+        assert f'"{key}"' in ai_agents.SYSTEM_PROMPT
+
+
+def test_build_prompt_ignores_what_the_model_doesnt_see():
+    moved = route(1, polyline="_p~iF~ps|U", endpoint={"lat": 40.75, "lng": -73.97})
+    assert ai_agents.build_prompt(metadata(route(1))) == ai_agents.build_prompt(metadata(moved))
+    assert ai_agents.build_prompt(metadata(route(1))) != ai_agents.build_prompt(
+        metadata(route(1, accuracy=80.0))
+    )
+
+
+def test_build_prompt_without_routes_or_corridor():
+    assert json.loads(ai_agents.build_prompt({}))["routes"] == []
+    bare = route(2)
+    del bare["safety_analysis"]["corridor"]
+    assert "crashes_per_km" not in json.loads(ai_agents.build_prompt(metadata(bare)))["routes"][0]
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "offline")
+    agent = ai_agents.SafetyAnalysisAgent()
+    agent.client = fakes.llm_client(latency_ms=0)
+    agent.async_client = fakes.async_llm_client(latency_ms=0)
+    return agent
+
+
+def test_identical_prompts_are_answered_from_the_cache(agent):
+    first = agent.make_call_to_llm(metadata(route(1)))
+    # a different polyline makes the same prompt, so the same cache key
+    again = agent.make_call_to_llm(metadata(route(1, polyline="_p~iF~ps|U")))
+    assert again is first
+    stats = agent.stats()
+    assert (stats["calls"], stats["cache_hits"]) == (1, 1)
+    assert stats["prompt_tokens"] == first.usage.prompt_tokens
+    assert stats["last_call"]["cached"] is True
+
+    agent.make_call_to_llm(metadata(route(1, accuracy=80.0)))
+    assert agent.stats()["calls"] == 2
+
+
+def test_sync_and_async_calls_share_the_cache(agent):
+    first = asyncio.run(agent.make_call_to_llm_async(metadata(route(1))))
+    assert agent.make_call_to_llm(metadata(route(1))) is first
+    assert asyncio.run(agent.make_call_to_llm_async(metadata(route(1)))) is first
+    assert (agent.stats()["calls"], agent.stats()["cache_hits"]) == (1, 2)
+
+
+def test_cache_key_covers_the_request_settings(agent, monkeypatch):
+    agent.make_call_to_llm(metadata(route(1)))
+    monkeypatch.setattr(LLMConfig, "TEMPERATURE", 0.9)
+    agent.make_call_to_llm(metadata(route(1)))
+    assert agent.stats()["calls"] == 2
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import async_routes
+from constants import Direction, SearchConfig
+
+ORIGIN = (40.7306, -73.9866)
+
+
+def search(target_km=5.0, budget=None):
+    async def run():
+        stats = {}
+        async with async_routes.RouteEngine() as engine:
+            routes = await engine.adaptive_route_finder(*ORIGIN, target_km, budget=budget, stats=stats)
+        return routes, stats
+
+    return asyncio.run(run())
+
+
+def test_stops_after_the_first_round_when_the_ratio_is_typical(router):
+    # the first round assumes walking is 0.5 / OPTIMAL_MULTIPLIER times the straight line
+    fake = router(ORIGIN, walking=lambda direction, km: km * 1.25)
+    routes, stats = search()
+    wave = SearchConfig.MIN_ROUTES + SearchConfig.HEDGE
+    assert stats["rounds"] == 1
+    assert stats["endpoints"] == wave
+    assert fake.total == stats["calls"] == 2 * wave
+    assert len(routes) == wave
+    assert all(route["accuracy"] >= SearchConfig.GOAL_ACCURACY for route in routes)
+
+
+@pytest.mark.parametrize("walking", [
+    lambda direction, km: km * 2.0,
+    lambda direction, km: km * 1.05,
+    lambda direction, km: km * 1.2 + 0.8,
+    lambda direction, km: km * (2.6 if direction in (Direction.NORTH, Direction.EAST) else 1.4),
+], ids=["twisty", "direct", "affine", "per-direction"])
+def test_refinement_converges_within_the_budget(router, walking):
+    fake = router(ORIGIN, walking=walking)
+    routes, stats = search()
+    good = [route for route in routes if route["accuracy"] >= SearchConfig.GOAL_ACCURACY]
+    assert len(good) >= SearchConfig.MIN_ROUTES
+    assert fake.total == stats["calls"] <= SearchConfig.CALL_BUDGET
+    # accuracy only ever improves within a direction: the best attempt is kept
+    assert routes == sorted(routes, key=lambda route: route["accuracy"], reverse=True)
+
+
+@pytest.mark.parametrize("budget", [1, 2, 3, 5, 8, 24])
+def test_call_budget_is_never_exceeded(router, budget):
+    fake = router(ORIGIN, walking=lambda direction, km: km * 3.0 + 0.5, water=[Direction.NORTH])
+    _, stats = search(budget=budget)
+    assert fake.total == stats["calls"] <= budget
+    assert stats["budget"] == budget
+
+
+def test_water_directions_are_dropped_after_one_geocode(router):
+    water = [Direction.NORTH, Direction.EAST, Direction.SOUTH]
+    fake = router(ORIGIN, walking=lambda direction, km: km * 1.25, water=water)
+    routes, stats = search()
+    assert not {route["direction"] for route in routes} & set(water)
+    assert len(routes) >= SearchConfig.MIN_ROUTES
+    # filtered endpoints cost a geocode but no Routes call
+    assert fake.calls["routes"] == fake.calls["geocode"] - len(water)
+
+
+def test_next_distance_starts_from_the_search_wide_ratio():
+    assert async_routes.DirectionSearch(Direction.NORTH).next_distance(2.5, 1.25) == pytest.approx(2.0)
+
+
+def test_next_distance_rescales_by_its_own_ratio():
+    direction = async_routes.DirectionSearch(Direction.NORTH)
+    direction.attempts.append((2.0, 3.0))
+    assert direction.next_distance(2.5, 1.25) == pytest.approx(2.0 * 2.5 / 3.0)
+
+
+def test_next_distance_step_is_clamped():
+    direction = async_routes.DirectionSearch(Direction.NORTH)
+    direction.attempts.append((2.0, 40.0))
+    assert direction.next_distance(2.5, 1.25) == pytest.approx(2.0 * (1 - SearchConfig.MAX_STEP))
+    direction.attempts[-1] = (2.0, 0.5)
+    assert direction.next_distance(2.5, 1.25) == pytest.approx(2.0 * (1 + SearchConfig.MAX_STEP))
+
+
+def test_next_distance_bisects_when_the_secant_leaves_the_bracket():
+    direction = async_routes.DirectionSearch(Direction.NORTH)
+    # short at 1.0 km, long at 1.9 and 2.0 km; the flat secant through the last two lands at 0
+    direction.attempts += [(1.0, 2.4), (2.0, 2.6), (1.9, 2.595)]
+    assert direction.next_distance(2.5, 1.25) == pytest.approx((1.0 + 1.9) / 2)
+
+
+def test_next_distance_keeps_a_secant_inside_the_bracket():
+    direction = async_routes.DirectionSearch(Direction.NORTH)
+    direction.attempts += [(1.0, 2.0), (1.5, 2.6)]
+    assert direction.next_distance(2.5, 1.25) == pytest.approx(1.5 + (2.5 - 2.6) * 0.5 / 0.6)
@@ -0,0 +1,52 @@
+import csv
+import io
+from itertools import islice
+
+import pytest
+
+import backfill
+from benchmarks import fakes
+
+
+@pytest.fixture(scope="module")
+def socrata_rows(crashes):
+    rows = list(islice(fakes.crash_rows(crashes), 500))
+    rows[10]["latitude"] = ""
+    rows[20]["longitude"] = "0"
+    del rows[30]["collision_id"]
+    rows[40]["number_of_persons_injured"] = ""  # missing counts load as 0
+    return rows
+
+
+def insert_params(crash):
+    """The values the row-at-a-time INSERT bound for one Socrata row"""
+    return (
+        int(crash["collision_id"]),
+        crash["crash_date"][:10],
+        float(crash["latitude"]),
+        float(crash["longitude"]),
+        int(crash.get("number_of_persons_injured") or 0),
+        int(crash.get("number_of_persons_killed") or 0),
+    )
+
+
+def test_clean_rows_match_insert_params(socrata_rows):
+    stats = {}
+    cleaned = list(backfill.clean_crash_rows(socrata_rows, stats))
+    valid = [row for i, row in enumerate(socrata_rows) if i not in (10, 20, 30)]
+    assert cleaned == [insert_params(row) for row in valid]
+    assert stats == {"rows": 500, "skipped": 3}
+
+
+@pytest.mark.parametrize("size", [1, 7, 8192, -1])
+def test_row_stream_copy_text_round_trips(socrata_rows, size):
+    cleaned = list(backfill.clean_crash_rows(socrata_rows))
+    stream = backfill.RowStream(iter(cleaned))
+    chunks = iter(lambda: stream.read(size), "")
+    text = "".join(chunks) if size > 0 else stream.read(size)
+    assert stream.read(size) == ""
+
+    copied = list(csv.reader(io.StringIO(text), delimiter="\t"))
+    assert len(copied) == len(cleaned)
+    for values, row in zip(copied, cleaned):
+        assert [type(value)(text) for value, text in zip(row, values)] == list(row)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import baseline
+import utils
+from constants import BaselineGrid
+
+
+def brute_force_percentiles(index, lat, lng, radius_km, days_back=None):
+    """The SQL loop's 25 inclusive boxes, over the raw columns"""
+    keep = np.ones(len(index), dtype=bool)
+    if days_back is not None:
+        keep = index.dates >= np.datetime64(utils.window_start(days_back), "D")
+    lats, lngs = index.lats[keep], index.lngs[keep]
+    injuries, fatalities = index.injuries[keep], index.fatalities[keep]
+    sums = []
+    for lat_offset in baseline.OFFSETS * BaselineGrid.SAMPLE_SPACING:
+        for lng_offset in baseline.OFFSETS * BaselineGrid.SAMPLE_SPACING:
+            sample_lat, sample_lng = lat + lat_offset, lng + lng_offset
+            lat_buffer = radius_km / 111.0
+            lng_buffer = radius_km / (111.0 * np.cos(np.radians(sample_lat)))
+            inside = (
+                (lats >= sample_lat - lat_buffer) & (lats <= sample_lat + lat_buffer)
+                & (lngs >= sample_lng - lng_buffer) & (lngs <= sample_lng + lng_buffer)
+            )
+            sums.append((inside.sum(), injuries[inside].sum(), fatalities[inside].sum()))
+    return {
+        attr: sorted(row[k] for row in sums)[len(sums) // 2]
+        for k, attr in enumerate(baseline.ATTRS)
+    }
+
+
+@pytest.mark.parametrize("days_back", [None, 60])
+def test_exact_percentiles_match_brute_force(crash_data, days_back):
+    rng = np.random.default_rng(1)
+    for i in rng.choice(len(crash_data), size=20, replace=False):
+        lat, lng = float(crash_data.lats[i]), float(crash_data.lngs[i])
+        assert baseline.exact_percentiles(lat, lng, 0.5, days_back) == brute_force_percentiles(
+            crash_data, lat, lng, 0.5, days_back
+        )
+
+
+# (radius, window) -> bounds for crashes/injuries: mean and p95 relative error, max absolute
+DOCUMENTED = {
+    (0.5, None): (0.05, 0.20, 15),
+    (1.0, None): (0.03, 0.10, 25),
+    (0.5, 60): (0.08, 0.30, 6),
+}
+
+
+@pytest.mark.parametrize("radius_km, days_back", list(DOCUMENTED))
+def test_grid_within_documented_error(crash_data, radius_km, days_back):
+    mean, p95, max_abs = DOCUMENTED[radius_km, days_back]
+    error = baseline.accuracy(200, radius_km, days_back)
+    for attr in ("crashes", "injuries"):
+        assert error[attr]["mean"] <= mean, (attr, error[attr])
+        assert error[attr]["p95"] <= p95, (attr, error[attr])
+        assert error[attr]["max_abs"] <= max_abs, (attr, error[attr])
+    assert error["fatalities"]["max_abs"] <= 1
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_ttl_cache_expires_entries(clock):
+    memory = cache.TTLCache(maxsize=10, ttl=60)
+    memory.set("a", 1)
+    memory.set("b", 2, ttl=120)
+    memory.set("c", 3, ttl=0)  # no expiry
+    clock[0] += 59
+    assert memory.get("a") == 1
+    clock[0] += 1
+    assert memory.get("a") is None
+    assert memory.get("b") == 2
+    clock[0] += 61
+    assert memory.get("b") is None
+    assert len(memory) == 1  # expired entries are dropped when looked up
+    assert memory.stats()["hits"] == 2
+    assert memory.stats()["misses"] == 2
+
+
+def test_ttl_cache_without_ttl_keeps_entries(clock):
+    memory = cache.TTLCache(maxsize=10)
+    memory.set("a", 1)
+    clock[0] += 10**9
+    assert memory.get("a") == 1
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    memory = cache.TTLCache(maxsize=2, ttl=60)
+    memory.set("a", 1)
+    memory.set("b", 2)
+    memory.get("a")
+    memory.set("c", 3)
+    assert memory.get("b") is None
+    assert memory.get("a") == 1
+    assert memory.get("c") == 3
+    assert memory.evictions == 1
+
+
+def test_two_tier_cache_falls_back_to_store(tmp_path):
+    store = cache.SqliteStore(path=str(tmp_path / "cache.sqlite3"))
+    first = cache.TwoTierCache("test", ttl=60, store=store)
+    first.set(("key", 1.0), {"value": 1})
+
+    second = cache.TwoTierCache("test", ttl=60, store=store)
+    assert second.get(("key", 1.0)) == {"value": 1}
+    assert second.store_hits == 1
+    assert second.get(("key", 1.0)) == {"value": 1}
+    assert second.store_hits == 1  # promoted into memory
+
+
+def test_single_flight_shares_one_call():
+    flight = cache.SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == [1] * 5
+    assert calls == [1]
+    assert flight.stats() == {"in_flight": 0, "calls": 1, "shared": 4}
+
+
+def test_single_flight_survives_a_cancelled_caller():
+    flight = cache.SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("key", compute))
+        second = asyncio.ensure_future(flight.do("key", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+    assert calls == [1]
+
+
+def test_single_flight_releases_key_after_failure():
+    flight = cache.SingleFlight()
+    attempts = []
+
+    async def compute():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("boom")
+        return "ok"
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await flight.do("key", compute)
+        return await flight.do("key", compute)
+
+    assert asyncio.run(main()) == "ok"
+    assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+import polyline
+import pytest
+
+import corridor
+import polyline_safety_analysis as p
+import utils
+from benchmarks import fakes
+from constants import CorridorConfig
+
+
+@pytest.fixture
+def route():
+    encoded, _ = fakes.street_polyline(*fakes.HOTSPOTS[1], *fakes.HOTSPOTS[2])
+    coords = p.decode_polyline_array(encoded)
+    return coords[:, 0], coords[:, 1]
+
+
+def segment_distance(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    t = 0.0 if length_sq == 0 else min(max(((px - ax) * dx + (py - ay) * dy) / length_sq, 0.0), 1.0)
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def brute_force_segments(index, lats, lngs, buffer_km, days_back):
+    """Every crash against every segment, one pair at a time"""
+    lat0, lng0 = float(np.mean(lats)), float(np.mean(lngs))
+    vx, vy = corridor.project(lats, lngs, lat0, lng0)
+    keep = index.dates >= np.datetime64(utils.window_start(days_back), "D")
+    px, py = corridor.project(index.lats[keep], index.lngs[keep], lat0, lng0)
+    counts = np.zeros(len(lats) - 1, dtype=np.int64)
+    for x, y in zip(px, py):
+        if abs(y) > 10 or abs(x) > 10:
+            continue  # nowhere near this route
+        distances = [
+            segment_distance(x, y, vx[k], vy[k], vx[k + 1], vy[k + 1]) for k in range(len(vx) - 1)
+        ]
+        nearest = int(np.argmin(distances))
+        if distances[nearest] <= buffer_km:
+            counts[nearest] += 1
+    return counts
+
+
+@pytest.mark.parametrize("block_size", [7, 2048])
+def test_segments_match_brute_force(crash_data, route, block_size):
+    lats, lngs = route
+    scored = corridor.score_corridor(lats, lngs, buffer_km=0.05, days_back=60, block_size=block_size)
+    expected = brute_force_segments(crash_data, lats, lngs, 0.05, 60)
+    np.testing.assert_array_equal(scored["crashes"], expected)
+    assert scored["total_crashes"] == expected.sum()
+
+
+def test_windows_cover_the_route(crash_data, route):
+    lats, lngs = route
+    scored = corridor.score_corridor(lats, lngs, buffer_km=0.05, days_back=None, window_km=0.15)
+    windows = scored["windows"]
+    assert windows["start_km"][0] == 0.0
+    assert windows["length_km"] * len(windows["start_km"]) == pytest.approx(scored["total_length_km"])
+    assert windows["length_km"] == pytest.approx(0.15, rel=0.5)
+    assert windows["crashes"].sum() == scored["total_crashes"]
+    assert windows["injuries"].sum() == scored["total_injuries"]
+    assert windows["fatalities"].sum() == scored["total_fatalities"]
+
+
+def test_window_scores_pick_the_dangerous_windows(crash_data, route):
+    lats, lngs = route
+    every = corridor.corridor_safety(lats, lngs, dangerous_below=101)["dangerous_windows"]
+    dangerous = corridor.corridor_safety(lats, lngs)["dangerous_windows"]
+    assert [w["window_index"] for w in every] == list(range(len(every)))
+    assert dangerous == [w for w in every if w["safety_score"] < 80]
+    assert dangerous, "the hotspot route should cross at least one dangerous window"
+
+
+@pytest.fixture
+def scored_route(route):
+    lats, lngs = route
+    return {"id": 1, "polyline": polyline.encode(list(zip(lats, lngs)))}
+
+
+def test_route_safety_comes_from_the_corridor(crash_data, scored_route, monkeypatch):
+    def no_circles(lats, lngs):
+        raise AssertionError("sample circles scored with the corridor enabled")
+
+    monkeypatch.setattr(p, "score_sample_points", no_circles)
+    analysis = p.analyze_route_safety_detailed(scored_route)["safety_analysis"]
+    summary = analysis["corridor"]
+    assert analysis["overall_safety_score"] == summary["safety_score"]
+    assert [seg["point_index"] for seg in analysis["dangerous_segments"]] == [
+        w["window_index"] for w in summary["dangerous_windows"]
+    ]
+    for seg, window in zip(analysis["dangerous_segments"], summary["dangerous_windows"]):
+        assert seg["safety_score"] == window["safety_score"] < p.DANGEROUS_SCORE
+        assert seg["counts"]["total_crashes"] == window["crashes"]
+        assert seg["coordinates"] == window["start"]
+        assert 0 <= seg["route_progress"] <= 100
+
+
+def test_circles_are_the_fallback_when_the_corridor_fails(crash_data, scored_route, monkeypatch):
+    monkeypatch.setattr(CorridorConfig, "ENABLED", False)
+    circles = p.analyze_route_safety_detailed(scored_route)
+    assert "corridor" not in circles["safety_analysis"]
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("no baseline")
+
+    monkeypatch.setattr(CorridorConfig, "ENABLED", True)
+    monkeypatch.setattr(corridor, "corridor_safety", broken)
+    assert p.analyze_route_safety_detailed(scored_route) == circles
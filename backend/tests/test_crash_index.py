@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import crash_index
+import utils
+from benchmarks import fakes
+
+
+@pytest.fixture(scope="module")
+def index(crashes):
+    return crash_index.CrashIndex(
+        crashes["lats"], crashes["lngs"], crashes["dates"],
+        crashes["injuries"], crashes["fatalities"], crashes["collision_ids"],
+    )
+
+
+def brute_force_radius(index, lat, lng, radius_km, days_back=None):
+    distances = np.array([
+        utils.euc_distance(lat, lng, crash_lat, crash_lng)
+        for crash_lat, crash_lng in zip(index.lats, index.lngs)
+    ])
+    keep = distances <= radius_km
+    if days_back is not None:
+        keep &= index.dates >= np.datetime64(utils.window_start(days_back), "D")
+    return np.flatnonzero(keep), distances[keep]
+
+
+def assert_radius_matches(index, radius_km, days_back=None):
+    for lat, lng in fakes.seeded_origins(5):
+        idx, distances = index.query_radius(lat, lng, radius_km, days_back=days_back)
+        expected_idx, expected_distances = brute_force_radius(index, lat, lng, radius_km, days_back)
+        order = np.argsort(idx)
+        np.testing.assert_array_equal(idx[order], expected_idx)
+        np.testing.assert_allclose(distances[order], expected_distances, rtol=1e-12)
+
+
+@pytest.mark.parametrize("radius_km", [0.2, 0.5, 1.0])
+def test_query_radius_matches_brute_force(index, radius_km):
+    assert_radius_matches(index, radius_km)
+
+
+@pytest.mark.parametrize("radius_km, days_back", [(0.5, 60), (2.0, 7), (0.5, 0)])
+def test_query_radius_honours_days_back(index, radius_km, days_back):
+    assert_radius_matches(index, radius_km, days_back)
+
+
+def test_query_radius_outside_the_data_is_empty(index):
+    idx, distances = index.query_radius(41.5, -72.0, 0.5)
+    assert len(idx) == 0 and len(distances) == 0
+
+
+def test_query_box_matches_brute_force(index):
+    lat_lo, lat_hi, lng_lo, lng_hi = 40.70, 40.72, -74.01, -73.98
+    inside = (
+        (index.lats >= lat_lo) & (index.lats <= lat_hi)
+        & (index.lngs >= lng_lo) & (index.lngs <= lng_hi)
+    )
+    np.testing.assert_array_equal(
+        np.sort(index.query_box(lat_lo, lat_hi, lng_lo, lng_hi)), np.flatnonzero(inside)
+    )
+
+
+def test_snapshot_round_trip(index, tmp_path):
+    index.save_snapshot(tmp_path / "snapshot")
+    mapped = crash_index.CrashIndex.load_snapshot(tmp_path / "snapshot")
+    lat, lng = fakes.HOTSPOTS[3]
+    assert mapped.aggregate(lat, lng, 0.5, days_back=60) == index.aggregate(lat, lng, 0.5, days_back=60)
+    assert mapped.records(*mapped.query_radius(lat, lng, 0.3)) == index.records(*index.query_radius(lat, lng, 0.3))
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import db
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, vars=None):
+        self.conn.pings += 1
+        time.sleep(self.conn.ping_delay)
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+
+
+class FakeConnection:
+    """Just enough of a psycopg2 connection for the pool"""
+
+    def __init__(self, ping_delay=0.0):
+        self.closed = 0
+        self.broken = False
+        self.pings = 0
+        self.ping_delay = ping_delay
+        self.rollbacks = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+
+    def connect(**kwargs):
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    monkeypatch.setattr(db.psycopg2, "connect", connect)
+    return opened
+
+
+def test_pool_reuses_connections(connections):
+    pool = db.ConnectionPool(min_size=2, max_size=4)
+    pool.warm()
+    assert len(connections) == 2
+    for _ in range(10):
+        with pool.connection():
+            pass
+    assert len(connections) == 2
+    assert pool.stats()["in_use"] == 0
+
+
+def test_pool_is_bounded_and_times_out(connections):
+    pool = db.ConnectionPool(min_size=0, max_size=2, timeout=0.05)
+    held = [pool.getconn(), pool.getconn()]
+    with pytest.raises(db.PoolTimeout):
+        pool.getconn()
+    pool.putconn(held.pop())
+    assert pool.getconn() in connections
+    assert len(connections) == 2
+
+
+def test_waiting_checkout_gets_a_returned_connection(connections):
+    pool = db.ConnectionPool(min_size=0, max_size=1, timeout=2)
+    conn = pool.getconn()
+    threading.Timer(0.05, pool.putconn, (conn,)).start()
+    assert pool.getconn() is conn
+
+
+def test_pool_rolls_back_open_transactions_on_return(connections):
+    pool = db.ConnectionPool(min_size=0, max_size=1)
+    conn = pool.getconn()
+    conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+    assert pool.getconn() is conn
+
+
+def test_pool_replaces_broken_connections(connections):
+    pool = db.ConnectionPool(min_size=0, max_size=2, max_idle=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.broken = True
+    replacement = pool.getconn()
+    assert replacement is not conn and conn.closed
+    assert pool.stats()["discarded"] == 1
+    assert pool.stats()["in_use"] == 1
+
+    pool.putconn(replacement, discard=True)
+    assert replacement.closed
+    assert pool.stats()["in_use"] == 0
+
+
+def test_rollback_on_error_returns_connection(connections):
+    pool = db.ConnectionPool(min_size=0, max_size=1)
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            raise RuntimeError("query failed")
+    assert conn.rollbacks == 1
+    assert pool.stats()["created"] == 1
+    assert pool.stats()["idle"] == 1
+
+
+def test_slow_ping_does_not_block_other_checkouts(connections):
+    pool = db.ConnectionPool(min_size=0, max_size=2, max_idle=0)
+    stale = pool.getconn()
+    fresh = pool.getconn()
+    pool.putconn(fresh)
+    pool.putconn(stale)  # popped first, and pinged since max_idle is 0
+    stale.ping_delay = 0.5
+
+    pinging = threading.Thread(target=pool.getconn)
+    pinging.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    assert pool.getconn() is fresh
+    assert time.monotonic() - started < 0.25
+    pinging.join()
+
+
+def test_closed_pool_refuses_checkouts(connections):
+    pool = db.ConnectionPool(min_size=1, max_size=1)
+    pool.warm()
+    pool.close()
+    assert connections[0].closed
+    with pytest.raises(db.PoolTimeout):
+        pool.getconn()
@@ -0,0 +1,185 @@
+import json
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import get_routes
+import land_mask
+from constants import BaselineGrid, LandMaskConfig
+
+
+@pytest.fixture(scope="module")
+def mask():
+    rng = np.random.default_rng(5)
+    data = land_mask.dilate(rng.random((200, 260)) < 0.002, 3).astype(np.uint8)
+    return land_mask.LandMask(data, 0.0005, 40.70, -74.02)
+
+
+@pytest.fixture(scope="module")
+def points(mask):
+    rng = np.random.default_rng(6)
+    # a margin past every edge so some points fall off the raster
+    lats = rng.uniform(mask.lat_min - 0.005, mask.lat_min + mask.n_lat * mask.resolution + 0.005, 3000)
+    lngs = rng.uniform(mask.lng_min - 0.005, mask.lng_min + mask.n_lng * mask.resolution + 0.005, 3000)
+    return lats, lngs
+
+
+def cell_is_land(mask, lat, lng):
+    row = math.floor((lat - mask.lat_min) / mask.resolution)
+    col = math.floor((lng - mask.lng_min) / mask.resolution)
+    return 0 <= row < mask.n_lat and 0 <= col < mask.n_lng and bool(mask.data[row, col])
+
+
+def nearest_land(mask, lat, lng, max_km):
+    """Centre of the closest land cell within max_km, scanning the whole raster"""
+    rows, cols = np.nonzero(mask.data)
+    centre_lats = mask.lat_min + (rows + 0.5) * mask.resolution
+    centre_lngs = mask.lng_min + (cols + 0.5) * mask.resolution
+    km = np.hypot((centre_lats - lat) * 111.0, (centre_lngs - lng) * 111.0 * np.cos(np.radians(lat)))
+    best = int(np.argmin(km))
+    if km[best] > max_km:
+        return None
+    return centre_lats[best], centre_lngs[best]
+
+
+def test_is_land_matches_per_point_lookup(mask, points):
+    lats, lngs = points
+    expected = [cell_is_land(mask, lat, lng) for lat, lng in zip(lats, lngs)]
+    np.testing.assert_array_equal(mask.is_land(lats, lngs), expected)
+
+
+def test_snap_matches_nearest_land_cell(mask, points):
+    lats, lngs = points
+    snapped_lats, snapped_lngs, ok = mask.snap(lats, lngs, max_km=0.3)
+    land = mask.is_land(lats, lngs)
+    inside = mask.cell_index(lats, lngs)[2]
+    for i in range(len(lats)):
+        if land[i]:
+            assert ok[i] and (snapped_lats[i], snapped_lngs[i]) == (lats[i], lngs[i])
+        elif not inside[i]:
+            assert not ok[i]
+        else:
+            expected = nearest_land(mask, lats[i], lngs[i], 0.3)
+            assert ok[i] == (expected is not None)
+            if expected is not None:
+                assert (snapped_lats[i], snapped_lngs[i]) == pytest.approx(expected)
+                assert mask.is_land([snapped_lats[i]], [snapped_lngs[i]])[0]
+
+
+def point_in_rings(lng, lat, rings):
+    """Even-odd ray cast, one edge at a time"""
+    inside = False
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+            if (y0 <= lat) != (y1 <= lat) and lng < x0 + (lat - y0) * (x1 - x0) / (y1 - y0):
+                inside = not inside
+    return inside
+
+
+def test_rasterize_matches_point_in_polygon():
+    resolution = 0.01
+    shape = land_mask.grid_shape(resolution)
+    # offset so no cell centre lies exactly on an edge
+    lng0, lat0 = BaselineGrid.LNG_MIN + 0.00123, BaselineGrid.LAT_MIN + 0.00217
+    outer = [(lng0 + 0.05, lat0 + 0.05), (lng0 + 0.40, lat0 + 0.08), (lng0 + 0.33, lat0 + 0.37),
+             (lng0 + 0.12, lat0 + 0.30), (lng0 + 0.05, lat0 + 0.05)]
+    hole = [(lng0 + 0.15, lat0 + 0.12), (lng0 + 0.25, lat0 + 0.12), (lng0 + 0.20, lat0 + 0.22),
+            (lng0 + 0.15, lat0 + 0.12)]
+    geojson = {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [outer, hole]}}
+
+    raster = land_mask.rasterize(geojson, shape, resolution)
+    centre_lats = BaselineGrid.LAT_MIN + (np.arange(shape[0]) + 0.5) * resolution
+    centre_lngs = BaselineGrid.LNG_MIN + (np.arange(shape[1]) + 0.5) * resolution
+    expected = [
+        [point_in_rings(lng, lat, [outer, hole]) for lng in centre_lngs] for lat in centre_lats
+    ]
+    np.testing.assert_array_equal(raster, expected)
+    assert raster.any()
+
+
+def test_saved_mask_maps_back_unchanged(mask, tmp_path):
+    mask.save(tmp_path / "land.bin")
+    mapped = land_mask.LandMask.load(tmp_path / "land.bin")
+    np.testing.assert_array_equal(mapped.data, mask.data)
+    assert mapped.header() == mask.header()
+
+
+@pytest.fixture
+def installed(mask, tmp_path, monkeypatch):
+    """Save a mask with the given sources where get_mask() looks for it"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(land_mask, "_mask", None)
+
+    def install(sources):
+        land_mask.LandMask(mask.data, mask.resolution, mask.lat_min, mask.lng_min, sources).save()
+        return land_mask.reload()
+
+    return install
+
+
+def test_get_mask_skips_a_crash_only_mask(installed):
+    assert installed([land_mask.CRASH_SOURCE]) is None
+    assert installed(["boroughs.geojson", land_mask.CRASH_SOURCE]).from_polygons
+
+
+def test_build_rasterizes_the_polygon_file_by_default(tmp_path, monkeypatch):
+    ring = [(-74.0, 40.7), (-73.9, 40.7), (-73.9, 40.8), (-74.0, 40.7)]
+    path = tmp_path / "land.geojson"
+    path.write_text(json.dumps({"type": "Polygon", "coordinates": [ring]}))
+    monkeypatch.setattr(LandMaskConfig, "GEOJSON", str(path))
+
+    built = land_mask.build(resolution=0.01)
+    assert built.sources == [str(path)] and built.from_polygons
+    assert built.is_land([40.72], [-73.91])[0] and not built.is_land([40.79], [-73.99])[0]
+
+
+@pytest.fixture
+def geocoded(installed, monkeypatch):
+    """Polygon mask installed, reverse geocoding answered from a table of addresses"""
+    installed(["boroughs.geojson"])
+    geocoder = SimpleNamespace(addresses={}, calls=[])
+
+    def reverse_geocode(lat, lng):
+        geocoder.calls.append((lat, lng))
+        address = geocoder.addresses.get((round(lat, 4), round(lng, 4)), "1 Fake St, New York, NY")
+        return {"status": "OK", "results": [{"formatted_address": address}]}
+
+    monkeypatch.setattr(get_routes, "reverse_geocode", reverse_geocode)
+    return geocoder
+
+
+def endpoints_at(mask, count):
+    rows, cols = np.nonzero(mask.data)
+    return [
+        {
+            "direction": f"d{i}",
+            "lat": mask.lat_min + (rows[i * 97] + 0.5) * mask.resolution,
+            "lng": mask.lng_min + (cols[i * 97] + 0.5) * mask.resolution,
+        }
+        for i in range(count)
+    ]
+
+
+def test_filter_endpoints_keeps_the_address_exclusions(mask, geocoded):
+    endpoints = endpoints_at(mask, 4)
+    geocoded.addresses[(round(endpoints[1]["lat"], 4), round(endpoints[1]["lng"], 4))] = (
+        "31st St, Astoria, NY 11105"
+    )
+    kept = get_routes.filter_endpoints(40.75, -73.95, endpoints)
+    assert [endpoint["direction"] for endpoint in kept] == ["d0", "d2", "d3"]
+    assert all(endpoint["address"].startswith("1 Fake St") for endpoint in kept)
+    assert len(geocoded.calls) == 4
+
+
+def test_filter_endpoints_can_trust_the_mask_alone(mask, geocoded, monkeypatch):
+    monkeypatch.setattr(LandMaskConfig, "CHECK_ADDRESSES", False)
+    kept = get_routes.filter_endpoints(40.75, -73.95, endpoints_at(mask, 4))
+    assert len(kept) == 4 and not geocoded.calls
+
+
+def test_filter_endpoints_geocodes_without_a_polygon_mask(mask, installed, geocoded):
+    installed([land_mask.CRASH_SOURCE])
+    kept = get_routes.filter_endpoints(40.75, -73.95, endpoints_at(mask, 3))
+    assert len(kept) == 3 and len(geocoded.calls) == 3
@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+import pytest
+
+import loops
+import polyline_safety_analysis as p
+from benchmarks import fakes
+from constants import LoopConfig
+
+START = (40.73, -73.98)
+
+
+@pytest.fixture(scope="module")
+def graph():
+    return fakes.street_grid(lat_min=40.70, lat_max=40.76, lng_min=-74.02, lng_max=-73.94)
+
+
+@pytest.fixture
+def with_risk(graph, monkeypatch):
+    """Serve searches from the given per-edge risks (flat by default)"""
+    monkeypatch.setattr(loops, "_costs", None)
+
+    def serve(risk=None):
+        if risk is None:
+            risk = np.zeros(len(graph.indices), dtype=np.float32)
+        return loops.set_risk(graph, risk)
+
+    return serve
+
+
+@pytest.fixture
+def tried(graph, monkeypatch):
+    """(A, B) waypoint nodes of every pair closed with A*"""
+    pairs = []
+    astar = graph.astar
+
+    def spy(a, b, *args, **kwargs):
+        pairs.append((a, b))
+        return astar(a, b, *args, **kwargs)
+
+    monkeypatch.setattr(graph, "astar", spy)
+    return pairs
+
+
+def sector(graph, node):
+    source, _ = graph.nearest_node(*START)
+    lat0, lng0 = float(graph.lats[source]), float(graph.lngs[source])
+    dy = (float(graph.lats[node]) - lat0) * 111.0
+    dx = (float(graph.lngs[node]) - lng0) * 111.0 * math.cos(math.radians(lat0))
+    return int((math.degrees(math.atan2(dx, dy)) % 360) // (360 / LoopConfig.SECTORS))
+
+
+def search(graph, target_km=4.0, count=3):
+    return loops.generate_loops(graph, *START, target_km, count=count, time_budget=10)
+
+
+def test_loops_are_closed_accurate_and_from_distinct_sectors(graph, with_risk, tried):
+    with_risk()
+    routes, stats = search(graph)
+    assert stats["stopped"] == "done" and len(routes) == 3
+    for route in routes:
+        coords = p.decode_polyline_array(route["polyline"])
+        assert tuple(coords[0]) == pytest.approx(tuple(coords[-1]))
+        assert route["accuracy"] >= LoopConfig.MIN_ACCURACY
+        assert route["shape"] == "loop" and route["direction"].endswith(" loop")
+        assert route["distance"]["total_distance"] == pytest.approx(4.0, rel=0.1)
+    assert len({sector(graph, node) for node, _ in tried}) > 1
+
+    # pairs are 30-120 degrees apart, and no sector serves two returned loops
+    for a, b in tried:
+        gap = (sector(graph, b) - sector(graph, a)) % LoopConfig.SECTORS
+        assert LoopConfig.SECTORS / 12 <= gap <= LoopConfig.SECTORS / 3
+    endpoints = [graph.nearest_node(r["endpoint"]["lat"], r["endpoint"]["lng"])[0] for r in routes]
+    used = [sector(graph, node) for node in endpoints]
+    assert len(set(used)) == len(used)
+    assert stats["pairs_tried"] == len(tried) <= stats["pairs"]
+
+
+def test_safer_streets_come_first(graph, with_risk):
+    # every street east of the start is risky
+    sources = np.repeat(np.arange(graph.n_nodes), np.diff(graph.indptr))
+    mid_lngs = (np.asarray(graph.lngs)[sources] + np.asarray(graph.lngs)[graph.indices]) / 2
+    with_risk(np.where(mid_lngs > START[1], LoopConfig.RISK_CAP, 0.0).astype(np.float32))
+    routes, _ = search(graph)
+    assert [route["risk"] for route in routes] == sorted(route["risk"] for route in routes)
+    # there are enough quiet western sectors that no returned loop crosses east
+    assert routes and all(route["risk"] == 0 for route in routes)
+
+
+def test_inaccurate_loops_are_dropped(graph, with_risk, monkeypatch, tried):
+    with_risk()
+    monkeypatch.setattr(LoopConfig, "MIN_ACCURACY", 99.999)
+    routes, stats = search(graph)
+    assert tried and stats["loops_found"] == len(routes) == 0
+
+
+def test_overlapping_stems_are_dropped(graph, with_risk, monkeypatch):
+    with_risk()
+    _, loose = search(graph)
+    monkeypatch.setattr(LoopConfig, "MAX_OVERLAP", 0.0)
+    routes, strict = search(graph)
+    assert strict["loops_found"] < loose["loops_found"]
+    for route in routes:
+        # no stem: the loop leaves the start by a different street than it returns on
+        coords = [tuple(c) for c in p.decode_polyline_array(route["polyline"])]
+        assert coords[1] != coords[-2]
+
+
+def test_stops_without_risks(graph, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # no saved risk.npy under RoutingConfig.GRAPH_DIR
+    monkeypatch.setattr(loops, "_costs", None)
+    routes, stats = search(graph)
+    assert routes == [] and stats["stopped"] == "no_risk"
+
+
+def test_stops_off_the_graph(graph, with_risk):
+    with_risk()
+    routes, stats = loops.generate_loops(graph, 40.90, -73.70, 4.0)
+    assert routes == [] and stats["stopped"] == "off_graph"
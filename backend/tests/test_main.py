@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import async_routes
+import cache
+import main
+from constants import SearchConfig
+
+ORIGIN = (40.7306, -73.9866)
+
+
+@pytest.fixture
+def generate(router, monkeypatch):
+    """Run concurrent generate requests against a FakeRouter; the scoring and LLM step is recorded"""
+    monkeypatch.setattr(main, "route_results", cache.TTLCache(maxsize=16, ttl=60))
+    monkeypatch.setattr(main, "route_flights", cache.SingleFlight())
+    fake = router(ORIGIN, walking=lambda direction, km: km * 1.25)
+    recommended = []
+
+    def recommend_routes(start_lat, start_lng, target_distance_km, routes):
+        recommended.append((start_lat, start_lng, target_distance_km))
+        return {
+            "start_location": {"lat": start_lat, "lng": start_lng},
+            "target_distance_km": target_distance_km,
+            "distances": [route["distance"]["target_distance"] for route in routes],
+        }
+
+    monkeypatch.setattr(main, "recommend_routes", recommend_routes)
+
+    def run(*requests):
+        async def requests_at_once():
+            try:
+                return await asyncio.gather(*(main.generate_running_routes(*r) for r in requests))
+            finally:
+                await async_routes.close_engine()
+
+        return asyncio.run(requests_at_once())
+
+    run.router = fake
+    run.recommended = recommended
+    return run
+
+
+def test_concurrent_identical_requests_share_one_computation(generate):
+    results = generate(*[(*ORIGIN, 5.0)] * 5)
+    assert generate.recommended == [(*ORIGIN, 5.0)]
+    assert all(result == results[0] for result in results)
+    assert main.route_flights.stats() == {"in_flight": 0, "calls": 1, "shared": 4}
+
+    # one search's worth of Google calls (one round of geocode + routes), not five
+    assert generate.router.total == 2 * (SearchConfig.MIN_ROUTES + SearchConfig.HEDGE)
+
+    # a later repeat is answered from route_results
+    generate((*ORIGIN, 5.0))
+    assert len(generate.recommended) == 1
+    assert generate.router.total == 2 * (SearchConfig.MIN_ROUTES + SearchConfig.HEDGE)
+
+
+def test_shared_computation_uses_the_first_callers_exact_inputs(generate):
+    leader = (ORIGIN[0] + 0.00002, ORIGIN[1] - 0.00001, 5.03)
+    follower = (ORIGIN[0], ORIGIN[1], 4.98)
+    assert main.generation_key(*leader) == main.generation_key(*follower)
+
+    results = generate(leader, follower)
+    assert generate.recommended == [leader]
+    assert results[0]["target_distance_km"] == 5.03
+    assert set(results[0]["distances"]) == {5.03}
+    assert results[1] == results[0]
+
+
+def test_different_keys_compute_separately(generate):
+    generate((*ORIGIN, 5.0), (*ORIGIN, 8.0))
+    assert sorted(generate.recommended) == [(*ORIGIN, 5.0), (*ORIGIN, 8.0)]
@@ -0,0 +1,125 @@
+import numpy as np
+import polyline
+import pytest
+
+import point_memo
+import polyline_safety_analysis as p
+from benchmarks import fakes
+from benchmarks.polyline_decode import synthetic_polyline
+from constants import CorridorConfig, ParallelConfig, PointMemoConfig
+
+
+@pytest.fixture
+def routes():
+    return [
+        {"polyline": fakes.street_polyline(lat, lng, lat + 0.01, lng + 0.012)[0], "distance_km": 1.5}
+        for lat, lng in fakes.seeded_origins(6)
+    ]
+
+
+@pytest.mark.parametrize("n_points", [1, 2, 11, 500])
+def test_decode_polyline_array_matches_polyline_decode(n_points):
+    encoded = synthetic_polyline(n_points, seed=n_points)
+    np.testing.assert_allclose(p.decode_polyline_array(encoded), polyline.decode(encoded), atol=1e-9)
+
+
+def test_decode_polyline_array_handles_large_deltas():
+    coords = [(40.7, -74.0), (-33.9, 151.2), (0.0, 0.0), (89.99999, -179.99999)]
+    encoded = polyline.encode(coords)
+    np.testing.assert_allclose(p.decode_polyline_array(encoded), polyline.decode(encoded), atol=1e-9)
+
+
+def test_decode_polyline_array_rejects_bad_input():
+    encoded = synthetic_polyline(20)
+    with pytest.raises(ValueError):
+        p.decode_polyline_array(encoded[:-1])
+    with pytest.raises(ValueError):
+        p.decode_polyline_array(encoded + " ")
+    assert p.decode_polyline_array("").shape == (0, 2)
+    assert p.decode_route_array("???").shape == (0, 2)
+
+
+@pytest.mark.parametrize("n_points", [3, 5, 6, 21, 26, 137])
+def test_sample_route_array_matches_sample_route_points(n_points):
+    encoded = synthetic_polyline(n_points)
+    expected = p.sample_route_points(p.decode_route_polyline(encoded), max_samples=5)
+    if len(expected) > 1 and expected[-2].get("route_index") == n_points - 1:
+        # the dict path repeats the last point when the step lands on it; the array path doesn't
+        del expected[-2]
+    sampled = p.sample_route_array(p.decode_route_array(encoded), max_samples=5)
+    assert len(sampled) == len(expected)
+    for point, want in zip(sampled, expected):
+        assert point.keys() == want.keys()
+        assert point["lat"] == pytest.approx(want["lat"], abs=1e-9)
+        assert point["lng"] == pytest.approx(want["lng"], abs=1e-9)
+        assert point.get("route_index") == want.get("route_index")
+        assert point.get("route_progress") == want.get("route_progress")
+
+
+@pytest.mark.parametrize("days_back", [60, None])
+def test_crashes_near_points_match_near_me(crash_data, days_back):
+    lats, lngs = zip(*fakes.seeded_origins(30))
+    batch = p.get_crashes_near_points(list(lats), list(lngs), radius_km=0.5, days_back=days_back)
+    for lat, lng, response in zip(lats, lngs, batch):
+        assert response == p.get_crashes_near_me(lat, lng, radius_km=0.5, days_back=days_back)
+
+
+def test_near_me_totals_match_brute_force(crash_data):
+    lat, lng = fakes.HOTSPOTS[0]
+    within = np.array([
+        p.utils.euc_distance(lat, lng, crash_lat, crash_lng) <= 0.5
+        for crash_lat, crash_lng in zip(crash_data.lats, crash_data.lngs)
+    ])
+    summary = p.get_crashes_near_me(lat, lng, radius_km=0.5, days_back=None)["summary"]
+    assert summary == {
+        "total_crashes": int(within.sum()),
+        "total_injuries": int(crash_data.injuries[within].sum()),
+        "total_fatalities": int(crash_data.fatalities[within].sum()),
+    }
+
+
+@pytest.mark.parametrize("use_corridor", [True, False], ids=["corridor", "circles"])
+def test_parallel_scoring_matches_serial(crash_data, routes, monkeypatch, use_corridor):
+    monkeypatch.setattr(CorridorConfig, "ENABLED", use_corridor)
+    serial = [p.analyze_route_safety_detailed(route) for route in routes]
+    assert p.analyze_routes_parallel(routes) == serial
+    assert p.analyze_routes_parallel(routes, workers=4) == serial
+    assert p.analyze_routes_parallel(routes, workers=1) == serial
+
+
+def test_a_typical_request_fans_out_per_route():
+    # 8 routes x 6 samples, the usual generate request
+    sample_points = [[{}] * 6 for _ in range(8)]
+    assert p.route_chunks(sample_points, workers=8) == [range(i, i + 1) for i in range(8)]
+    chunks = p.route_chunks(sample_points, workers=3)
+    assert len(chunks) == 3 and [i for chunk in chunks for i in chunk] == list(range(8))
+
+
+def test_small_requests_stay_one_lookup():
+    assert p.route_chunks([[{}] * 6], workers=8) == [range(1)]
+    assert p.route_chunks([[{}] * 5] * 3, workers=8) == [range(3)]
+    assert len(p.route_chunks([[{}] * 4] * ParallelConfig.MIN_BATCH, workers=8)) == 8
+
+
+def test_point_memo_does_not_change_scores(crash_data, routes, monkeypatch):
+    # the memo caches sample-point lookups, which only the circles path makes
+    monkeypatch.setattr(CorridorConfig, "ENABLED", False)
+    monkeypatch.setattr(PointMemoConfig, "ENABLED", False)
+    unmemoized = p.analyze_routes_parallel(routes)
+
+    monkeypatch.setattr(PointMemoConfig, "ENABLED", True)
+    monkeypatch.setattr(PointMemoConfig, "SHARED", True)
+    point_memo.clear()
+    memo, token = point_memo.start()
+    try:
+        assert p.analyze_routes_parallel(routes) == unmemoized
+        # the second pass is answered entirely from the memo
+        misses = memo.misses
+        assert p.analyze_routes_parallel(routes) == unmemoized
+        assert memo.misses == misses
+    finally:
+        point_memo.end(token)
+
+    # a new request still gets the same answers from the shared LRU
+    assert p.analyze_routes_parallel(routes) == unmemoized
+    point_memo.clear()
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import polyline_safety_analysis as p
+import safety_tiles
+from benchmarks import fakes
+
+
+@pytest.fixture
+def tiles(crash_data):
+    # coarse tiles keep the build quick; lookups are resolution independent
+    return safety_tiles.build(resolution=0.02, radii=(0.5, 1.0), days_back=60)
+
+
+def exact_score(index, lat, lng, radius_km, days_back):
+    totals = index.aggregate(lat, lng, radius_km, days_back=days_back).values()
+    return p.score_crash_totals(lat, lng, radius_km, *totals, days_back=days_back)
+
+
+@pytest.mark.parametrize("radius_km", [0.5, 1.0])
+def test_tile_centres_match_exact_scores(crash_data, tiles, radius_km):
+    centre_lats, centre_lngs = tiles.centres()
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, tiles.n_lat, 40)
+    cols = rng.integers(0, tiles.n_lng, 40)
+    for lat, lng in zip(centre_lats[rows], centre_lngs[cols]):
+        lat, lng = float(lat), float(lng)
+        layers = tiles.lookup(lat, lng, radius_km)
+        totals = crash_data.aggregate(lat, lng, radius_km, days_back=60)
+        assert (layers["crashes"], layers["injuries"], layers["fatalities"]) == tuple(totals.values())
+        expected = exact_score(crash_data, lat, lng, radius_km, 60)
+        assert layers["score"] == pytest.approx(expected, abs=1e-4)
+        assert tiles.score(lat, lng, radius_km) == pytest.approx(expected, abs=1e-4)
+
+
+def test_point_responses_match_lookup_at_centres(crash_data, tiles, monkeypatch):
+    monkeypatch.setattr(safety_tiles, "_tiles", tiles)
+    centre_lats, centre_lngs = tiles.centres()
+    lats = [float(lat) for lat in centre_lats[5:10]]
+    lngs = [float(lng) for lng in centre_lngs[10:15]]
+    from_tiles = safety_tiles.point_responses(lats, lngs, 0.5, 60)
+    exact = p.lookup_crashes_near_points(lats, lngs, 0.5, 60)
+    for tiled, response in zip(from_tiles, exact):
+        assert tiled["summary"] == response["summary"]
+        assert tiled["safety"] == pytest.approx(response["safety"], abs=1e-4)
+
+    assert safety_tiles.point_responses(lats, lngs, 0.5, 30) is None
+    assert safety_tiles.point_responses([41.5], [-72.0], 0.5, 60) is None
+
+
+def test_point_responses_score_their_own_totals(crash_data, tiles, monkeypatch):
+    monkeypatch.setattr(safety_tiles, "_tiles", tiles)
+    rng = np.random.default_rng(4)
+    lats = rng.uniform(40.60, 40.85, 25).tolist()
+    lngs = rng.uniform(-74.05, -73.80, 25).tolist()
+    centre_lats, centre_lngs = tiles.centres()
+    rows, cols, _ = tiles.tile_index(lats, lngs)
+    for tiled, row, col in zip(safety_tiles.point_responses(lats, lngs, 0.5, 60), rows, cols):
+        # off-centre points get the containing tile's totals and the score of exactly those
+        centre = float(centre_lats[row]), float(centre_lngs[col])
+        summary = tiled["summary"]
+        assert tiled["safety"] == pytest.approx(p.score_crash_totals(
+            *centre, 0.5, summary["total_crashes"], summary["total_injuries"],
+            summary["total_fatalities"], days_back=60,
+        ), abs=1e-4)
+
+
+def test_polyline_scores_match_point_scores(tiles):
+    coords = p.decode_polyline_array(fakes.street_polyline(*fakes.HOTSPOTS[0], *fakes.HOTSPOTS[1])[0])
+    scored = tiles.polyline_scores(coords, 0.5)
+    expected = [tiles.score(lat, lng, 0.5) for lat, lng in coords]
+    np.testing.assert_allclose(scored["scores"], expected)
+    assert scored["min"] == round(min(expected), 1)
+
+
+def test_saved_tiles_map_back_unchanged(tiles, tmp_path):
+    tiles.save(tmp_path / "tiles.bin")
+    mapped = safety_tiles.SafetyTiles.load(tmp_path / "tiles.bin")
+    np.testing.assert_array_equal(mapped.data, tiles.data)
+    assert mapped.header() == tiles.header()
@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import httpx
+import openai
+import pytest
+from fastapi.testclient import TestClient
+
+import async_routes
+import main
+from ai_agents import SafetyAnalysisAgent
+from benchmarks import fakes
+from constants import Direction
+
+ORIGIN = (40.7306, -73.9866)
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "offline")
+    agent = SafetyAnalysisAgent()
+    agent.client = fakes.llm_client(latency_ms=0)
+    agent.async_client = fakes.async_llm_client(latency_ms=0)
+    monkeypatch.setattr(main, "safety_ai", agent)
+    return agent
+
+
+def stream(target_km=5.0):
+    """The response body exactly as StreamingResponse would send it"""
+    async def run():
+        try:
+            return "".join([chunk async for chunk in main.stream_route_events(*ORIGIN, target_km)])
+        finally:
+            await async_routes.close_engine()
+
+    return asyncio.run(run())
+
+
+def events(body):
+    assert body.endswith("\n")
+    lines = body[:-1].split("\n")
+    # one JSON object per line, nothing else on it
+    return [json.loads(line) for line in lines]
+
+
+def test_events_arrive_in_order(crash_data, router, agent):
+    router(ORIGIN, walking=lambda direction, km: km * 1.25)
+    sent = events(stream())
+    names = [event["event"] for event in sent]
+
+    assert names[0] == "start" and names[-1] == "done"
+    routes_at = names.index("routes")
+    assert set(names[1:routes_at]) == {"candidate"}
+    route_ids = sent[routes_at]["route_ids"]
+    safety = sent[routes_at + 1:routes_at + 1 + len(route_ids)]
+    assert [event["event"] for event in safety] == ["safety"] * len(route_ids)
+    assert sorted(event["route"]["id"] for event in safety) == sorted(route_ids)
+    assert all("safety_analysis" in event["route"] for event in safety)
+    assert names[routes_at + 1 + len(route_ids):] == ["recommendation", "done"]
+
+    assert sent[0]["start_location"] == {"lat": ORIGIN[0], "lng": ORIGIN[1]}
+    # every selected route was streamed as a candidate first
+    assert set(route_ids) <= {event["route"]["id"] for event in sent[1:routes_at]}
+    assert sent[routes_at]["search"]["calls"] > 0
+    assert sent[-2]["content"] == fakes.RECOMMENDATION
+
+
+def test_no_routes_ends_with_an_error_line(crash_data, router, agent):
+    router(ORIGIN, water=list(Direction))
+    sent = events(stream())
+    assert [event["event"] for event in sent] == ["start", "error"]
+    assert sent[-1] == {"event": "error", "stage": "routes", "detail": "No routes found"}
+
+
+def test_recommendation_failure_still_finishes(crash_data, router, agent):
+    router(ORIGIN, walking=lambda direction, km: km * 1.25)
+    agent.async_client = openai.AsyncOpenAI(
+        api_key="offline", max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(500, json={"error": {"message": "down"}})
+        )),
+    )
+    names = [event["event"] for event in events(stream())]
+    assert names[-2:] == ["error", "done"]
+    assert "recommendation" not in names and "safety" in names
+
+
+def test_endpoint_streams_ndjson(crash_data, router, agent):
+    router(ORIGIN, walking=lambda direction, km: km * 1.25)
+    response = TestClient(main.app).get(
+        "/api/routes/stream", params={"start_lat": ORIGIN[0], "start_lng": ORIGIN[1]}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["cache-control"] == "no-cache"
+    sent = events(response.text)
+    assert [sent[0]["event"], sent[-1]["event"]] == ["start", "done"]
+    assert sent[0]["target_distance_km"] == 5.0
@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+import polyline
+import pytest
+
+from benchmarks import fakes
+from street_graph import M_PER_DEG
+
+
+@pytest.fixture(scope="module")
+def graph():
+    return fakes.street_grid(lat_min=40.70, lat_max=40.74, lng_min=-74.01, lng_max=-73.97)
+
+
+@pytest.fixture(scope="module")
+def pairs(graph):
+    rng = np.random.default_rng(1)
+    return rng.integers(0, graph.n_nodes, (12, 2))
+
+
+def test_nearest_node_matches_brute_force(graph):
+    rng = np.random.default_rng(2)
+    for lat, lng in zip(rng.uniform(40.70, 40.74, 50), rng.uniform(-74.01, -73.97, 50)):
+        node, metres = graph.nearest_node(lat, lng)
+        brute = np.hypot(graph._xs - lng * M_PER_DEG * graph._cos, graph._ys - lat * M_PER_DEG)
+        assert metres == pytest.approx(brute.min())
+        assert brute[node] == pytest.approx(brute.min())
+
+
+def test_astar_matches_dijkstra(graph, pairs):
+    for source, target in pairs:
+        dist, _ = graph.shortest_paths(int(source), targets={int(target)})
+        metres, nodes = graph.astar(int(source), int(target))
+        if int(target) not in dist:
+            assert metres is None
+            continue
+        assert metres == pytest.approx(dist[int(target)])
+        assert nodes[0] == source and nodes[-1] == target
+        assert graph.weights[graph.path_edges(nodes)].sum() == pytest.approx(metres)
+
+
+def test_astar_matches_dijkstra_on_weighted_costs(graph, pairs):
+    costs = graph.weights * np.random.default_rng(3).uniform(1.0, 3.0, len(graph.weights))
+    for source, target in pairs:
+        cost, _, _ = graph.search_tree(int(source), costs=costs, targets={int(target)})
+        found, nodes = graph.astar(int(source), int(target), costs=costs)
+        if int(target) in cost:
+            assert found == pytest.approx(cost[int(target)])
+            assert costs[graph.path_edges(nodes)].sum() == pytest.approx(found)
+
+
+def test_routes_from_matches_route(graph):
+    start = (40.7150, -73.9950)
+    points = [(40.7300, -73.9800), (40.7050, -74.0050), (40.7380, -73.9720), (41.0, -73.0)]
+    batch = graph.routes_from(*start, points)
+    for point, result in zip(points, batch):
+        single = graph.route(*start, *point)
+        assert result["success"] == single["success"]
+        if single["success"]:
+            assert result["distance_km"] == pytest.approx(single["distance_km"])
+            decoded = polyline.decode(result["polyline"])
+            assert decoded[0] == pytest.approx(polyline.decode(single["polyline"])[0])
+            assert decoded[-1] == pytest.approx(polyline.decode(single["polyline"])[-1])
+
+
+def test_searches_stop_at_the_deadline(graph):
+    far = graph.n_nodes - 1
+    assert graph.astar(0, far, deadline=time.perf_counter() - 1) == (None, None)
+    settled, _, _ = graph.search_tree(0, deadline=time.perf_counter() - 1)
+    assert len(settled) < graph.n_nodes
+    assert len(graph.search_tree(0)[0]) > len(settled)
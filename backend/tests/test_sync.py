@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+from itertools import islice
+
+import pytest
+
+import backfill
+import db
+import sync
+from benchmarks import fakes
+
+
+class FakeDatabase:
+    """
+    The statements sync issues itself (state table, watermark, advisory lock);
+    the COPY and merge are backfill.load_crash_rows, replaced by load() below.
+    Writes only land on commit, like the pooled connection's context manager.
+    """
+
+    def __init__(self, watermark=None, latest_crash_date=None):
+        self.watermark = watermark
+        self.latest_crash_date = latest_crash_date
+        self.merged = []
+        self.open = 0
+        self.locked = False
+        self.fail_merge = False
+        self.on_row = None  # called during the download, to change things under it
+        self.refreshed = self.followed = 0
+
+    @contextmanager
+    def connection(self):
+        conn = FakeConnection(self)
+        self.open += 1
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            self.open -= 1
+            self.locked = False  # pg_advisory_xact_lock ends with the transaction
+
+    def load(self, rows, on_conflict="DO NOTHING", returning=False, conn=None):
+        assert self.locked and conn is not None, "merge outside the locked transaction"
+        if self.fail_merge:
+            raise RuntimeError("merge failed")
+        conn.pending_rows = list(rows)
+        return len(conn.pending_rows), None
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+        self.pending_rows = []
+        self.pending_watermark = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.database.merged += self.pending_rows
+        if self.pending_watermark is not None:
+            self.database.watermark = self.pending_watermark
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def execute(self, query, params=None):
+        database = self.conn.database
+        if "pg_advisory_xact_lock" in query:
+            database.locked = True
+        elif "SELECT watermark FROM sync_state" in query:
+            self.result = [(database.watermark,)] if database.watermark else []
+        elif "MAX(crash_date)" in query:
+            self.result = [(database.latest_crash_date,)]
+        elif "INSERT INTO sync_state" in query:
+            self.conn.pending_watermark = params[1]
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+
+def updated_rows(crashes, n):
+    rows = list(islice(fakes.crash_rows(crashes), n))
+    for i, row in enumerate(rows):
+        row[":updated_at"] = f"2026-10-{1 + i % 9:02d}T12:{i % 60:02d}:00.000Z"
+    rows[3]["latitude"] = ""  # skipped by clean_crash_rows
+    return rows
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase(latest_crash_date="2026-09-30")
+    monkeypatch.setattr(db, "get_connection", database.connection)
+    monkeypatch.setattr(backfill, "load_crash_rows", database.load)
+
+    fetch = backfill.fetch_crash_pages
+
+    def fetch_without_holding_the_database(*args, **kwargs):
+        for row in fetch(*args, **kwargs):
+            assert database.open == 0 and not database.locked
+            if database.on_row is not None:
+                database.on_row()
+            yield row
+
+    monkeypatch.setattr(backfill, "fetch_crash_pages", fetch_without_holding_the_database)
+
+    def refresh():
+        database.refreshed += 1
+
+    def follow():
+        database.followed += 1
+
+    monkeypatch.setattr(sync, "refresh", refresh)
+    monkeypatch.setattr(sync, "follow", follow)
+    return database
+
+
+def run(server, page_size=10):
+    return sync.run_sync(url=server.url, page_size=page_size)
+
+
+def test_first_sync_pages_from_the_newest_crash_date(crashes, database):
+    rows = updated_rows(crashes, 25)
+    with fakes.SocrataServer(rows, page_latency_ms=0) as server:
+        assert run(server) == 24
+
+    assert [int(r["$offset"]) for r in server.requests] == [0, 10, 20]
+    assert all(r["$limit"] == "10" and r["$order"] == ":id" for r in server.requests)
+    assert server.requests[0]["$select"].startswith(":updated_at,")
+    assert "crash_date >= '2026-09-30'" in server.requests[0]["$where"]
+
+    assert [row[0] for row in database.merged] == [
+        int(row["collision_id"]) for i, row in enumerate(rows) if i != 3
+    ]
+    # the newest :updated_at of everything read, skipped rows included, without the Z
+    assert database.watermark == max(row[":updated_at"] for row in rows).rstrip("Z")
+    assert (database.refreshed, database.followed) == (1, 0)
+
+
+def test_later_syncs_ask_only_past_the_watermark(crashes, database):
+    database.watermark = "2026-10-01T00:00:00.000"
+    with fakes.SocrataServer(updated_rows(crashes, 5), page_latency_ms=0) as server:
+        run(server)
+    assert server.requests[0]["$where"].endswith(":updated_at > '2026-10-01T00:00:00.000'")
+    assert len(server.requests) == 1  # a short first page is the last
+
+
+def test_full_last_page_asks_once_more(crashes, database):
+    with fakes.SocrataServer(updated_rows(crashes, 20), page_latency_ms=0) as server:
+        run(server)
+    assert [int(r["$offset"]) for r in server.requests] == [0, 10, 20]
+
+
+def test_nothing_new_keeps_the_watermark_and_follows(database):
+    database.watermark = "2026-10-05T00:00:00.000"
+    with fakes.SocrataServer([], page_latency_ms=0) as server:
+        assert run(server) == 0
+    assert database.watermark == "2026-10-05T00:00:00.000"
+    assert (database.refreshed, database.followed) == (0, 1)
+
+
+def test_watermark_moved_during_the_download_skips_the_merge(crashes, database):
+    database.watermark = "2026-10-01T00:00:00.000"
+
+    def another_process_syncs():
+        database.watermark = "2026-10-09T23:00:00.000"
+
+    database.on_row = another_process_syncs
+    with fakes.SocrataServer(updated_rows(crashes, 12), page_latency_ms=0) as server:
+        assert run(server) == 0
+    assert database.merged == []
+    assert database.watermark == "2026-10-09T23:00:00.000"
+    assert (database.refreshed, database.followed) == (0, 1)
+
+
+def test_failed_merge_leaves_the_watermark(crashes, database):
+    database.watermark = "2026-10-01T00:00:00.000"
+    database.fail_merge = True
+    with fakes.SocrataServer(updated_rows(crashes, 12), page_latency_ms=0) as server:
+        with pytest.raises(RuntimeError):
+            run(server)
+    assert database.watermark == "2026-10-01T00:00:00.000"
+    assert database.merged == [] and not database.locked
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(3)
+    return rng.uniform(40.5, 40.9, 40), rng.uniform(-74.2, -73.7, 40)
+
+
+def test_haversine_many_matches_euc_distance(points):
+    lats, lngs = points
+    expected = [utils.euc_distance(40.75, -73.98, lat, lng) for lat, lng in zip(lats, lngs)]
+    np.testing.assert_allclose(utils.haversine_many(40.75, -73.98, lats, lngs), expected, rtol=1e-12)
+
+
+def test_haversine_many_same_point_is_zero():
+    assert utils.haversine_many(40.75, -73.98, [40.75], [-73.98])[0] == 0.0
+
+
+def test_haversine_pairwise_matches_euc_distance(points):
+    lats, lngs = points
+    expected = [
+        [utils.euc_distance(lat1, lng1, lat2, lng2) for lat2, lng2 in zip(lats[25:], lngs[25:])]
+        for lat1, lng1 in zip(lats[:25], lngs[:25])
+    ]
+    np.testing.assert_allclose(
+        utils.haversine_pairwise(lats[:25], lngs[:25], lats[25:], lngs[25:]), expected, rtol=1e-12
+    )
+
+
+def test_haversine_blocked_matches_pairwise(points):
+    lats, lngs = points
+    full = utils.haversine_pairwise(lats, lngs, lats, lngs)
+    blocks = np.full_like(full, np.nan)
+    for rows, block in utils.haversine_blocked(lats, lngs, lats, lngs, block_size=7):
+        blocks[rows] = block
+    np.testing.assert_array_equal(blocks, full)
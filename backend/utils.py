@@ -1,4 +1,9 @@
+import fcntl
 import math
+import os
+from contextlib import contextmanager
+from datetime import date, timedelta
+import numpy as np
 import constants as const
 
 
@@ -19,3 +24,65 @@ def euc_distance(lat1: float, lng1: float, lat2: float, lng2: float):  # utils?
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
 
     return R * c
+
+
+def haversine_many(lat: float, lng: float, lats, lngs):
+    """Distances (km) from one point to many; same formula as euc_distance"""
+    lat1_rad = np.radians(lat)
+    lat2_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lat2_rad - lat1_rad
+    dlng = np.radians(np.asarray(lngs, dtype=np.float64)) - np.radians(lng)
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlng / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return const.R * c
+
+
+def haversine_pairwise(lats1, lngs1, lats2, lngs2):
+    """(n, m) matrix of distances (km) between every point of set 1 and set 2"""
+    lat1_rad = np.radians(np.asarray(lats1, dtype=np.float64))[:, None]
+    lng1_rad = np.radians(np.asarray(lngs1, dtype=np.float64))[:, None]
+    lat2_rad = np.radians(np.asarray(lats2, dtype=np.float64))[None, :]
+    lng2_rad = np.radians(np.asarray(lngs2, dtype=np.float64))[None, :]
+
+    dlat = lat2_rad - lat1_rad
+    dlng = lng2_rad - lng1_rad
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlng / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return const.R * c
+
+
+def haversine_blocked(lats1, lngs1, lats2, lngs2, block_size=1024):
+    """
+    Pairwise distances in row blocks so memory stays at block_size x m
+
+    Yields:
+        (row slice into set 1, distance block of shape (rows, m))
+    """
+    lats1 = np.asarray(lats1, dtype=np.float64)
+    lngs1 = np.asarray(lngs1, dtype=np.float64)
+    for start in range(0, len(lats1), block_size):
+        rows = slice(start, min(start + block_size, len(lats1)))
+        yield rows, haversine_pairwise(lats1[rows], lngs1[rows], lats2, lngs2)
+
+
+def window_start(days_back):
+    """First crash_date inside a days_back window, or None for all history"""
+    if days_back is None:
+        return None
+    return date.today() - timedelta(days=int(days_back))
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive cross-process lock (flock) on path, created if missing"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)